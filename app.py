@@ -1,15 +1,40 @@
 import os
-import csv
-from flask import Flask, request, jsonify, send_from_directory, render_template, session, redirect, url_for
+from flask import Flask, Response, g, request, jsonify, send_from_directory, render_template, session, redirect, url_for, stream_with_context
 from flask_cors import CORS
-from models import db, Product, User
+from models import db, Product, ProductTombstone, User, CatalogState, CategoryFacet, ImageJob, ImageIssue, ImageReconcileState, ImportJob, ImportJobError
+import catalog_export
+import catalog_restore
+import csv_import
+import facets
+import image_reconcile
+import image_store
+from product_validation import validate_columns, validate_product_data
+from background import PeriodicTask
+from upload_storage import UploadIndex, is_content_name, variant_name
+from image_jobs import ImageJobQueue, ImageTooLarge, QueueFull
+from search import PythonSearch, create_search_engine, normalize
+from cache import Cache, MemoryBackend, create_cache
+from migrations import run_migrations
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import get_input_stream
+from werkzeug.security import safe_join
+from werkzeug.exceptions import HTTPException, NotFound
+from flask.sessions import SecureCookieSessionInterface
 from PIL import Image
 import secrets
-from datetime import timedelta
+import base64
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
 import logging
 import urllib.parse
-from sqlalchemy import text
+import csv
+import io
+import itertools
+import threading
+import time
+import zipfile
+from sqlalchemy import text, func, or_, and_, select, update, insert
 
 # Configuração de logging
 logging.basicConfig(level=logging.INFO)
@@ -41,12 +66,67 @@ def get_database_uri():
         logger.info(f"🔍 Usando SQLite: {sqlite_path}")
         return sqlite_path
 
+class UploadAwareSessionInterface(SecureCookieSessionInterface):
+    """Não regrava o cookie de sessão nas respostas de /uploads.
+
+    Com sessões permanentes o Flask renova o cookie a cada requisição; em
+    imagens isso gera Set-Cookie e Vary: Cookie, e nenhum cache as guarda.
+    """
+    
+    def save_session(self, app, session, response):
+        if request.endpoint == 'uploaded_file':
+            return
+        super().save_session(app, session, response)
+
+app.session_interface = UploadAwareSessionInterface()
+
 app.config["SQLALCHEMY_DATABASE_URI"] = get_database_uri()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = os.path.join(basedir, 'uploads')
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 16)) * 1024 * 1024
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'sua-chave-secreta-muito-longa-aqui-12345')
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
+app.config['UPLOAD_INDEX_RESCAN_INTERVAL'] = int(os.environ.get('UPLOAD_INDEX_RESCAN_INTERVAL', 10))
+# auto | sqlite-fts5 | postgres-tsvector | python
+app.config['SEARCH_BACKEND'] = os.environ.get('SEARCH_BACKEND', 'auto')
+# memory (por processo) | sqlite (compartilhado entre os workers)
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'sqlite')
+# Junto do banco, numa pasta do app (não no /tmp, onde qualquer usuário cria arquivos)
+app.config['CACHE_PATH'] = os.environ.get('CACHE_PATH', os.path.join(basedir, 'catalogo-cache.sqlite3'))
+app.config['CACHE_MAX_ENTRIES'] = int(os.environ.get('CACHE_MAX_ENTRIES', 5000))
+app.config['CACHE_DEFAULT_TTL'] = int(os.environ.get('CACHE_DEFAULT_TTL', 300))
+# Usuário logado (admin_required, /api/user, /api/profile) em cache; as alterações
+# pela API invalidam na hora (tag user:<id>), o TTL cobre scripts que mexem direto no banco.
+# Só com o cache compartilhado (sqlite); com memory o usuário vem sempre do banco
+app.config['PRINCIPAL_CACHE_TTL'] = int(os.environ.get('PRINCIPAL_CACHE_TTL', 30))
+app.config['PRODUCT_FRAGMENT_CACHE_SIZE'] = int(os.environ.get('PRODUCT_FRAGMENT_CACHE_SIZE', 200000))
+# Primeira página de produtos e categorias embutidas no HTML da vitrine
+app.config['STOREFRONT_SSR'] = os.environ.get('STOREFRONT_SSR', 'true').lower() in ('1', 'true', 'yes')
+app.config['STOREFRONT_PAGE_SIZE'] = int(os.environ.get('STOREFRONT_PAGE_SIZE', 24))
+# Processos para imagens por worker (0 = na própria requisição) e limite de jobs pendentes
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 2))
+app.config['IMAGE_QUEUE_MAX'] = int(os.environ.get('IMAGE_QUEUE_MAX', 16))
+app.config['IMAGE_JOB_TIMEOUT'] = int(os.environ.get('IMAGE_JOB_TIMEOUT', 300))  # segundos
+# Pixels decodificados por imagem (JPEGs grandes são decodificados já reduzidos e raramente chegam perto)
+app.config['IMAGE_MAX_MEGAPIXELS'] = int(os.environ.get('IMAGE_MAX_MEGAPIXELS', 24))
+# Upload em lote: limite de arquivos, tamanho de cada imagem (também dentro do ZIP) e espera máxima
+app.config['IMAGE_BATCH_MAX_FILES'] = int(os.environ.get('IMAGE_BATCH_MAX_FILES', 200))
+app.config['IMAGE_BATCH_MAX_FILE_MB'] = int(os.environ.get('IMAGE_BATCH_MAX_FILE_MB', 25))
+app.config['IMAGE_BATCH_TIMEOUT'] = int(os.environ.get('IMAGE_BATCH_TIMEOUT', 100))  # abaixo do timeout do gunicorn
+# Importação de CSV: produtos gravados (e commit) por lote
+app.config['CSV_IMPORT_CHUNK_SIZE'] = int(os.environ.get('CSV_IMPORT_CHUNK_SIZE', 1000))
+# Chave natural padrão da importação com atualização (?mode=upsert): sku ou name_category
+app.config['CSV_UPSERT_KEY'] = os.environ.get('CSV_UPSERT_KEY', 'sku')
+# Restauração de backup (/api/admin/restore): tamanho máximo do corpo, já compactado
+app.config['RESTORE_MAX_MB'] = int(os.environ.get('RESTORE_MAX_MB', 256))
+# ... e do backup depois de descompactado (o gzip de um JSON chega a 10-20x)
+app.config['RESTORE_MAX_UNCOMPRESSED_MB'] = int(os.environ.get('RESTORE_MAX_UNCOMPRESSED_MB', 2048))
+# Arquivos das importações em andamento (pasta oculta: fora do índice de uploads e da reconciliação)
+app.config['IMPORT_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], '.imports')
+# Reconciliação de imagens ausentes/órfãs em segundo plano (0 desliga)
+app.config['IMAGE_RECONCILE_INTERVAL'] = int(os.environ.get('IMAGE_RECONCILE_INTERVAL', 900))  # segundos
+app.config['IMAGE_RECONCILE_FULL_HOURS'] = int(os.environ.get('IMAGE_RECONCILE_FULL_HOURS', 24))
+app.config['IMAGE_ORPHAN_GRACE_HOURS'] = int(os.environ.get('IMAGE_ORPHAN_GRACE_HOURS', 24))
 
 # 🔥 CORS CONFIGURADO CORRETAMENTE PARA RENDER
 CORS(app, 
@@ -57,15 +137,44 @@ CORS(app,
         "http://127.0.0.1:5000"
     ],
     methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization"]
+    allow_headers=["Content-Type", "Authorization"],
+    expose_headers=["X-Total-Count", "X-Next-Page-Token", "Link"]
 )
 
 # Criar diretórios necessários
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs('static/images', exist_ok=True)
 
+# Índice dos arquivos de upload, evita um os.path.exists por produto
+upload_index = UploadIndex(app.config['UPLOAD_FOLDER'], app.config['UPLOAD_INDEX_RESCAN_INTERVAL'])
+upload_index.build()
+
+# Fila de processamento de imagens (pool de processos por worker)
+image_queue = ImageJobQueue(
+    app.config['UPLOAD_FOLDER'],
+    max_workers=app.config['IMAGE_WORKERS'],
+    max_pending=app.config['IMAGE_QUEUE_MAX'],
+    max_pixels=app.config['IMAGE_MAX_MEGAPIXELS'] * 1_000_000
+)
+
+# Mecanismo de busca; substituído em setup_database conforme o banco
+search_engine = PythonSearch(db, lambda: get_catalog_state()[0])
+
 db.init_app(app)
 
+# Cache compartilhado (usado também por optimize.py)
+cache = create_cache(
+    app.config['CACHE_BACKEND'],
+    path=app.config['CACHE_PATH'],
+    max_entries=app.config['CACHE_MAX_ENTRIES'],
+    default_ttl=app.config['CACHE_DEFAULT_TTL']
+)
+if not cache.shared:
+    logger.warning("⚠️ Cache por processo: usuário logado lido do banco a cada requisição")
+
+# JSON já codificado de cada produto, por worker, chave (id, updated_at, imagem existe)
+product_fragments = Cache(MemoryBackend(max_entries=app.config['PRODUCT_FRAGMENT_CACHE_SIZE']), default_ttl=0)
+
 # ===== MIDDLEWARES DE SEGURANÇA =====
 @app.after_request
 def after_request(response):
@@ -84,14 +193,30 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def get_principal(user_id):
+    """Usuário logado (User.to_dict) do cache compartilhado, ou do banco; None se não existe.
+
+    A entrada leva a tag user:<id>, invalidada por promote/demote/toggle e
+    update_profile: desativar ou rebaixar vale já na requisição seguinte.
+    Com cache por processo (memória) a invalidação não chegaria aos outros
+    workers, então o usuário é sempre lido do banco.
+    """
+    def load():
+        user = db.session.get(User, user_id)
+        return user.to_dict() if user else None
+    if not cache.shared:
+        return load()
+    return cache.get_or_set(f'principal:{user_id}', load,
+                            ttl=app.config['PRINCIPAL_CACHE_TTL'], tags=(f'user:{user_id}',))
+
 def admin_required(f):
     from functools import wraps
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return jsonify({"error": "Login requerido"}), 401
-        user = db.session.get(User, session['user_id'])
-        if not user or not user.is_admin:
+        principal = get_principal(session['user_id'])
+        if not principal or not principal['is_admin'] or not principal['is_active']:
             return jsonify({"error": "Acesso admin requerido"}), 403
         return f(*args, **kwargs)
     return decorated_function
@@ -135,8 +260,7 @@ def check_image_exists(image_url):
     if not cleaned_url:
         return False
     
-    image_path = os.path.join(app.config['UPLOAD_FOLDER'], cleaned_url)
-    return os.path.exists(image_path)
+    return cleaned_url in upload_index
 
 def get_default_image_url():
     """Retorna URL para imagem padrão quando a imagem não existe"""
@@ -159,7 +283,9 @@ def fix_existing_image_urls():
                     logger.info(f"🔄 URL corrigida: {original_url} -> {cleaned_url}")
         
         if fixed_count > 0:
+            bump_catalog_version()
             db.session.commit()
+            cache.invalidate_tags('products')
             logger.info(f"✅ {fixed_count} URLs de imagem corrigidas no banco de dados")
         
         return fixed_count
@@ -167,105 +293,394 @@ def fix_existing_image_urls():
         logger.error(f"❌ Erro ao corrigir URLs: {e}")
         return 0
 
-def validate_product_data(data):
-    """Valida dados do produto"""
-    errors = []
+def sku_in_use(sku, product_id=None):
+    """Outro produto já usa o SKU? (índice único ux_product_sku)"""
+    if not sku:
+        return False
+    query = select(Product.id).where(Product.sku == sku)
+    if product_id is not None:
+        query = query.where(Product.id != product_id)
+    return db.session.execute(query.limit(1)).first() is not None
+
+# ===== VERSÃO DO CATÁLOGO (ETAG / 304) =====
+CATALOG_STATE_ID = 1
+
+def get_catalog_state():
+    """Retorna (versão, data da última alteração) do catálogo, lida uma vez por requisição"""
+    if 'catalog_state' not in g:
+        row = db.session.execute(
+            select(CatalogState.version, CatalogState.updated_at).where(CatalogState.id == CATALOG_STATE_ID)
+        ).first()
+        g.catalog_state = (row.version, row.updated_at) if row else (0, None)
+    return g.catalog_state
+
+def bump_catalog_version():
+    """Incrementa a versão do catálogo na transação atual (chamar antes do commit)"""
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(CatalogState)
+        .where(CatalogState.id == CATALOG_STATE_ID)
+        .values(version=CatalogState.version + 1, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.session.add(CatalogState(id=CATALOG_STATE_ID, version=1, updated_at=now))
+    g.pop('catalog_state', None)
+
+def catalog_etag(*parts):
+    """ETag forte derivada da versão do catálogo e dos parâmetros da resposta"""
+    version, _ = get_catalog_state()
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:16]
+    return f"c{version}-{digest}"
+
+def not_modified(etag, last_modified=None):
+    """Retorna uma resposta 304 se o cliente já tem a versão atual, senão None"""
+    if last_modified is not None:
+        last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+    
+    if request.if_none_match:
+        # If-None-Match tem precedência sobre If-Modified-Since
+        fresh = request.if_none_match.contains(etag)
+    elif request.if_modified_since and last_modified is not None:
+        fresh = last_modified <= request.if_modified_since
+    else:
+        fresh = False
+    
+    if not fresh:
+        return None
+    return set_cache_validators(Response(status=304), etag, last_modified)
+
+def set_cache_validators(response, etag, last_modified=None):
+    """Adiciona ETag/Last-Modified e força revalidação no navegador"""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# ===== SERIALIZAÇÃO DE PRODUTOS =====
+# Colunas suficientes para ordenar, paginar e localizar o fragmento em cache
+PRODUCT_LIST_COLUMNS = (Product.id, Product.created_at, Product.updated_at, Product.image_url)
+
+def image_srcset(image_url, variants):
+    """srcset por tipo de imagem a partir dos derivados, ou None se não houver"""
+    if not variants:
+        return None
+    srcset = {}
+    for mime_type, ext in (('image/webp', 'webp'), ('image/jpeg', 'jpg')):
+        candidates = [(width, variant_name(image_url, width, ext)) for width, variant_ext in variants if variant_ext == ext]
+        srcset[mime_type] = candidates
+    # A base JPEG tem a largura do maior WebP (gerado sempre no tamanho da base)
+    if srcset['image/webp']:
+        srcset['image/jpeg'].append((srcset['image/webp'][-1][0], image_url))
+    return {
+        mime_type: ', '.join(f"/uploads/{name} {width}w" for width, name in candidates)
+        for mime_type, candidates in srcset.items() if candidates
+    }
+
+def product_response_dict(product):
+    """Produto com URL de imagem limpa e os campos image_exists/image_url_display/image_srcset"""
+    product_dict = product.to_dict()
+    image_url = clean_image_url(product_dict.get('image_url'))
+    if product_dict.get('image_url'):
+        product_dict['image_url'] = image_url
     
-    if not data.get('name') or not data['name'].strip():
-        errors.append("Nome é obrigatório")
+    product_dict['image_exists'] = bool(image_url) and image_url in upload_index
+    product_dict['image_url_display'] = f"/uploads/{image_url}" if product_dict['image_exists'] else get_default_image_url()
+    product_dict['image_srcset'] = image_srcset(image_url, upload_index.variants(image_url)) if product_dict['image_exists'] else None
+    return product_dict
+
+def encode_json(value):
+    """Codifica como o jsonify do Flask (chaves ordenadas, sem espaços)"""
+    return json.dumps(value, ensure_ascii=True, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+def product_fragment_key(row, upload_names, upload_variants):
+    product_id, _, updated_at, image_url = row
+    image_url = clean_image_url(image_url)
+    image_exists = bool(image_url) and image_url in upload_names
+    return (product_id, updated_at, image_exists, upload_variants.get(image_url) if image_exists else None)
+
+def product_json_fragments(rows):
+    """JSON de cada linha, do cache; só produtos novos/alterados são serializados"""
+    upload_names, upload_variants = upload_index.snapshot()
+    keys = [product_fragment_key(row, upload_names, upload_variants) for row in rows]
+    cached = product_fragments.get_many(keys)
+    fragments = {key[0]: fragment for key, fragment in cached.items()}
+    missing_ids = [key[0] for key in keys if key not in cached]
+    
+    for start in range(0, len(missing_ids), 500):
+        for product in Product.query.filter(Product.id.in_(missing_ids[start:start + 500])):
+            fragment = encode_json(product_response_dict(product))
+            fragments[product.id] = fragment
+            product_fragments.set(product_fragment_key(
+                (product.id, product.created_at, product.updated_at, product.image_url), upload_names, upload_variants
+            ), fragment)
     
+    return [fragments[key[0]] for key in keys if key[0] in fragments]
+
+def product_list_response(rows):
+    """Resposta JSON da lista montada pela concatenação dos fragmentos"""
+    body = b'[' + b','.join(product_json_fragments(rows)) + b']'
+    return Response(body, mimetype='application/json')
+
+def category_facet_list():
+    return [facet.to_dict() for facet in CategoryFacet.query.order_by(CategoryFacet.category)]
+
+# ===== PAGINAÇÃO DE PRODUTOS =====
+PRODUCTS_PAGE_SIZE = 50
+PRODUCTS_MAX_PAGE_SIZE = 200
+PRODUCT_COUNT_CACHE_TTL = 30  # segundos
+SEARCH_ROWS_PER_QUERY = 500
+
+def encode_page_token(cursor):
+    """Gera o token opaco da próxima página a partir do cursor (dict)"""
+    payload = json.dumps(cursor, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_page_token(token):
+    """Decodifica o token de página. Levanta ValueError se for inválido"""
     try:
-        price = float(data.get('price', 0))
-        if price <= 0:
-            errors.append("Preço deve ser maior que zero")
-    except (ValueError, TypeError):
-        errors.append("Preço deve ser um número válido")
+        padded = token + '=' * (-len(token) % 4)
+        cursor = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if not isinstance(cursor, dict):
+            raise ValueError
+        return cursor
+    except Exception:
+        raise ValueError("Token de página inválido")
+
+def search_product_ids(search, category=None, limit=None):
+    """IDs dos produtos que casam com a pesquisa (e a categoria), em ordem de relevância"""
+    return search_engine.search(search, limit, category if category != 'all' else None)
+
+def build_products_query(category=None):
+    """Monta a consulta de produtos com o filtro opcional de categoria"""
+    query = Product.query
     
-    if len(data.get('name', '')) > 100:
-        errors.append("Nome deve ter no máximo 100 caracteres")
+    if category and category != 'all':
+        query = query.filter(Product.category == category)
     
-    if len(data.get('category', '')) > 50:
-        errors.append("Categoria deve ter no máximo 50 caracteres")
+    return query
+
+def count_products(category=None, search=None):
+    """Conta os produtos do filtro (pesquisa sem limite de resultados), com cache curto"""
+    version, _ = get_catalog_state()
+    key = 'products:count:' + json.dumps([version, category or 'all', search or ''])
     
-    return errors
+    def count():
+        if search:
+            return search_engine.count(search, category if category != 'all' else None)
+        return build_products_query(category).with_entities(func.count(Product.id)).scalar()
+    return cache.get_or_set(key, count, ttl=PRODUCT_COUNT_CACHE_TTL, tags=('products',))
 
-def process_image(file):
+def parse_page_limit(value):
+    """Valida o parâmetro limit. Levanta ValueError se for inválido"""
+    if value is None or value == '':
+        return PRODUCTS_PAGE_SIZE
     try:
-        image = Image.open(file)
-        # Otimizar imagem
-        image.thumbnail((800, 800), Image.Resampling.LANCZOS)
-        
-        # Converter para RGB se necessário
-        if image.mode in ('RGBA', 'P'):
-            image = image.convert('RGB')
-        
-        filename = secrets.token_hex(8) + '_' + secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        # Salvar com qualidade otimizada
-        image.save(filepath, 'JPEG', quality=85, optimize=True)
-        return filename
-    except Exception as e:
-        logger.error(f"Erro ao processar imagem: {str(e)}")
-        raise Exception(f"Erro ao processar imagem: {str(e)}")
+        limit = int(value)
+    except (ValueError, TypeError):
+        raise ValueError("Parâmetro 'limit' deve ser um número inteiro")
+    if limit < 1:
+        raise ValueError("Parâmetro 'limit' deve ser maior que zero")
+    return min(limit, PRODUCTS_MAX_PAGE_SIZE)
+
+# ===== VITRINE RENDERIZADA NO SERVIDOR =====
+def storefront_initial_data(page_size):
+    """JSON com a primeira página de produtos e as categorias, para embutir no HTML"""
+    rows = db.session.execute(
+        select(*PRODUCT_LIST_COLUMNS)
+        .order_by(Product.created_at.desc(), Product.id.desc())
+        .limit(page_size + 1)
+    ).all()
+    next_token = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_token = encode_page_token({'c': rows[-1].created_at.isoformat(), 'i': rows[-1].id})
+    
+    body = (
+        b'{"categories":' + encode_json(category_facet_list()) +
+        b',"next_page_token":' + encode_json(next_token) +
+        b',"products":[' + b','.join(product_json_fragments(rows)) + b']}'
+    )
+    # Com ensure_ascii só "<" pode fechar a tag <script> antes da hora
+    return body.decode('ascii').replace('<', '\\u003c')
 
-def process_csv(file):
+def render_storefront():
+    """HTML da vitrine, em cache por versão do catálogo"""
+    _, last_modified = get_catalog_state()
+    etag = catalog_etag('storefront', app.config['STOREFRONT_PAGE_SIZE'])
+    cached_response = not_modified(etag, last_modified)
+    if cached_response:
+        return cached_response
+    
+    html = cache.get_or_set(
+        f"storefront:{etag}",
+        lambda: render_template(
+            'index.html', initial_data=storefront_initial_data(app.config['STOREFRONT_PAGE_SIZE'])
+        ),
+        tags=('products',)
+    )
+    return set_cache_validators(Response(html, mimetype='text/html'), etag, last_modified)
+
+def process_image(file):
+    """Grava o upload em staging e enfileira o processamento.
+
+    Retorna (ImageJob, repetida): repetida é True quando um original
+    idêntico já estava processado e nada foi enfileirado.
+    """
+    job, future = enqueue_image(file.filename, file.save)
+    return job, future is None
+
+def enqueue_image(original_name, save, wait=0):
+    """Grava o original em staging com save(caminho) e enfileira o job.
+
+    Se um original idêntico já foi processado e o arquivo existe, o job já
+    nasce concluído, sem reprocessar. Retorna (ImageJob, Future do
+    processamento ou None se não houve processamento).
+    """
+    job_id = secrets.token_hex(16)
+    staging_path = image_queue.staging_path(job_id)
     try:
-        csv_content = file.stream.read().decode('utf-8').splitlines()
-        csv_reader = csv.DictReader(csv_content)
-        
-        products_created = 0
-        errors = []
-        
-        for row_num, row in enumerate(csv_reader, start=2):
+        save(staging_path)
+    except Exception:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+        raise
+    source_hash = image_store.file_sha256(staging_path)
+    
+    existing = image_store.find_by_source(db.session, source_hash)
+    if existing and existing in upload_index:
+        os.remove(staging_path)
+        now = datetime.utcnow()
+        job = ImageJob(id=job_id, original_name=original_name, source_hash=source_hash, filename=existing,
+                       status='done', created_at=now, started_at=now, finished_at=now, queue_ms=0, processing_ms=0)
+        db.session.add(job)
+        db.session.commit()
+        return job, None
+    
+    job = ImageJob(id=job_id, original_name=original_name, source_hash=source_hash)
+    db.session.add(job)
+    db.session.commit()
+    
+    try:
+        future = image_queue.submit(job_id, finish_image_job, wait=wait)
+    except Exception:
+        try:
+            os.remove(staging_path)
+        except FileNotFoundError:
+            pass
+        db.session.delete(job)
+        db.session.commit()
+        raise
+    return job, future
+
+def finish_image_job(job_id, result, error):
+    """Callback do pool: registra o resultado do job no banco"""
+    with app.app_context():
+        job = db.session.get(ImageJob, job_id)
+        if job is None:
+            return
+        if error is None:
+            job.filename = result['filename']
+            for name in result['variants'] + [job.filename]:
+                upload_index.add(name)
+            image_store.register(db.session, job.filename, job.source_hash, result['size_bytes'])
+            job.status = 'done'
+            job.started_at = datetime.utcfromtimestamp(result['started_at'])
+            job.finished_at = datetime.utcfromtimestamp(result['finished_at'])
+            job.queue_ms = max(int((job.started_at - job.created_at).total_seconds() * 1000), 0)
+            job.processing_ms = int((result['finished_at'] - result['started_at']) * 1000)
+            # Produto cadastrado antes do fim do job: listas e vitrine em cache precisam mudar
+            referenced = db.session.query(Product.id).filter(Product.image_url == job.filename).first()
+            if referenced:
+                bump_catalog_version()
+        else:
+            logger.error(f"Erro ao processar imagem {job.original_name}: {error}")
+            job.status = 'failed'
+            job.error = str(error) or error.__class__.__name__
+            job.finished_at = datetime.utcnow()
+            referenced = None
+        db.session.commit()
+        if referenced:
+            cache.invalidate_tags('products')
+
+def remove_image_files(image_url):
+    """Apaga a imagem e os derivados do disco e do índice"""
+    for name in upload_index.related_names(image_url):
+        image_path = os.path.join(app.config['UPLOAD_FOLDER'], name)
+        if os.path.exists(image_path):
             try:
-                if 'name' not in row or 'price' not in row:
-                    errors.append(f"Linha {row_num}: Colunas 'name' e 'price' são obrigatórias")
-                    continue
-                
-                # Validar dados
-                validation_errors = validate_product_data(row)
-                if validation_errors:
-                    errors.extend([f"Linha {row_num}: {error}" for error in validation_errors])
-                    continue
-                
-                # Limpar URL da imagem se existir
-                image_url = clean_image_url(str(row.get('image_url', '')).strip())
-                
-                product = Product(
-                    name=str(row['name']).strip(),
-                    description=str(row.get('description', '')).strip(),
-                    price=float(row['price']),
-                    category=str(row.get('category', '')).strip(),
-                    image_url=image_url
-                )
-                db.session.add(product)
-                products_created += 1
-                
+                os.remove(image_path)
             except Exception as e:
-                errors.append(f"Linha {row_num}: {str(e)}")
-                continue
-        
-        if products_created > 0:
-            db.session.commit()
-        
-        result_message = f"{products_created} produtos importados com sucesso"
-        if errors:
-            result_message += f". {len(errors)} erros encontrados: " + "; ".join(errors[:5])
-            if len(errors) > 5:
-                result_message += f" e mais {len(errors) - 5} erros..."
-        
-        return result_message
-        
+                logger.warning(f"Erro ao remover imagem: {str(e)}")
+        upload_index.discard(name)
+
+def expire_image_job(job):
+    """Marca como falho um job pendente há mais que IMAGE_JOB_TIMEOUT (worker reiniciado etc.)"""
+    if job.status == 'queued' and job.created_at < datetime.utcnow() - timedelta(seconds=app.config['IMAGE_JOB_TIMEOUT']):
+        job.status = 'failed'
+        job.error = 'Tempo esgotado'
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+    return job
+
+def process_csv(file, mode='insert', key='sku', dry_run=False):
+    """Importa produtos de um CSV em lotes; retorna (mensagem, relatório da importação)"""
+    def chunk_committed(report):
+        # Cada lote já está visível: listas e vitrine em cache precisam mudar
+        cache.invalidate_tags('products')
+        logger.info(f"📥 Importação CSV: lote {len(report['chunks'])} gravado, "
+                    f"{report['created']} produtos ({report['rows_read']} linhas lidas)")
+    
+    try:
+        report = csv_import.import_csv(
+            db.session, file.stream, validate_columns, clean_image_url,
+            chunk_size=app.config['CSV_IMPORT_CHUNK_SIZE'],
+            before_commit=lambda chunk, report: bump_catalog_version() if chunk['rows'] else None,
+            after_commit=chunk_committed, mode=mode, key=key, dry_run=dry_run
+        )
     except Exception as e:
+        db.session.rollback()
         logger.error(f"Erro ao processar CSV: {str(e)}")
         raise Exception(f"Erro ao processar CSV: {str(e)}")
+    
+    summary = import_summary(report)
+    result_message = f"{summary} (simulação, nada foi gravado)" if dry_run else summary
+    if report['status'] == 'failed':
+        result_message = f"Importação interrompida ({report['error']}). {summary}"
+    if report['error_count']:
+        result_message += f". {report['error_count']} erros encontrados: " + "; ".join(report['errors'][:5])
+        if report['error_count'] > 5:
+            result_message += f" e mais {report['error_count'] - 5} erros..."
+    
+    return result_message, report
+
+def import_summary(report):
+    if report['mode'] == 'upsert':
+        return (f"{report['created']} produtos criados, {report['updated']} atualizados, "
+                f"{report['unchanged']} sem alteração")
+    return f"{report['created']} produtos importados com sucesso"
+
+def import_options(args):
+    """Modo e chave da importação de CSV a partir da query string. Levanta ValueError"""
+    mode = args.get('mode', 'insert')
+    key = args.get('key', app.config['CSV_UPSERT_KEY'])
+    if mode not in csv_import.IMPORT_MODES:
+        raise ValueError(f"Parâmetro 'mode' deve ser um de: {', '.join(csv_import.IMPORT_MODES)}")
+    if key not in csv_import.NATURAL_KEYS:
+        raise ValueError(f"Parâmetro 'key' deve ser um de: {', '.join(csv_import.NATURAL_KEYS)}")
+    return {'mode': mode, 'key': key}
 
 # ===== SOLUÇÃO 1: ROTA RAIZ ACEITANDO POST PARA WEBHOOK =====
 @app.route('/', methods=['GET', 'POST'])
 def catalog_page():
     if request.method == 'GET':
         # Sua lógica atual para exibir o catálogo
+        if app.config['STOREFRONT_SSR']:
+            try:
+                return render_storefront()
+            except Exception as e:
+                logger.error(f"Erro ao renderizar a vitrine: {str(e)}")
         return render_template('index.html')
     else:
         # Processar webhook da Umbler Talk
@@ -360,6 +775,7 @@ def register():
         
         db.session.add(user)
         db.session.commit()
+        cache.invalidate_tags('users')
         
         # Login automático após registro
         session['user_id'] = user.id
@@ -426,12 +842,12 @@ def get_current_user():
     if 'user_id' not in session:
         return jsonify({"user": None})
     
-    user = db.session.get(User, session['user_id'])
-    if not user:
+    principal = get_principal(session['user_id'])
+    if not principal:
         session.clear()
         return jsonify({"user": None})
     
-    return jsonify({"user": user.to_dict()})
+    return jsonify({"user": principal})
 
 # ===== CONFIGURAÇÃO DE SESSÃO PARA RENDER =====
 @app.before_request
@@ -443,8 +859,11 @@ def make_session_permanent():
 @login_required
 def get_profile():
     try:
-        user = db.session.get(User, session['user_id'])
-        return jsonify({"user": user.to_dict()})
+        principal = get_principal(session['user_id'])
+        if not principal:
+            session.clear()
+            return jsonify({"error": "Login requerido"}), 401
+        return jsonify({"user": principal})
     except Exception as e:
         logger.error(f"Erro ao buscar perfil: {str(e)}")
         return jsonify({"error": f"Erro ao buscar perfil: {str(e)}"}), 500
@@ -482,6 +901,7 @@ def update_profile():
             user.set_password(data['password'])
         
         db.session.commit()
+        cache.invalidate_tags('users', f'user:{user.id}')
         logger.info(f"Perfil atualizado: {user.username}")
         return jsonify({"message": "Perfil atualizado com sucesso", "user": user.to_dict()})
         
@@ -526,6 +946,7 @@ def invite_admin():
         
         db.session.add(user)
         db.session.commit()
+        cache.invalidate_tags('users')
         
         logger.info(f"Admin convidado: {username} por {session['username']}")
         
@@ -544,8 +965,12 @@ def invite_admin():
 @admin_required
 def list_users():
     try:
-        users = User.query.order_by(User.created_at.desc()).all()
-        return jsonify([user.to_dict() for user in users])
+        users = cache.get_or_set(
+            'users:list',
+            lambda: [user.to_dict() for user in User.query.order_by(User.created_at.desc()).all()],
+            tags=('users',)
+        )
+        return jsonify(users)
     except Exception as e:
         logger.error(f"Erro ao listar usuários: {str(e)}")
         return jsonify({"error": f"Erro ao listar usuários: {str(e)}"}), 500
@@ -564,6 +989,7 @@ def promote_user(user_id):
         
         user.is_admin = True
         db.session.commit()
+        cache.invalidate_tags('users', f'user:{user.id}')
         
         logger.info(f"Usuário promovido a admin: {user.username} por {session['username']}")
         return jsonify({"message": f"Usuário {user.username} promovido a administrador"})
@@ -591,6 +1017,7 @@ def demote_user(user_id):
         
         user.is_admin = False
         db.session.commit()
+        cache.invalidate_tags('users', f'user:{user.id}')
         
         logger.info(f"Admin rebaixado: {user.username} por {session['username']}")
         return jsonify({"message": f"Administrador {user.username} rebaixado para usuário comum"})
@@ -620,6 +1047,7 @@ def toggle_user(user_id):
         
         user.is_active = not user.is_active
         db.session.commit()
+        cache.invalidate_tags('users', f'user:{user.id}')
         
         status = "ativado" if user.is_active else "desativado"
         logger.info(f"Usuário {status}: {user.username} por {session['username']}")
@@ -637,8 +1065,8 @@ def admin_page():
     if 'user_id' not in session:
         return redirect('/login')
     
-    user = db.session.get(User, session['user_id'])
-    if not user or not user.is_admin or not user.is_active:
+    principal = get_principal(session['user_id'])
+    if not principal or not principal['is_admin'] or not principal['is_active']:
         return redirect('/login')
     
     return render_template('admin.html')
@@ -651,37 +1079,80 @@ def get_products():
         category = request.args.get('category')
         search = request.args.get('search')
         
-        query = Product.query
+        # ?all=1 mantém a resposta completa, sem paginação, para clientes antigos
+        unpaginated = request.args.get('all', '').lower() in ('1', 'true', 'yes')
         
-        if category and category != 'all':
-            query = query.filter(Product.category == category)
+        # Responde 304 sem consultar produtos se o catálogo não mudou
+        _, last_modified = get_catalog_state()
+        etag = catalog_etag('products', sorted(request.args.items(multi=True)))
+        cached_response = not_modified(etag, last_modified)
+        if cached_response:
+            return cached_response
         
-        if search:
-            query = query.filter(Product.name.contains(search))
+        next_token = None
         
-        products = query.order_by(Product.created_at.desc()).all()
+        try:
+            limit = None if unpaginated else parse_page_limit(request.args.get('limit'))
+            cursor = decode_page_token(request.args['after']) if request.args.get('after') else {}
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        # Aplicar clean_image_url em todos os produtos antes de retornar
-        cleaned_products = []
-        for product in products:
-            product_dict = product.to_dict()
-            if product_dict.get('image_url'):
-                # Verificar se a imagem existe
-                if not check_image_exists(product_dict['image_url']):
-                    product_dict['image_exists'] = False
-                    product_dict['image_url_display'] = get_default_image_url()
-                else:
-                    product_dict['image_exists'] = True
-                    product_dict['image_url_display'] = f"/uploads/{clean_image_url(product_dict['image_url'])}"
-                
-                product_dict['image_url'] = clean_image_url(product_dict['image_url'])
+        if search:
+            # Pesquisa: ordem de relevância, paginação por posição no ranking.
+            # A categoria é filtrada pelo mecanismo de busca, antes do corte da página
+            if limit:
+                try:
+                    offset = max(int(cursor.get('o', 0)), 0)
+                except (TypeError, ValueError):
+                    return jsonify({"error": "Token de página inválido"}), 400
+                # Um a mais para saber se existe próxima página
+                ranked_ids = search_product_ids(search, category, offset + limit + 1)
+                page_ids = ranked_ids[offset:offset + limit]
+                if len(ranked_ids) > offset + limit:
+                    next_token = encode_page_token({'o': offset + limit})
             else:
-                product_dict['image_exists'] = False
-                product_dict['image_url_display'] = get_default_image_url()
+                page_ids = search_product_ids(search, category)
             
-            cleaned_products.append(product_dict)
+            rank = {product_id: position for position, product_id in enumerate(page_ids)}
+            rows = []
+            # ?all=1 traz todos os resultados: IN em partes, abaixo do limite de parâmetros do SQLite
+            for start in range(0, len(page_ids), SEARCH_ROWS_PER_QUERY):
+                rows.extend(db.session.execute(select(*PRODUCT_LIST_COLUMNS).where(
+                    Product.id.in_(page_ids[start:start + SEARCH_ROWS_PER_QUERY])
+                )))
+            rows.sort(key=lambda row: rank[row.id])
+        else:
+            query = build_products_query(category)
+            query = query.with_entities(*PRODUCT_LIST_COLUMNS).order_by(Product.created_at.desc(), Product.id.desc())
+            if limit:
+                if cursor:
+                    try:
+                        after_created_at = datetime.fromisoformat(cursor['c'])
+                        after_id = int(cursor['i'])
+                    except (KeyError, TypeError, ValueError):
+                        return jsonify({"error": "Token de página inválido"}), 400
+                    query = query.filter(or_(
+                        Product.created_at < after_created_at,
+                        and_(Product.created_at == after_created_at, Product.id < after_id)
+                    ))
+                
+                # Busca um item a mais para saber se existe próxima página
+                rows = query.limit(limit + 1).all()
+                if len(rows) > limit:
+                    rows = rows[:limit]
+                    last = rows[-1]
+                    next_token = encode_page_token({'c': last.created_at.isoformat(), 'i': last.id})
+            else:
+                rows = query.all()
         
-        return jsonify(cleaned_products)
+        response = product_list_response(rows)
+        response.headers['X-Total-Count'] = str(count_products(category, search))
+        if next_token:
+            next_args = request.args.to_dict()
+            next_args['after'] = next_token
+            response.headers['X-Next-Page-Token'] = next_token
+            response.headers['Link'] = f'<{url_for("get_products", **next_args)}>; rel="next"'
+        return set_cache_validators(response, etag, last_modified)
         
     except Exception as e:
         logger.error(f"Erro ao buscar produtos: {str(e)}")
@@ -698,6 +1169,10 @@ def create_product():
         if validation_errors:
             return jsonify({"error": "; ".join(validation_errors)}), 400
         
+        sku = (data.get('sku') or '').strip() or None
+        if sku_in_use(sku):
+            return jsonify({"error": "SKU já cadastrado em outro produto"}), 400
+        
         # Limpar URL da imagem se existir
         image_url = clean_image_url(data.get('image_url', '').strip())
         
@@ -706,21 +1181,23 @@ def create_product():
             description=data.get('description', '').strip(),
             price=float(data['price']),
             category=data.get('category', '').strip(),
-            image_url=image_url
+            image_url=image_url,
+            sku=sku
         )
         
         db.session.add(product)
+        db.session.flush()
+        facets.apply_product_change(db.session, new=(product.category, product.price))
+        image_store.acquire(db.session, product.image_url)
+        bump_catalog_version()
         db.session.commit()
+        cache.invalidate_tags('products')
+        search_engine.index_product(product)
         
         logger.info(f"Produto criado: {product.name} por {session['username']}")
         
         # Retornar produto com informações de imagem
-        product_dict = product.to_dict()
-        if product_dict.get('image_url'):
-            product_dict['image_exists'] = check_image_exists(product_dict['image_url'])
-            product_dict['image_url_display'] = f"/uploads/{clean_image_url(product_dict['image_url'])}" if product_dict['image_exists'] else get_default_image_url()
-        
-        return jsonify(product_dict), 201
+        return jsonify(product_response_dict(product)), 201
         
     except Exception as e:
         db.session.rollback()
@@ -730,21 +1207,22 @@ def create_product():
 @app.route('/api/products/<int:product_id>', methods=['GET'])
 def get_product(product_id):
     try:
-        product = db.session.get(Product, product_id)
-        if not product:
+        # ETag do item vem de updated_at, consultado sem carregar o produto
+        row = db.session.execute(select(*PRODUCT_LIST_COLUMNS).where(Product.id == product_id)).first()
+        if not row:
             return jsonify({"error": "Produto não encontrado"}), 404
         
-        product_dict = product.to_dict()
-        # Aplicar clean_image_url antes de retornar
-        if product_dict.get('image_url'):
-            product_dict['image_url'] = clean_image_url(product_dict['image_url'])
-            product_dict['image_exists'] = check_image_exists(product_dict['image_url'])
-            product_dict['image_url_display'] = f"/uploads/{product_dict['image_url']}" if product_dict['image_exists'] else get_default_image_url()
-        else:
-            product_dict['image_exists'] = False
-            product_dict['image_url_display'] = get_default_image_url()
+        last_modified = row.updated_at
+        etag = f"p{product_id}-{last_modified.timestamp() if last_modified else 0}"
+        cached_response = not_modified(etag, last_modified)
+        if cached_response:
+            return cached_response
+        
+        fragments = product_json_fragments([row])
+        if not fragments:
+            return jsonify({"error": "Produto não encontrado"}), 404
         
-        return jsonify(product_dict)
+        return set_cache_validators(Response(fragments[0], mimetype='application/json'), etag, last_modified)
     except Exception as e:
         logger.error(f"Erro ao buscar produto: {str(e)}")
         return jsonify({"error": f"Erro ao buscar produto: {str(e)}"}), 500
@@ -764,30 +1242,36 @@ def update_product(product_id):
         if validation_errors:
             return jsonify({"error": "; ".join(validation_errors)}), 400
         
+        sku = ((data.get('sku') or '').strip() or None) if 'sku' in data else product.sku
+        if sku_in_use(sku, product_id):
+            return jsonify({"error": "SKU já cadastrado em outro produto"}), 400
+        
         # Limpar URL da imagem se existir
         image_url = clean_image_url(data.get('image_url', product.image_url).strip())
+        old_facet = (product.category, product.price)
+        old_image_url = clean_image_url(product.image_url)
         
         product.name = data.get('name', product.name).strip()
         product.description = data.get('description', product.description).strip()
         product.price = float(data.get('price', product.price))
         product.category = data.get('category', product.category).strip()
         product.image_url = image_url
-        
+        product.sku = sku
+        
+        db.session.flush()
+        facets.apply_product_change(db.session, old=old_facet, new=(product.category, product.price))
+        if image_url != old_image_url:
+            # A imagem antiga sem uso fica para a limpeza de órfãos
+            image_store.release(db.session, old_image_url)
+            image_store.acquire(db.session, image_url)
+        bump_catalog_version()
         db.session.commit()
+        cache.invalidate_tags('products')
+        search_engine.index_product(product)
         
         logger.info(f"Produto atualizado: {product.name} por {session['username']}")
         
-        product_dict = product.to_dict()
-        # Aplicar clean_image_url antes de retornar
-        if product_dict.get('image_url'):
-            product_dict['image_url'] = clean_image_url(product_dict['image_url'])
-            product_dict['image_exists'] = check_image_exists(product_dict['image_url'])
-            product_dict['image_url_display'] = f"/uploads/{product_dict['image_url']}" if product_dict['image_exists'] else get_default_image_url()
-        else:
-            product_dict['image_exists'] = False
-            product_dict['image_url_display'] = get_default_image_url()
-        
-        return jsonify(product_dict)
+        return jsonify(product_response_dict(product))
         
     except Exception as e:
         db.session.rollback()
@@ -802,20 +1286,24 @@ def delete_product(product_id):
         if not product:
             return jsonify({"error": "Produto não encontrado"}), 404
         
-        # Remover arquivo de imagem se existir
-        if product.image_url:
-            cleaned_url = clean_image_url(product.image_url)
-            image_path = os.path.join(app.config['UPLOAD_FOLDER'], cleaned_url)
-            if os.path.exists(image_path):
-                try:
-                    os.remove(image_path)
-                except Exception as e:
-                    logger.warning(f"Erro ao remover imagem: {str(e)}")
-        
         product_name = product.name
+        old_facet = (product.category, product.price)
+        image_url = clean_image_url(product.image_url)
         db.session.delete(product)
+        # Registro da exclusão para o backup incremental (/api/admin/export/deletions)
+        db.session.add(ProductTombstone(product_id=product_id))
+        db.session.flush()
+        facets.apply_product_change(db.session, old=old_facet)
+        image_unused = image_store.release(db.session, image_url)
+        bump_catalog_version()
         db.session.commit()
         
+        # Remove o arquivo de imagem (e derivados) só se nenhum outro produto o usa
+        if image_unused:
+            remove_image_files(image_url)
+        cache.invalidate_tags('products')
+        search_engine.remove_product(product_id)
+        
         logger.info(f"Produto deletado: {product_name} por {session['username']}")
         return jsonify({'message': 'Produto deletado com sucesso'})
         
@@ -840,13 +1328,64 @@ def upload_file():
             file_ext = filename.rsplit('.', 1)[1].lower()
             
             if file_ext == 'csv':
-                result_message = process_csv(file)
-                logger.info(f"CSV importado por {session['username']}: {result_message}")
-                return jsonify({'message': result_message})
+                try:
+                    options = import_options(request.args)
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
+                dry_run = request.args.get('dry_run') == '1'
+                sync = dry_run or request.args.get('sync') == '1'
+            
+            if file_ext == 'csv' and not sync:
+                # Importação em segundo plano; o progresso é consultado em status_url
+                job = create_import_job(file, options)
+                logger.info(f"Importação CSV {job.id} enviada por {session['username']}: {file.filename}")
+                response = jsonify({
+                    'job_id': job.id,
+                    'status': job.status,
+                    'status_url': url_for('get_import_job', job_id=job.id),
+                    'message': 'Arquivo recebido, importação em andamento'
+                })
+                response.headers['Location'] = url_for('get_import_job', job_id=job.id)
+                return response, 202
+            elif file_ext == 'csv':
+                # Síncrona: ?sync=1 ou simulação (dry_run=1), que devolve o diff na resposta
+                result_message, report = process_csv(file, dry_run=dry_run, **options)
+                logger.info(f"CSV importado por {session['username']}: {result_message} "
+                            f"({report['rows_per_sec']} linhas/s)")
+                if report['status'] == 'failed':
+                    return jsonify({'error': result_message, 'import': report}), 500
+                return jsonify({'message': result_message, 'import': report})
             else:
-                filename = process_image(file)
-                logger.info(f"Imagem enviada por {session['username']}: {filename}")
-                return jsonify({'filename': filename, 'message': 'Imagem enviada com sucesso'})
+                try:
+                    job, duplicate = process_image(file)
+                except QueueFull as e:
+                    response = jsonify({'error': f'{e}. Tente novamente em instantes'})
+                    response.headers['Retry-After'] = '5'
+                    return response, 503
+                logger.info(f"Imagem enviada por {session['username']}: {file.filename} (job {job.id}, {job.status})")
+                # O nome final (hash do conteúdo) vem no status do job; já vem aqui se a imagem
+                # era repetida ou se o processamento terminou antes da resposta (IMAGE_WORKERS=0)
+                result = {
+                    'filename': job.filename,
+                    'job_id': job.id,
+                    'status': job.status,
+                    'status_url': url_for('get_image_job', job_id=job.id)
+                }
+                if duplicate:
+                    result['message'] = 'Imagem já existente'
+                    status_code = 200
+                elif job.status == 'failed':
+                    result['error'] = job.error
+                    status_code = 422
+                elif job.status == 'done':
+                    result['message'] = 'Imagem processada'
+                    status_code = 201
+                else:
+                    result['message'] = 'Imagem recebida, processamento em andamento'
+                    status_code = 202
+                response = jsonify(result)
+                response.headers['Location'] = url_for('get_image_job', job_id=job.id)
+                return response, status_code
         
         return jsonify({'error': 'Tipo de arquivo não permitido'}), 400
         
@@ -854,17 +1393,705 @@ def upload_file():
         logger.error(f"Erro no upload: {str(e)}")
         return jsonify({'error': f'Erro no upload: {str(e)}'}), 500
 
+@app.route('/api/upload/jobs/<job_id>', methods=['GET'])
+@admin_required
+def get_image_job(job_id):
+    """Status de um job de processamento de imagem"""
+    job = db.session.get(ImageJob, job_id)
+    if job is None:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    return jsonify(expire_image_job(job).to_dict())
+
+@app.route('/api/admin/image-jobs', methods=['GET'])
+@admin_required
+def image_job_stats():
+    """Profundidade da fila e tempos de processamento (deste worker) e jobs recentes"""
+    stats = image_queue.stats()
+    stats['queued'] = ImageJob.query.filter_by(status='queued').count()
+    stats['recent'] = [job.to_dict() for job in ImageJob.query.order_by(ImageJob.created_at.desc()).limit(20)]
+    return jsonify(stats)
+
+# ===== EXPORTAÇÃO DO CATÁLOGO =====
+def parse_since(value):
+    """Data ISO 8601 do parâmetro since, em UTC sem fuso (como updated_at). Levanta ValueError"""
+    since = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return since
+
+def export_since():
+    """(since, resposta de erro) a partir do parâmetro ?since= da exportação"""
+    if not request.args.get('since'):
+        return None, None
+    try:
+        return parse_since(request.args['since']), None
+    except ValueError:
+        return None, (jsonify({'error': "Parâmetro 'since' deve ser uma data ISO 8601"}), 400)
+
+def export_response(body, mimetype, filename, started_at, gzip):
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Export-Started-At': started_at.isoformat(),
+        'Cache-Control': 'no-store'
+    }
+    # Produtos restaurados mantêm o updated_at do backup: um since anterior a isto não os enxerga
+    restored_at = db.session.execute(
+        select(CatalogState.restored_at).where(CatalogState.id == CATALOG_STATE_ID)
+    ).scalar()
+    if restored_at:
+        headers['X-Catalog-Restored-At'] = restored_at.isoformat()
+    if gzip:
+        headers['Content-Encoding'] = 'gzip'
+    return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+
+@app.route('/api/admin/export', methods=['GET'])
+@admin_required
+def export_catalog():
+    """Catálogo completo (ou alterado desde ?since=) em NDJSON, CSV ou JSON, em streaming.
+
+    ?gzip=1 comprime a resposta (Content-Encoding: gzip). X-Export-Started-At
+    é o horário do início da exportação, para usar como since na próxima.
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in catalog_export.EXPORT_FORMATS:
+        return jsonify({'error': f"Parâmetro 'format' deve ser um de: {', '.join(catalog_export.EXPORT_FORMATS)}"}), 400
+    since, error = export_since()
+    if error:
+        return error
+    gzip = request.args.get('gzip') == '1'
+    
+    started_at = datetime.utcnow()
+    logger.info(f"📤 Exportação {fmt} por {session['username']}" + (f" (desde {since.isoformat()})" if since else ""))
+    body = catalog_export.iter_export(db.session, fmt, since=since, gzip=gzip)
+    return export_response(body, catalog_export.EXPORT_FORMATS[fmt],
+                           f'catalogo-{started_at.strftime("%Y%m%d-%H%M%S")}.{fmt}', started_at, gzip)
+
+@app.route('/api/admin/export/deletions', methods=['GET'])
+@admin_required
+def export_deletions():
+    """Produtos excluídos (desde ?since=) em NDJSON: {"id": ..., "deleted_at": ...} por linha.
+
+    Par da exportação com since para o backup incremental; aceita ?gzip=1
+    e devolve X-Export-Started-At do mesmo jeito.
+    """
+    since, error = export_since()
+    if error:
+        return error
+    gzip = request.args.get('gzip') == '1'
+    
+    started_at = datetime.utcnow()
+    body = catalog_export.iter_deletions(db.session, since=since, gzip=gzip)
+    return export_response(body, catalog_export.EXPORT_FORMATS['ndjson'],
+                           f'exclusoes-{started_at.strftime("%Y%m%d-%H%M%S")}.ndjson', started_at, gzip)
+
+@app.route('/api/admin/restore', methods=['POST'])
+@admin_required
+def restore_catalog():
+    """Restaura o catálogo de um backup enviado no corpo (JSON ou NDJSON, gzip opcional).
+
+    Tudo numa transação: com qualquer registro inválido nada muda. ?mode=replace
+    (padrão) deixa o catálogo igual ao backup; ?mode=merge grava por cima pelo
+    id. Ids e datas do backup são mantidos. Um backup vazio no replace é
+    recusado, a não ser com ?allow_empty=1.
+    """
+    mode = request.args.get('mode', 'replace')
+    if mode not in catalog_restore.RESTORE_MODES:
+        return jsonify({'error': f"Parâmetro 'mode' deve ser um de: {', '.join(catalog_restore.RESTORE_MODES)}"}), 400
+    fmt = request.args.get('format') or ('ndjson' if request.mimetype == 'application/x-ndjson' else 'json')
+    if fmt not in catalog_restore.RESTORE_FORMATS:
+        return jsonify({'error': f"Parâmetro 'format' deve ser um de: {', '.join(catalog_restore.RESTORE_FORMATS)}"}), 400
+    
+    stream = get_input_stream(request.environ, max_content_length=app.config['RESTORE_MAX_MB'] * 1024 * 1024)
+    try:
+        report = catalog_restore.restore_catalog(
+            db.session, stream, fmt, mode,
+            max_bytes=app.config['RESTORE_MAX_UNCOMPRESSED_MB'] * 1024 * 1024,
+            allow_empty=request.args.get('allow_empty') == '1'
+        )
+        bump_catalog_version()
+        db.session.execute(
+            update(CatalogState).where(CatalogState.id == CATALOG_STATE_ID).values(restored_at=datetime.utcnow())
+        )
+        db.session.commit()
+    except catalog_restore.RestoreError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e), 'errors': e.errors}), 400
+    except HTTPException:
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Erro ao restaurar backup: {e}")
+        return jsonify({'error': f"Erro ao restaurar backup: {e}"}), 500
+    
+    cache.invalidate_tags('products')
+    logger.info(f"♻️ Backup restaurado por {session['username']} ({mode}): {report['restored']} produtos "
+                f"({report['rows_per_sec']} produtos/s)")
+    return jsonify({'message': f"{report['restored']} produtos restaurados", 'restore': report})
+
+# ===== IMPORTAÇÃO DE CSV EM SEGUNDO PLANO =====
+IMPORT_JOB_LEASE = 60  # segundos; renovado a cada lote gravado
+os.makedirs(app.config['IMPORT_FOLDER'], exist_ok=True)
+
+class ImportJobLost(Exception):
+    """Outro worker assumiu o job (lease vencido); esta execução deve parar"""
+
+def import_job_path(job_id):
+    return os.path.join(app.config['IMPORT_FOLDER'], job_id + '.csv')
+
+def create_import_job(file, options):
+    """Grava o CSV enviado e dispara a importação numa thread deste worker"""
+    job_id = secrets.token_hex(16)
+    path = import_job_path(job_id)
+    file.save(path)
+    job = ImportJob(id=job_id, original_name=file.filename, size_bytes=os.path.getsize(path),
+                    options=json.dumps(options), created_by=session.get('username'))
+    db.session.add(job)
+    db.session.commit()
+    start_import_job(job_id)
+    return job
+
+def start_import_job(job_id):
+    threading.Thread(target=run_import_job, args=(job_id,), name=f'csv-import-{job_id[:8]}', daemon=True).start()
+
+def claim_import_job(job_id):
+    """Assume um job na fila ou abandonado (lease vencido). Retorna o token da execução, ou None"""
+    owner = secrets.token_hex(16)
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        update(ImportJob)
+        .where(ImportJob.id == job_id, ImportJob.status.in_(('queued', 'running')),
+               or_(ImportJob.lease_until.is_(None), ImportJob.lease_until < now))
+        .values(status='running', owner=owner, lease_until=now + timedelta(seconds=IMPORT_JOB_LEASE),
+                attempts=ImportJob.attempts + 1, started_at=func.coalesce(ImportJob.started_at, now),
+                updated_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return owner if claimed else None
+
+def run_import_job(job_id):
+    """Executa ou retoma um job de importação, a partir do fim do último lote gravado"""
+    with app.app_context():
+        owner = claim_import_job(job_id)
+        if owner is None:
+            return
+        job = db.session.get(ImportJob, job_id)
+        options = json.loads(job.options) if job.options else {}
+        resume = None
+        if job.offset:
+            resume = {
+                'offset': job.offset,
+                'line_num': job.line_num,
+                'fieldnames': json.loads(job.fieldnames) if job.fieldnames else None,
+                'rows_read': job.rows_read,
+                'created': job.created_count,
+                'updated': job.updated_count,
+                'unchanged': job.unchanged_count,
+                'error_count': job.error_count,
+                'chunks': job.chunks
+            }
+            logger.info(f"📥 Retomando importação {job_id} na linha {job.line_num + 1} (tentativa {job.attempts})")
+        
+        def chunk_committing(chunk, report):
+            # Progresso, erros e lease do job vão no mesmo commit dos produtos do lote
+            now = datetime.utcnow()
+            updated = db.session.execute(
+                update(ImportJob)
+                .where(ImportJob.id == job_id, ImportJob.owner == owner)
+                .values(offset=chunk['offset'], line_num=chunk['line_num'], fieldnames=json.dumps(report['fieldnames']),
+                        rows_read=report['rows_read'], created_count=report['created'],
+                        updated_count=report['updated'], unchanged_count=report['unchanged'],
+                        error_count=report['error_count'], chunks=chunk['chunk'],
+                        lease_until=now + timedelta(seconds=IMPORT_JOB_LEASE), updated_at=now)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if not updated:
+                raise ImportJobLost(f"Importação {job_id} assumida por outro worker")
+            if chunk['errors']:
+                db.session.execute(insert(ImportJobError.__table__), [
+                    {'job_id': job_id, 'line_num': line_num, 'column': column, 'message': message}
+                    for line_num, column, message in chunk['errors']
+                ])
+            if chunk['rows']:
+                bump_catalog_version()
+        
+        def chunk_committed(report):
+            if report['chunks'][-1]['rows']:
+                cache.invalidate_tags('products')
+        
+        try:
+            with open(import_job_path(job_id), 'rb') as f:
+                report = csv_import.import_csv(
+                    db.session, f, validate_columns, clean_image_url,
+                    chunk_size=app.config['CSV_IMPORT_CHUNK_SIZE'],
+                    before_commit=chunk_committing, after_commit=chunk_committed, resume=resume, **options
+                )
+            status, error = report['status'], report['error']
+        except Exception as e:
+            db.session.rollback()
+            status, error = 'failed', str(e)
+        
+        now = datetime.utcnow()
+        finished = db.session.execute(
+            update(ImportJob)
+            .where(ImportJob.id == job_id, ImportJob.owner == owner)
+            .values(status=status, error=error, lease_until=None, finished_at=now, updated_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if not finished:
+            return
+        try:
+            os.remove(import_job_path(job_id))
+        except FileNotFoundError:
+            pass
+        job = db.session.get(ImportJob, job_id)
+        logger.info(f"📥 Importação {job_id} {status}: {job.created_count} produtos, {job.error_count} erros"
+                    + (f" ({error})" if error else ""))
+
+def resume_stalled_imports():
+    """Retoma os jobs cujo worker parou (reinício, max_requests, OOM) sem terminar"""
+    with app.app_context():
+        job_ids = db.session.execute(
+            select(ImportJob.id).where(
+                ImportJob.status.in_(('queued', 'running')),
+                or_(ImportJob.lease_until.is_(None), ImportJob.lease_until < datetime.utcnow())
+            )
+        ).scalars().all()
+    for job_id in job_ids:
+        run_import_job(job_id)
+
+import_resumer = PeriodicTask('csv-import-resume', resume_stalled_imports, IMPORT_JOB_LEASE, initial_delay=IMPORT_JOB_LEASE)
+
+@app.before_request
+def schedule_import_resume():
+    import_resumer.maybe_start()
+
+@app.route('/api/import/jobs', methods=['GET'])
+@admin_required
+def list_import_jobs():
+    """Importações recentes"""
+    jobs = ImportJob.query.order_by(ImportJob.created_at.desc()).limit(20)
+    return jsonify([job.to_dict() for job in jobs])
+
+@app.route('/api/import/jobs/<job_id>', methods=['GET'])
+@admin_required
+def get_import_job(job_id):
+    """Progresso da importação: linhas lidas, produtos criados, erros e ETA"""
+    job = db.session.get(ImportJob, job_id)
+    if not job:
+        return jsonify({'error': 'Importação não encontrada'}), 404
+    if job.status in ('queued', 'running') and (job.lease_until is None or job.lease_until < datetime.utcnow()):
+        # Worker que executava parou; retoma já em vez de esperar a verificação periódica
+        start_import_job(job_id)
+    result = job.to_dict()
+    result['errors_url'] = url_for('get_import_job_errors', job_id=job_id) if job.error_count else None
+    result['errors'] = [f"Linha {error.line_num}: {error.message}" for error in
+                        ImportJobError.query.filter_by(job_id=job_id).order_by(ImportJobError.line_num).limit(5)]
+    return jsonify(result)
+
+def iter_error_report_csv(batches):
+    """Relatório de erros em CSV (linha, coluna, erro), um pedaço por lote de erros"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(('linha', 'coluna', 'erro'))
+    for batch in batches:
+        writer.writerows((line_num, column or '', message) for line_num, column, message in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+@app.route('/api/import/validate', methods=['POST'])
+@admin_required
+def validate_import():
+    """Valida um CSV sem tocar no banco e devolve o relatório completo de erros.
+
+    Resposta JSON com os totais, erros por coluna e os primeiros erros como
+    {linha, coluna, erro}; com ?format=csv, todos os erros em CSV, em streaming.
+    """
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify({'error': 'Nenhum arquivo enviado'}), 400
+    report = {}
+    errors = csv_import.validate_csv(file.stream, validate_columns, report=report)
+    
+    try:
+        if request.args.get('format') == 'csv':
+            # O cabeçalho é conferido antes de a resposta começar
+            first = next(errors, [])
+            body = iter_error_report_csv(itertools.chain([first], errors))
+            name = os.path.splitext(secure_filename(file.filename) or 'importacao')[0]
+            return Response(stream_with_context(body), mimetype='text/csv', headers={
+                'Content-Disposition': f'attachment; filename="{name}-validacao.csv"'
+            })
+        
+        sample = []
+        for batch in errors:
+            room = csv_import.MAX_REPORTED_ERRORS - len(sample)
+            sample.extend({'line': line_num, 'column': column, 'error': message}
+                          for line_num, column, message in batch[:max(room, 0)])
+    except csv_import.CSVImportError as e:
+        return jsonify({'error': str(e)}), 400
+    report['errors'] = sample
+    return jsonify(report)
+
+@app.route('/api/import/jobs/<job_id>/errors', methods=['GET'])
+@admin_required
+def get_import_job_errors(job_id):
+    """Relatório completo das linhas recusadas, em CSV"""
+    job = db.session.get(ImportJob, job_id)
+    if not job:
+        return jsonify({'error': 'Importação não encontrada'}), 404
+    
+    def generate():
+        rows = db.session.execute(
+            select(ImportJobError.line_num, ImportJobError.column, ImportJobError.message)
+            .where(ImportJobError.job_id == job_id)
+            .order_by(ImportJobError.line_num, ImportJobError.id)
+            .execution_options(yield_per=1000)
+        )
+        yield from iter_error_report_csv(rows.partitions())
+    
+    name = os.path.splitext(secure_filename(job.original_name or '') or 'importacao')[0]
+    return Response(stream_with_context(generate()), mimetype='text/csv', headers={
+        'Content-Disposition': f'attachment; filename="{name}-erros.csv"'
+    })
+
+# ===== RECONCILIAÇÃO DE IMAGENS =====
+IMAGE_RECONCILE_LEASE = 600  # segundos; um worker que morrer no meio libera a vez depois disso
+
+def run_image_reconcile(full=False):
+    """Atualiza o relatório de imagens ausentes/órfãs se nenhum outro worker estiver fazendo isso.
+
+    Retorna o resumo da execução, ou None se outro worker está com o lease.
+    """
+    with app.app_context():
+        if not image_reconcile.claim(db.session, IMAGE_RECONCILE_LEASE):
+            db.session.rollback()
+            return None
+        db.session.commit()
+        try:
+            stats = image_reconcile.reconcile(
+                db.session, app.config['UPLOAD_FOLDER'], clean_image_url, full=full,
+                orphan_grace=app.config['IMAGE_ORPHAN_GRACE_HOURS'] * 3600,
+                full_every=app.config['IMAGE_RECONCILE_FULL_HOURS'] * 3600
+            )
+            image_reconcile.release_claim(db.session)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            image_reconcile.release_claim(db.session, error=str(e))
+            db.session.commit()
+            raise
+        logger.info(f"🖼️ Reconciliação de imagens: {stats}")
+        return stats
+
+image_reconciler = PeriodicTask('image-reconcile', run_image_reconcile, app.config['IMAGE_RECONCILE_INTERVAL'])
+
+@app.before_request
+def schedule_image_reconcile():
+    image_reconciler.maybe_start()
+
+def image_report_state():
+    """Estado do relatório; na primeira consulta (nada reconciliado ainda) executa na hora"""
+    state = db.session.get(ImageReconcileState, image_reconcile.STATE_ID)
+    if state is None or state.last_run_at is None or request.args.get('refresh') == '1':
+        run_image_reconcile()
+        db.session.expire_all()
+        state = db.session.get(ImageReconcileState, image_reconcile.STATE_ID)
+    return state
+
+@app.route('/api/admin/images/report', methods=['GET'])
+@admin_required
+def image_report():
+    """Relatório completo: imagens ausentes e arquivos órfãos (até ?limit= de cada)"""
+    limit = min(request.args.get('limit', 500, type=int), 5000)
+    state = image_report_state()
+    issues = {}
+    for kind in ('missing', 'orphan'):
+        issues[kind] = [issue.to_dict() for issue in
+                        ImageIssue.query.filter_by(kind=kind).order_by(ImageIssue.filename).limit(limit)]
+    return jsonify({
+        'report': state.to_dict() if state else None,
+        'missing': issues['missing'],
+        'orphans': issues['orphan']
+    })
+
+@app.route('/api/admin/images/reconcile', methods=['POST'])
+@admin_required
+def reconcile_images():
+    """Executa a reconciliação agora (?full=1 confere tudo, não só o que mudou)"""
+    try:
+        stats = run_image_reconcile(full=request.args.get('full') == '1')
+    except Exception as e:
+        logger.error(f"Erro na reconciliação de imagens: {e}")
+        return jsonify({"error": f"Erro na reconciliação de imagens: {e}"}), 500
+    if stats is None:
+        return jsonify({"error": "Reconciliação já em andamento"}), 409
+    return jsonify(stats)
+
+@app.route('/api/admin/images/gc', methods=['POST'])
+@admin_required
+def collect_orphan_images():
+    """Apaga os arquivos órfãos do último relatório (?dry_run=1 só lista)"""
+    dry_run = request.args.get('dry_run') == '1'
+    if not image_reconcile.claim(db.session, IMAGE_RECONCILE_LEASE):
+        db.session.rollback()
+        return jsonify({"error": "Reconciliação em andamento, tente de novo"}), 409
+    db.session.commit()
+    try:
+        removed, freed = image_reconcile.collect_orphans(
+            db.session, app.config['UPLOAD_FOLDER'],
+            orphan_grace=app.config['IMAGE_ORPHAN_GRACE_HOURS'] * 3600, dry_run=dry_run
+        )
+        image_reconcile.release_claim(db.session)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        image_reconcile.release_claim(db.session, error=str(e))
+        db.session.commit()
+        logger.error(f"Erro ao remover imagens órfãs: {e}")
+        return jsonify({"error": f"Erro ao remover imagens órfãs: {e}"}), 500
+    
+    for name in removed if not dry_run else ():
+        upload_index.discard(name)
+    if not dry_run:
+        logger.info(f"🗑️ {len(removed)} arquivos órfãos removidos por {session['username']} ({freed} bytes)")
+    return jsonify({
+        'dry_run': dry_run,
+        'removed_count': len(removed),
+        'freed_bytes': freed,
+        'removed': removed
+    })
+
+# ===== UPLOAD DE IMAGENS EM LOTE =====
+IMAGE_EXTENSIONS = ALLOWED_EXTENSIONS - {'csv'}
+BATCH_MATCH_MODES = ('none', 'id', 'name', 'sku')
+
+def file_extension(name):
+    return name.rsplit('.', 1)[1].lower() if '.' in name else ''
+
+def extract_zip_member(archive, member, path, max_bytes):
+    """Copia um membro do ZIP em blocos, sem carregá-lo inteiro na memória"""
+    copied = 0
+    with archive.open(member) as source, open(path, 'wb') as target:
+        for chunk in iter(lambda: source.read(1024 * 1024), b''):
+            copied += len(chunk)
+            if copied > max_bytes:
+                # Tamanho declarado no ZIP não é confiável (zip bomb)
+                raise ValueError("Arquivo muito grande")
+            target.write(chunk)
+
+def iter_batch_images(files, max_bytes):
+    """(nome, save(caminho) ou None, erro) para cada imagem enviada ou dentro de ZIPs.
+
+    O ZIP é lido do arquivo temporário do upload, um membro por vez.
+    """
+    for storage in files:
+        name = storage.filename or ''
+        ext = file_extension(name)
+        if ext == 'zip':
+            try:
+                archive = zipfile.ZipFile(storage.stream)
+            except zipfile.BadZipFile:
+                yield name, None, 'ZIP inválido'
+                continue
+            with archive:
+                for member in archive.infolist():
+                    member_name = os.path.basename(member.filename)
+                    if member.is_dir() or not member_name or member_name.startswith('.') or '__MACOSX' in member.filename:
+                        continue
+                    if file_extension(member_name) not in IMAGE_EXTENSIONS:
+                        yield member.filename, None, 'Tipo de arquivo não permitido'
+                    elif member.file_size > max_bytes:
+                        yield member.filename, None, 'Arquivo muito grande'
+                    else:
+                        yield member.filename, (
+                            lambda path, member=member: extract_zip_member(archive, member, path, max_bytes)
+                        ), None
+        elif ext in IMAGE_EXTENSIONS:
+            yield name, storage.save, None
+        else:
+            yield name, None, 'Tipo de arquivo não permitido'
+
+def match_images_to_products(results, mode):
+    """Associa imagens a produtos pelo nome do arquivo (id, nome ou SKU do produto), numa transação.
+
+    Atualiza results com product_id ou match_error; retorna quantos produtos mudaram.
+    """
+    stems = {key: os.path.splitext(os.path.basename(key))[0].strip() for key, item in results.items()
+             if item.get('filename')}
+    if mode == 'id':
+        candidates = {key: int(stem) for key, stem in stems.items() if stem.isdigit()}
+        products = {product.id: product for product in Product.query.filter(Product.id.in_(set(candidates.values())))}
+        targets = {key: products.get(product_id) for key, product_id in candidates.items()}
+    elif mode == 'sku':
+        products = {product.sku: product for product in Product.query.filter(Product.sku.in_(set(stems.values())))}
+        targets = {key: products.get(stem) for key, stem in stems.items()}
+    else:
+        wanted = {key: normalize(stem.replace('_', ' ').replace('-', ' ')).strip() for key, stem in stems.items()}
+        by_name = {}
+        for product_id, name in db.session.query(Product.id, Product.name):
+            by_name.setdefault(normalize(name).strip(), []).append(product_id)
+        ids = {key: by_name.get(name, []) for key, name in wanted.items()}
+        products = {product.id: product for product in Product.query.filter(
+            Product.id.in_({matches[0] for matches in ids.values() if len(matches) == 1}))}
+        targets = {}
+        for key, matches in ids.items():
+            if len(matches) > 1:
+                results[key]['match_error'] = 'Mais de um produto com este nome'
+            else:
+                targets[key] = products.get(matches[0]) if matches else None
+    
+    changed = 0
+    for key in stems:
+        product = targets.get(key)
+        if product is None:
+            results[key].setdefault('match_error', 'Produto não encontrado')
+            continue
+        filename = results[key]['filename']
+        results[key]['product_id'] = product.id
+        old_image_url = clean_image_url(product.image_url)
+        if old_image_url != filename:
+            product.image_url = filename
+            db.session.flush()
+            image_store.release(db.session, old_image_url)
+            image_store.acquire(db.session, filename)
+            changed += 1
+    
+    if changed:
+        bump_catalog_version()
+    db.session.commit()
+    if changed:
+        cache.invalidate_tags('products')
+    return changed
+
+@app.route('/api/upload/batch', methods=['POST'])
+@admin_required
+def upload_batch():
+    """Várias imagens e/ou ZIPs, processados em paralelo no pool de processos.
+
+    Campo opcional match (none, padrão, | id | name | sku) associa cada imagem
+    a um produto pelo nome do arquivo sem extensão, tudo numa única transação:
+    id compara com o id do produto, name com o nome (sem acentos nem
+    maiúsculas, '_' e '-' valendo espaço) e sku com o SKU, exatamente igual.
+    """
+    files = request.files.getlist('files') or request.files.getlist('file')
+    if not files:
+        return jsonify({'error': 'Nenhum arquivo enviado'}), 400
+    match_mode = request.form.get('match', 'none')
+    if match_mode not in BATCH_MATCH_MODES:
+        return jsonify({'error': f"Parâmetro 'match' deve ser um de: {', '.join(BATCH_MATCH_MODES)}"}), 400
+    
+    deadline = time.monotonic() + app.config['IMAGE_BATCH_TIMEOUT']
+    max_files = app.config['IMAGE_BATCH_MAX_FILES']
+    max_bytes = app.config['IMAGE_BATCH_MAX_FILE_MB'] * 1024 * 1024
+    results = {}
+    pending = {}
+    accepted = 0
+    
+    try:
+        for name, save, error in iter_batch_images(files, max_bytes):
+            key = name
+            suffix = 2
+            while key in results:
+                key = f"{name} ({suffix})"
+                suffix += 1
+            if error is None and accepted >= max_files:
+                error = f'Limite de {max_files} imagens por lote excedido'
+            if error:
+                results[key] = {'status': 'failed', 'error': error}
+                continue
+            try:
+                # Com a fila cheia, espera vaga em vez de recusar (o lote se auto-regula)
+                job, future = enqueue_image(name, save, wait=max(deadline - time.monotonic(), 0))
+            except Exception as e:
+                db.session.rollback()
+                results[key] = {'status': 'failed', 'error': str(e)}
+                continue
+            accepted += 1
+            results[key] = {'status': job.status, 'job_id': job.id, 'filename': job.filename}
+            if future is not None:
+                pending[key] = future
+    except Exception as e:
+        logger.error(f"Erro no upload em lote: {str(e)}")
+        return jsonify({'error': f'Erro no upload em lote: {str(e)}'}), 500
+    
+    for key, future in pending.items():
+        try:
+            result = future.result(timeout=max(deadline - time.monotonic(), 0))
+            results[key].update(status='done', filename=result['filename'])
+        except TimeoutError:
+            # Continua na fila; o status pode ser consultado depois
+            results[key]['status'] = 'queued'
+        except ImageTooLarge as e:
+            results[key].update(status='failed', error=str(e))
+        except Exception as e:
+            logger.error(f"Erro ao processar imagem {key} do lote: {str(e)}")
+            results[key].update(status='failed', error='Não foi possível processar a imagem')
+    
+    matched = 0
+    if match_mode != 'none':
+        try:
+            matched = match_images_to_products(results, match_mode)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Erro ao associar imagens: {str(e)}")
+            return jsonify({'error': f'Erro ao associar imagens: {str(e)}', 'results': results}), 500
+    
+    statuses = [item['status'] for item in results.values()]
+    logger.info(f"Lote de imagens enviado por {session['username']}: {len(results)} arquivos, {matched} produtos atualizados")
+    return jsonify({
+        'results': results,
+        'done': statuses.count('done'),
+        'queued': statuses.count('queued'),
+        'failed': statuses.count('failed'),
+        'matched': matched
+    })
+
 # ===== ROTAS PÚBLICAS DA API =====
 @app.route('/api/categories', methods=['GET'])
 def get_categories():
     try:
-        categories = db.session.query(Product.category).distinct().all()
-        categories_list = [cat[0] for cat in categories if cat[0] and cat[0].strip()]
-        return jsonify(sorted(categories_list))
+        _, last_modified = get_catalog_state()
+        etag = catalog_etag('categories')
+        cached_response = not_modified(etag, last_modified)
+        if cached_response:
+            return cached_response
+        
+        # Lê do agregado materializado: O(categorias), não O(produtos)
+        categories_list = cache.get_or_set(
+            f"categories:{etag}",
+            lambda: [cat[0] for cat in db.session.query(CategoryFacet.category).order_by(CategoryFacet.category)],
+            tags=('products',)
+        )
+        return set_cache_validators(jsonify(categories_list), etag, last_modified)
     except Exception as e:
         logger.error(f"Erro ao buscar categorias: {str(e)}")
         return jsonify({"error": f"Erro ao buscar categorias: {str(e)}"}), 500
 
+@app.route('/api/categories/facets', methods=['GET'])
+def get_category_facets():
+    """Categorias com quantidade de produtos e preço mínimo/máximo/médio"""
+    try:
+        _, last_modified = get_catalog_state()
+        etag = catalog_etag('category-facets')
+        cached_response = not_modified(etag, last_modified)
+        if cached_response:
+            return cached_response
+        
+        facet_list = cache.get_or_set(
+            f"facets:{etag}",
+            category_facet_list,
+            tags=('products',)
+        )
+        return set_cache_validators(jsonify(facet_list), etag, last_modified)
+    except Exception as e:
+        logger.error(f"Erro ao buscar facetas: {str(e)}")
+        return jsonify({"error": f"Erro ao buscar facetas: {str(e)}"}), 500
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     try:
@@ -881,9 +2108,36 @@ def health_check():
     })
 
 # ===== ROTA CORRIGIDA PARA UPLOADS =====
+# Nomes endereçados por conteúdo nunca mudam; os antigos podem ser revalidados após 1 dia
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+LEGACY_UPLOAD_CACHE_CONTROL = 'public, max-age=86400'
+
+_default_image = None
+
+def default_image_response():
+    """Imagem padrão servida da memória (lida de static/ uma única vez por worker)"""
+    global _default_image
+    if _default_image is None:
+        try:
+            with open(os.path.join(basedir, 'static', 'images', 'default-product.png'), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            # Sem o arquivo em static/, usa um placeholder cinza gerado uma vez
+            buffer = io.BytesIO()
+            Image.new('RGB', (300, 200), (233, 236, 239)).save(buffer, 'PNG')
+            data = buffer.getvalue()
+        _default_image = (data, hashlib.sha1(data).hexdigest())
+    
+    data, etag = _default_image
+    response = Response(data, mimetype='image/png')
+    response.set_etag(etag)
+    # A imagem real pode aparecer nesta URL (job em andamento): sempre revalidar
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    """Rota corrigida para servir arquivos uploadados"""
+    """Serve uploads com ETag forte, cache longo, Range e sendfile (wsgi.file_wrapper)"""
     try:
         # Decodificar URL se necessário
         filename = urllib.parse.unquote(filename)
@@ -891,17 +2145,41 @@ def uploaded_file(filename):
         # Aplicar clean_image_url para extrair apenas o nome do arquivo
         cleaned_filename = clean_image_url(filename)
         
-        # Verificar se o arquivo existe
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], cleaned_filename)
-        if not os.path.exists(filepath):
-            logger.warning(f"Arquivo não encontrado: {cleaned_filename} (original: {filename})")
-            # Retornar imagem padrão em vez de 404
-            return send_from_directory('static', 'images/default-product.png')
-        
-        return send_from_directory(app.config['UPLOAD_FOLDER'], cleaned_filename)
+        # Confere no índice; só vai ao disco se o arquivo não estiver lá (outro worker pode tê-lo criado)
+        if cleaned_filename not in upload_index:
+            if not safe_join(app.config['UPLOAD_FOLDER'], cleaned_filename) or not upload_index.refresh(cleaned_filename):
+                logger.debug(f"Arquivo não encontrado: {cleaned_filename} (original: {filename})")
+                # Retornar imagem padrão em vez de 404
+                return default_image_response()
+        
+        # Serve o WebP equivalente quando o navegador aceita
+        webp_filename = upload_index.webp_for(cleaned_filename)
+        served_filename = cleaned_filename
+        if webp_filename and 'image/webp' in request.headers.get('Accept', ''):
+            served_filename = webp_filename
+        
+        if is_content_name(served_filename):
+            # O próprio hash do nome identifica o conteúdo
+            response = send_from_directory(
+                app.config['UPLOAD_FOLDER'], served_filename, etag=os.path.basename(served_filename)
+            )
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response = send_from_directory(app.config['UPLOAD_FOLDER'], served_filename)
+            response.headers['Cache-Control'] = LEGACY_UPLOAD_CACHE_CONTROL
+        if webp_filename:
+            response.headers['Vary'] = 'Accept'
+        return response
+    except NotFound:
+        # Removido entre a consulta ao índice e a leitura
+        upload_index.discard(cleaned_filename)
+        return default_image_response()
+    except HTTPException:
+        # 416 Range Not Satisfiable etc.
+        raise
     except Exception as e:
         logger.error(f"Erro ao servir arquivo {filename}: {str(e)}")
-        return send_from_directory('static', 'images/default-product.png')
+        return default_image_response()
 
 # ===== ROTA PARA CORRIGIR IMAGENS EXISTENTES =====
 @app.route('/api/fix-image-urls', methods=['POST'])
@@ -918,27 +2196,43 @@ def fix_image_urls():
         logger.error(f"Erro ao corrigir URLs: {e}")
         return jsonify({"error": f"Erro ao corrigir URLs: {e}"}), 500
 
+# ===== ROTAS DO CACHE =====
+@app.route('/api/admin/cache', methods=['GET'])
+@admin_required
+def cache_stats():
+    """Estatísticas do cache (hits, misses, evictions) deste worker"""
+    stats = cache.stats()
+    stats['product_fragments'] = product_fragments.stats()
+    return jsonify(stats)
+
+@app.route('/api/admin/cache', methods=['DELETE'])
+@admin_required
+def clear_cache():
+    """Limpa todas as entradas do cache"""
+    cache.clear()
+    product_fragments.clear()
+    logger.info(f"Cache limpo por {session['username']}")
+    return jsonify({"message": "Cache limpo com sucesso"})
+
 # ===== ROTA PARA VERIFICAR IMAGENS AUSENTES =====
 @app.route('/api/admin/missing-images', methods=['GET'])
 @admin_required
 def get_missing_images():
-    """Retorna lista de produtos com imagens ausentes"""
+    """Retorna lista de produtos com imagens ausentes, do relatório da reconciliação (?refresh=1 atualiza antes)"""
     try:
-        products = Product.query.filter(Product.image_url != '').all()
-        missing_images = []
-        
-        for product in products:
-            if product.image_url and not check_image_exists(product.image_url):
-                missing_images.append({
-                    'id': product.id,
-                    'name': product.name,
-                    'image_url': product.image_url,
-                    'cleaned_url': clean_image_url(product.image_url)
-                })
+        state = image_report_state()
+        issues = ImageIssue.query.filter_by(kind='missing').order_by(ImageIssue.product_id).all()
+        missing_images = [{
+            'id': issue.product_id,
+            'name': issue.product_name,
+            'image_url': issue.filename,
+            'cleaned_url': issue.filename
+        } for issue in issues]
         
         return jsonify({
             'missing_count': len(missing_images),
-            'products': missing_images
+            'products': missing_images,
+            'report': state.to_dict() if state else None
         })
     except Exception as e:
         logger.error(f"Erro ao buscar imagens ausentes: {e}")
@@ -954,10 +2248,16 @@ def remove_missing_image(product_id):
         if not product:
             return jsonify({"error": "Produto não encontrado"}), 404
         
-        if product.image_url and not check_image_exists(product.image_url):
+        # Confere o arquivo no disco, o índice pode estar desatualizado
+        if product.image_url and not upload_index.refresh(clean_image_url(product.image_url)):
             old_image_url = product.image_url
             product.image_url = ''
+            db.session.flush()
+            image_store.release(db.session, clean_image_url(old_image_url))
+            ImageIssue.query.filter_by(kind='missing', product_id=product.id).delete()
+            bump_catalog_version()
             db.session.commit()
+            cache.invalidate_tags('products')
             
             logger.info(f"Imagem ausente removida do produto {product.name}: {old_image_url}")
             return jsonify({
@@ -975,11 +2275,28 @@ def remove_missing_image(product_id):
 # ===== INICIALIZAÇÃO DO BANCO =====
 def setup_database():
     """Configura o banco preservando dados existentes"""
+    global search_engine
     with app.app_context():
         try:
             db.create_all()
             logger.info("✅ Banco de dados inicializado!")
             
+            # Índices e alterações de schema em bancos já existentes
+            applied = run_migrations(db.engine)
+            if applied:
+                logger.info(f"🛠️ Migrações aplicadas: {', '.join(applied)}")
+            
+            # Linha de versão do catálogo usada nas ETags
+            if not db.session.get(CatalogState, CATALOG_STATE_ID):
+                db.session.add(CatalogState(id=CATALOG_STATE_ID, version=1))
+                db.session.commit()
+            
+            # Índice de busca (FTS5 / tsvector / memória)
+            search_engine = create_search_engine(
+                db, app.config['SEARCH_BACKEND'], lambda: get_catalog_state()[0]
+            )
+            logger.info(f"🔎 Busca de produtos: {search_engine.name}")
+            
             # Criar usuário admin padrão se não existir
             if User.query.count() == 0:
                 admin_user = User(
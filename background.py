@@ -0,0 +1,45 @@
+# background.py
+"""Tarefas periódicas em threads de fundo, disparadas pelas requisições.
+
+Com preload_app, threads criadas no import morreriam no fork do gunicorn;
+por isso cada worker dispara as suas a partir de um before_request. Quando
+só um worker pode executar por vez, quem decide é um lease no banco, não
+esta classe.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Roda ``run`` numa thread de fundo no máximo a cada ``interval`` segundos (0 desliga)"""
+
+    def __init__(self, name, run, interval, initial_delay=60):
+        self.name = name
+        self.run = run
+        self.interval = interval
+        self._next_run = time.monotonic() + min(interval, initial_delay)
+        self._running = False
+        self._lock = threading.Lock()
+
+    def maybe_start(self):
+        now = time.monotonic()
+        if not self.interval or now < self._next_run:
+            return False
+        with self._lock:
+            if self._running or now < self._next_run:
+                return False
+            self._running = True
+            self._next_run = now + self.interval
+        threading.Thread(target=self._run, name=self.name, daemon=True).start()
+        return True
+
+    def _run(self):
+        try:
+            self.run()
+        except Exception as e:
+            logger.error(f"Erro na tarefa {self.name}: {e}")
+        finally:
+            self._running = False
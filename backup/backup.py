@@ -1,8 +1,21 @@
 import sqlite3
 import csv
+import gzip
+import json
 import os
+import sys
+import tempfile
 from datetime import datetime
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backup_auto import login_admin
+from restaurar_produtos import enviar_backup
+
+# App que recebe a restauração (/api/admin/restore); por padrão o local
+CATALOGO_URL = os.environ.get('CATALOGO_URL', 'http://127.0.0.1:5000')
+BACKUP_COLUMNS = ['id', 'name', 'description', 'price', 'category', 'image_url', 'sku', 'created_at', 'updated_at']
+
 def backup_database():
     """Faz backup dos produtos para CSV antes de atualizar"""
     try:
@@ -18,19 +31,22 @@ def backup_database():
         os.makedirs('backups', exist_ok=True)
         
         # Exportar produtos para CSV
-        cursor.execute('''
-            SELECT name, description, price, category, image_url, created_at 
+        # Com id e datas: a restauração mantém os mesmos produtos
+        cursor.execute(f'''
+            SELECT {', '.join(BACKUP_COLUMNS)}
             FROM product
         ''')
         
-        products = cursor.fetchall()
-        
+        # Linhas gravadas à medida que o cursor avança, sem carregar a tabela inteira
+        total = 0
         with open(backup_file, 'w', newline='', encoding='utf-8') as f:
             writer = csv.writer(f)
-            writer.writerow(['name', 'description', 'price', 'category', 'image_url', 'created_at'])
-            writer.writerows(products)
+            writer.writerow(BACKUP_COLUMNS)
+            for product in cursor:
+                writer.writerow(product)
+                total += 1
         
-        print(f"✅ Backup criado: {backup_file} ({len(products)} produtos)")
+        print(f"✅ Backup criado: {backup_file} ({total} produtos)")
         conn.close()
         return backup_file
         
@@ -50,23 +66,19 @@ def restore_backup():
         latest_backup = sorted(backup_files)[-1]
         backup_path = os.path.join('backups', latest_backup)
         
-        # Restaurar dados
-        conn = sqlite3.connect('catalogo.db')
-        cursor = conn.cursor()
-        
-        with open(backup_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                cursor.execute('''
-                    INSERT OR IGNORE INTO product 
-                    (name, description, price, category, image_url, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (row['name'], row['description'], float(row['price']), 
-                      row['category'], row['image_url'], row['created_at']))
-        
-        conn.commit()
-        conn.close()
-        print(f"✅ Backup restaurado: {latest_backup}")
+        # Restaurar dados: CSV convertido em NDJSON e enviado de uma vez para o
+        # /api/admin/restore, que grava tudo numa transação (ou nada)
+        with tempfile.TemporaryDirectory() as tmp:
+            ndjson_path = os.path.join(tmp, 'restore.ndjson.gz')
+            with open(backup_path, 'r', newline='', encoding='utf-8') as f, \
+                    gzip.open(ndjson_path, 'wt', encoding='utf-8') as out:
+                for row in csv.DictReader(f):
+                    # Vazio no CSV é ausente no backup (backups antigos não têm id nem sku)
+                    out.write(json.dumps({key: value for key, value in row.items() if value != ''}, ensure_ascii=False) + '\n')
+            
+            # merge: produtos do backup gravados por cima pelo id; os criados depois ficam
+            resultado = enviar_backup(login_admin(CATALOGO_URL), CATALOGO_URL, ndjson_path, mode='merge')
+        print(f"✅ Backup restaurado: {latest_backup} ({resultado['restored']} produtos)")
         
     except Exception as e:
         print(f"❌ Erro na restauração: {e}")
@@ -1,8 +1,130 @@
 import os
+import getpass
+import gzip
 import requests
 import csv
 import json
-from datetime import datetime
+import shlex
+from datetime import datetime, timedelta
+
+# Backup incremental: backups/incremental/<data da base>/ com base.ndjson.gz,
+# delta_<data>.ndjson.gz e manifest.json
+INCREMENTAL_DIR = 'incremental'
+# O updated_at é gravado antes do commit: uma margem no since pega escritas
+# que ainda estavam em andamento na exportação anterior (repetir é inofensivo)
+WATERMARK_OVERLAP = timedelta(minutes=5)
+# Depois de tantos deltas a próxima execução começa uma cadeia nova (base completa)
+MAX_DELTAS = 30
+
+def login_admin(render_url):
+    """Sessão HTTP autenticada como admin (a exportação exige login).
+
+    Usa CATALOGO_USERNAME / CATALOGO_PASSWORD se definidas; senão pergunta.
+    """
+    sessao = requests.Session()
+    username = os.environ.get('CATALOGO_USERNAME') or input("Usuário admin: ").strip()
+    password = os.environ.get('CATALOGO_PASSWORD') or getpass.getpass("Senha: ")
+    response = sessao.post(f"{render_url}/api/login", json={'username': username, 'password': password}, timeout=30)
+    if response.status_code != 200:
+        raise Exception(f"Login falhou: {response.json().get('error', response.status_code)}")
+    return sessao
+
+def baixar_exportacao(sessao, render_url, csv_file, json_file, info, since=None):
+    """Baixa /api/admin/export em NDJSON (gzip) e grava CSV e JSON linha a linha.
+
+    Nem o servidor nem o script montam a lista inteira na memória. O JSON
+    mantém o formato dos backups anteriores (info + products + total_products).
+    Retorna (total de produtos, X-Export-Started-At).
+    """
+    params = {'format': 'ndjson', 'gzip': '1'}
+    if since:
+        params['since'] = since
+    with sessao.get(f"{render_url}/api/admin/export", params=params, stream=True, timeout=(30, 300)) as response:
+        if response.status_code != 200:
+            raise Exception(f"Erro API: {response.status_code}")
+        
+        total = 0
+        with open(csv_file, 'w', newline='', encoding='utf-8') as f_csv, \
+                open(json_file, 'w', encoding='utf-8') as f_json:
+            header = json.dumps(info, indent=2, ensure_ascii=False)[:-2]
+            f_json.write(header + ',\n  "products": [')
+            writer = None
+            # requests descompacta o gzip; cada linha é um produto
+            for line in response.iter_lines(chunk_size=64 * 1024):
+                if not line:
+                    continue
+                product = json.loads(line)
+                if writer is None:
+                    writer = csv.DictWriter(f_csv, fieldnames=product.keys())
+                    writer.writeheader()
+                writer.writerow(product)
+                f_json.write((',' if total else '') + '\n    ' + json.dumps(product, ensure_ascii=False))
+                total += 1
+            f_json.write(f'\n  ],\n  "total_products": {total}\n}}\n')
+        return total, response.headers.get('X-Export-Started-At')
+
+def _linhas_ndjson(sessao, url, params):
+    """Resposta NDJSON (gzip) aberta e os objetos dela, um por vez"""
+    response = sessao.get(url, params={**params, 'gzip': '1'}, stream=True, timeout=(30, 300))
+    if response.status_code != 200:
+        response.close()
+        raise Exception(f"Erro API: {response.status_code}")
+    def registros():
+        with response:
+            for line in response.iter_lines(chunk_size=64 * 1024):
+                if line:
+                    yield json.loads(line)
+    return response, registros()
+
+def baixar_delta(sessao, render_url, arquivo, since=None):
+    """Grava em arquivo (NDJSON gzip) os produtos alterados desde since e as exclusões.
+
+    Sem since é uma base: o catálogo inteiro, sem exclusões. As exclusões vêm
+    como {"id": ..., "deleted_at": ..., "deleted": true}. O arquivo só aparece
+    com o nome final quando completo. Retorna (produtos, exclusões, watermark),
+    onde watermark é o início da exportação, o since do próximo delta, ou None
+    se o catálogo foi restaurado de um backup depois de since: os produtos
+    restaurados mantêm o updated_at antigo e só uma base nova os pega.
+    """
+    params = {'format': 'ndjson'}
+    if since:
+        params['since'] = since
+    response, registros = _linhas_ndjson(sessao, f"{render_url}/api/admin/export", params)
+    restaurado = response.headers.get('X-Catalog-Restored-At')
+    if since and restaurado and datetime.fromisoformat(restaurado) >= datetime.fromisoformat(since):
+        response.close()
+        return None
+    
+    produtos = exclusoes = 0
+    parcial = arquivo + '.part'
+    with gzip.open(parcial, 'wt', encoding='utf-8') as f:
+        for product in registros:
+            f.write(json.dumps(product, ensure_ascii=False) + '\n')
+            produtos += 1
+        if since:
+            _, registros = _linhas_ndjson(sessao, f"{render_url}/api/admin/export/deletions", {'since': since})
+            for deletion in registros:
+                f.write(json.dumps({**deletion, 'deleted': True}) + '\n')
+                exclusoes += 1
+    os.replace(parcial, arquivo)
+    return produtos, exclusoes, response.headers.get('X-Export-Started-At')
+
+def aplicar_delta(produtos, arquivo):
+    """Aplica um arquivo da cadeia (base ou delta) ao dicionário {id: produto}.
+
+    Uma exclusão só remove o produto se ele não foi gravado depois dela (o id
+    pode ter sido reaproveitado, e a margem do since repete exclusões).
+    """
+    with gzip.open(arquivo, 'rt', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if not record.get('deleted'):
+                produtos[record['id']] = record
+                continue
+            atual = produtos.get(record['id'])
+            if atual and datetime.fromisoformat(atual['updated_at']) <= datetime.fromisoformat(record['deleted_at']):
+                del produtos[record['id']]
+    return produtos
 
 class BackupManager:
     def __init__(self):
@@ -14,44 +136,116 @@ class BackupManager:
         """Faz backup dos produtos do Render"""
         try:
             print("🔗 Conectando ao Render...")
-            response = requests.get(f"{self.render_url}/api/products", timeout=30)
+            sessao = login_admin(self.render_url)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            csv_file = f'{self.backup_dir}/produtos_{timestamp}.csv'
+            json_file = f'{self.backup_dir}/backup_{timestamp}.json'
             
-            if response.status_code == 200:
-                products = response.json()
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                
-                # CSV
-                csv_file = f'{self.backup_dir}/produtos_{timestamp}.csv'
-                if products:
-                    with open(csv_file, 'w', newline='', encoding='utf-8') as f:
-                        writer = csv.DictWriter(f, fieldnames=products[0].keys())
-                        writer.writeheader()
-                        writer.writerows(products)
-                
-                # JSON
-                json_file = f'{self.backup_dir}/backup_{timestamp}.json'
-                backup_data = {
-                    'backup_date': timestamp,
-                    'total_products': len(products),
-                    'render_url': self.render_url,
-                    'products': products
-                }
-                
-                with open(json_file, 'w', encoding='utf-8') as f:
-                    json.dump(backup_data, f, indent=2, ensure_ascii=False)
-                
-                print(f"✅ BACKUP REALIZADO: {len(products)} produtos")
-                print(f"📁 Arquivos: {csv_file}, {json_file}")
+            total, _ = baixar_exportacao(sessao, self.render_url, csv_file, json_file, {
+                'backup_date': timestamp,
+                'render_url': self.render_url
+            })
+            
+            print(f"✅ BACKUP REALIZADO: {total} produtos")
+            print(f"📁 Arquivos: {csv_file}, {json_file}")
+            
+            return total
                 
-                return len(products)
-            else:
-                print(f"❌ Erro API: {response.status_code}")
-                return 0
+        except Exception as e:
+            print(f"❌ Erro: {e}")
+            return 0
+    
+    def cadeia_atual(self):
+        """Diretório da cadeia incremental mais recente (ou None)"""
+        raiz = os.path.join(self.backup_dir, INCREMENTAL_DIR)
+        cadeias = sorted(os.listdir(raiz)) if os.path.isdir(raiz) else []
+        # Cadeia sem manifesto: a base não chegou a terminar
+        cadeias = [nome for nome in cadeias if os.path.exists(os.path.join(raiz, nome, 'manifest.json'))]
+        return os.path.join(raiz, cadeias[-1]) if cadeias else None
+    
+    def fazer_backup_incremental(self, completo=False):
+        """Baixa só o que mudou desde o último backup (ou uma base nova).
+
+        Retorna quantos registros foram gravados (produtos e exclusões); 0 se
+        nada mudou ou se deu erro.
+        """
+        try:
+            print("🔗 Conectando ao Render...")
+            sessao = login_admin(self.render_url)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            cadeia = self.cadeia_atual()
+            manifest = None
+            if cadeia and not completo:
+                with open(os.path.join(cadeia, 'manifest.json'), encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if len(manifest['deltas']) >= MAX_DELTAS:
+                    manifest = None
+            
+            if manifest is not None:
+                since = (datetime.fromisoformat(manifest['watermark']) - WATERMARK_OVERLAP).isoformat()
+                arquivo = f'delta_{timestamp}.ndjson.gz'
+                delta = baixar_delta(sessao, self.render_url, os.path.join(cadeia, arquivo), since)
+                if delta is None:
+                    print("♻️ Catálogo restaurado desde o último backup: começando uma base nova")
+                    manifest = None
+                else:
+                    total, exclusoes, watermark = delta
+                    manifest['deltas'].append({'file': arquivo, 'backup_date': timestamp, 'since': since,
+                                               'products': total, 'deleted': exclusoes})
+                    manifest['watermark'] = watermark
+                    print(f"✅ BACKUP INCREMENTAL: {total} produtos alterados, {exclusoes} exclusões")
+                    total += exclusoes
+            
+            if manifest is None:
+                cadeia = os.path.join(self.backup_dir, INCREMENTAL_DIR, timestamp)
+                os.makedirs(cadeia, exist_ok=True)
+                total, _, watermark = baixar_delta(sessao, self.render_url, os.path.join(cadeia, 'base.ndjson.gz'))
+                manifest = {'render_url': self.render_url, 'base_date': timestamp, 'base_products': total,
+                            'watermark': watermark, 'deltas': []}
+                print(f"✅ BASE COMPLETA: {total} produtos")
+            
+            # Manifesto por último: um delta interrompido não avança o watermark
+            parcial = os.path.join(cadeia, 'manifest.json.part')
+            with open(parcial, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2, ensure_ascii=False)
+            os.replace(parcial, os.path.join(cadeia, 'manifest.json'))
+            print(f"📁 Cadeia: {cadeia} ({len(manifest['deltas'])} deltas)")
+            return total
                 
         except Exception as e:
             print(f"❌ Erro: {e}")
             return 0
     
+    def reconstruir_backup(self, cadeia=None):
+        """Reaplica base + deltas e grava um backup completo (backup_<data>_incremental.json).
+
+        O arquivo tem o mesmo formato dos backups completos, para o
+        restaurar_produtos.py. Retorna o caminho do arquivo (ou None).
+        """
+        cadeia = cadeia or self.cadeia_atual()
+        if not cadeia:
+            print("❌ Nenhum backup incremental encontrado")
+            return None
+        with open(os.path.join(cadeia, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+        
+        produtos = aplicar_delta({}, os.path.join(cadeia, 'base.ndjson.gz'))
+        for delta in manifest['deltas']:
+            aplicar_delta(produtos, os.path.join(cadeia, delta['file']))
+        
+        ultimo = manifest['deltas'][-1]['backup_date'] if manifest['deltas'] else manifest['base_date']
+        json_file = f'{self.backup_dir}/backup_{ultimo}_incremental.json'
+        with open(json_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                'backup_date': ultimo,
+                'render_url': manifest['render_url'],
+                'products': [produtos[product_id] for product_id in sorted(produtos)],
+                'total_products': len(produtos)
+            }, f, indent=2, ensure_ascii=False)
+        print(f"✅ Catálogo reconstruído: {len(produtos)} produtos (base + {len(manifest['deltas'])} deltas)")
+        print(f"📁 Arquivo: {json_file}")
+        return json_file
+    
     def listar_backups(self):
         """Lista backups disponíveis"""
         if not os.path.exists(self.backup_dir):
@@ -63,11 +257,13 @@ class BackupManager:
             if file.startswith('backup_') and file.endswith('.json'):
                 backups.append(file)
         
-        if not backups:
+        cadeia = self.cadeia_atual()
+        if not backups and not cadeia:
             print("📋 Nenhum backup encontrado")
             return
         
-        print("📋 BACKUPS DISPONÍVEIS:")
+        if backups:
+            print("📋 BACKUPS DISPONÍVEIS:")
         for backup in sorted(backups, reverse=True)[:10]:
             file_path = os.path.join(self.backup_dir, backup)
             with open(file_path, 'r', encoding='utf-8') as f:
@@ -76,13 +272,20 @@ class BackupManager:
                 print(f"      📅 {data['backup_date']} | 🛍️  {data['total_products']} produtos")
                 print(f"      🌐 {data['render_url']}")
                 print()
+        
+        if cadeia:
+            with open(os.path.join(cadeia, 'manifest.json'), encoding='utf-8') as f:
+                manifest = json.load(f)
+            print(f"🧩 INCREMENTAL: base {manifest['base_date']} ({manifest['base_products']} produtos)"
+                  f" + {len(manifest['deltas'])} deltas, até {manifest['watermark']}")
     
-    def upload_github(self):
-        """Faz upload para GitHub"""
+    def upload_github(self, caminho=None):
+        """Faz upload para GitHub (só de ``caminho``, se dado; senão da pasta de backups)"""
         try:
-            # Verificar se há backups novos
-            os.system('git add backups/')
-            os.system(f'git commit -m "Backup automático: {datetime.now().strftime("%d/%m/%Y %H:%M")}"')
+            # Com caminho, o commit leva só ele (nada mais que esteja no índice)
+            pathspec = f' -- {shlex.quote(caminho)}' if caminho else ''
+            os.system(f'git add {shlex.quote(caminho or self.backup_dir)}')
+            os.system(f'git commit -m "Backup automático: {datetime.now().strftime("%d/%m/%Y %H:%M")}"{pathspec}')
             os.system('git push origin main')
             print("✅ Backup enviado para GitHub")
         except Exception as e:
@@ -100,8 +303,11 @@ if __name__ == '__main__':
     print("2. Listar backups")
     print("3. Backup + Upload GitHub")
     print("4. Verificar status do Render")
+    print("5. Backup incremental")
+    print("6. Backup incremental + Upload GitHub")
+    print("7. Reconstruir backup completo do incremental")
     
-    opcao = input("Escolha (1-4): ").strip()
+    opcao = input("Escolha (1-7): ").strip()
     
     if opcao == "1":
         backup.fazer_backup_render()
@@ -121,5 +327,14 @@ if __name__ == '__main__':
                 print("❌ Render com problemas")
         except:
             print("❌ Não foi possível conectar ao Render")
+    elif opcao == "5":
+        backup.fazer_backup_incremental()
+    elif opcao == "6":
+        # Commit só da cadeia: o repositório cresce pelo que mudou, não pelo catálogo inteiro
+        count = backup.fazer_backup_incremental()
+        if count > 0:
+            backup.upload_github(backup.cadeia_atual())
+    elif opcao == "7":
+        backup.reconstruir_backup()
     else:
         print("❌ Opção inválida")
\ No newline at end of file
@@ -1,9 +1,9 @@
 import os
-import requests
 import csv
-import json
 from datetime import datetime
 
+from backup_auto import baixar_exportacao, login_admin
+
 def backup_from_render():
     """Faz backup dos produtos da API do Render"""
     try:
@@ -12,54 +12,33 @@ def backup_from_render():
         
         print(f"🔗 Conectando à API: {render_url}")
         
-        # Buscar produtos da API
-        response = requests.get(f"{render_url}/api/products")
+        sessao = login_admin(render_url)
+        
+        # Criar backup
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        os.makedirs('backups', exist_ok=True)
+        csv_file = f'backups/produtos_render_{timestamp}.csv'
+        json_file = f'backups/backup_render_{timestamp}.json'
+        
+        # Exportação em streaming: produtos gravados à medida que chegam
+        total, _ = baixar_exportacao(sessao, render_url, csv_file, json_file, {
+            'backup_date': timestamp,
+            'source': 'render_api'
+        })
         
-        if response.status_code == 200:
-            products = response.json()
-            print(f"✅ {len(products)} produtos encontrados na API")
-            
-            # Criar backup
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            os.makedirs('backups', exist_ok=True)
-            
-            # Backup CSV
-            csv_file = f'backups/produtos_render_{timestamp}.csv'
-            with open(csv_file, 'w', newline='', encoding='utf-8') as f:
-                if products:
-                    columns = products[0].keys()
-                    writer = csv.DictWriter(f, fieldnames=columns)
-                    writer.writeheader()
-                    writer.writerows(products)
-            
-            # Backup JSON
-            json_file = f'backups/backup_render_{timestamp}.json'
-            backup_data = {
-                'backup_date': timestamp,
-                'source': 'render_api',
-                'total_products': len(products),
-                'products': products
-            }
-            
-            with open(json_file, 'w', encoding='utf-8') as f:
-                json.dump(backup_data, f, indent=2, ensure_ascii=False)
-            
-            print("🎉 BACKUP DO RENDER CRIADO!")
-            print(f"📊 Produtos: {len(products)}")
-            print(f"📁 CSV: {csv_file}")
-            print(f"📁 JSON: {json_file}")
-            
-            # Mostrar alguns produtos
-            print("\n📦 AMOSTRA DE PRODUTOS:")
-            for i, product in enumerate(products[:3]):
+        print("🎉 BACKUP DO RENDER CRIADO!")
+        print(f"📊 Produtos: {total}")
+        print(f"📁 CSV: {csv_file}")
+        print(f"📁 JSON: {json_file}")
+        
+        # Mostrar alguns produtos
+        print("\n📦 AMOSTRA DE PRODUTOS:")
+        with open(csv_file, newline='', encoding='utf-8') as f:
+            for i, product in zip(range(3), csv.DictReader(f)):
                 print(f"   {i+1}. {product.get('name', 'N/A')} - R$ {product.get('price', 'N/A')}")
-            
-            return len(products)
-            
-        else:
-            print(f"❌ Erro na API: {response.status_code}")
-            return 0
-            
+        
+        return total
+        
     except Exception as e:
         print(f"❌ Erro: {e}")
         return 0
@@ -0,0 +1,116 @@
+# benchmarks/bench_csv_import.py
+"""Benchmark da importação de produtos por CSV: linhas/s e pico de memória.
+
+Compara o process_csv antigo (arquivo inteiro em memória, um Product do ORM
+por linha, um commit no final) com csv_import.import_csv (streaming, INSERT
+executemany por lote). Cada execução roda num processo novo, com banco
+SQLite temporário, para medir o pico de RSS separadamente.
+
+Uso:
+    python benchmarks/bench_csv_import.py [10000 50000 200000]
+"""
+import csv
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_csv(path, count):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write('name,price,description,category,image_url\n')
+        for i in range(count):
+            f.write(f'Produto {i},{10 + i % 500}.90,"Descrição do produto {i}, com vírgula",Categoria {i % 40},\n')
+
+
+def peak_rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def legacy_import(catalog, stream):
+    """process_csv como era antes da importação em lotes"""
+    csv_content = stream.read().decode('utf-8').splitlines()
+    csv_reader = csv.DictReader(csv_content)
+    created_rows = []
+    created_images = []
+    for row in csv_reader:
+        if catalog.validate_product_data(row):
+            continue
+        image_url = catalog.clean_image_url(str(row.get('image_url', '')).strip())
+        product = catalog.Product(
+            name=str(row['name']).strip(),
+            description=str(row.get('description', '')).strip(),
+            price=float(row['price']),
+            category=str(row.get('category', '')).strip(),
+            image_url=image_url
+        )
+        catalog.db.session.add(product)
+        created_rows.append((product.category, product.price))
+        created_images.append(image_url)
+    catalog.db.session.flush()
+    catalog.facets.add_product_rows(catalog.db.session, created_rows)
+    catalog.image_store.acquire_many(catalog.db.session, created_images)
+    catalog.bump_catalog_version()
+    catalog.db.session.commit()
+    return len(created_rows)
+
+
+def measure(mode, csv_path, workdir, count, queue):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, mode + '.db')}"
+    os.environ['CACHE_BACKEND'] = 'memory'
+    os.environ['IMAGE_RECONCILE_INTERVAL'] = '0'
+    sys.path.insert(0, ROOT)
+    import logging
+    logging.disable(logging.INFO)
+
+    import app as catalog
+    import csv_import
+
+    with catalog.app.app_context():
+        baseline = peak_rss_mb()
+        with open(csv_path, 'rb') as f:
+            # O upload chega como arquivo temporário; BufferedReader equivale ao stream do Werkzeug
+            started = time.perf_counter()
+            if mode == 'antigo':
+                created = legacy_import(catalog, f)
+            else:
+                report = csv_import.import_csv(
+                    catalog.db.session, f, catalog.validate_product_data, catalog.clean_image_url,
+                    chunk_size=int(mode.split('-')[1]), before_commit=lambda chunk, report: catalog.bump_catalog_version()
+                )
+                created = report['created']
+            elapsed = time.perf_counter() - started
+    assert created == count, (mode, created)
+    queue.put((elapsed, peak_rss_mb() - baseline))
+
+
+def main(sizes):
+    context = multiprocessing.get_context('spawn')
+    workdir = tempfile.mkdtemp(prefix='bench-csv-')
+    try:
+        print(f"{'linhas':>8} {'modo':>11} {'tempo':>9} {'linhas/s':>10} {'memória':>9}")
+        for count in sizes:
+            csv_path = os.path.join(workdir, f'{count}.csv')
+            write_csv(csv_path, count)
+            for mode in ('antigo', 'lotes-1000', 'lotes-5000'):
+                queue = context.Queue()
+                process = context.Process(target=measure, args=(mode, csv_path, workdir, count, queue))
+                process.start()
+                elapsed, memory = queue.get()
+                process.join()
+                os.remove(os.path.join(workdir, mode + '.db'))
+                print(f"{count:>8} {mode:>11} {elapsed:>8.2f}s {count / elapsed:>10.0f} {memory:>7.0f}MB")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 50000, 200000])
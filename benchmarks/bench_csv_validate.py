@@ -0,0 +1,114 @@
+# benchmarks/bench_csv_validate.py
+"""Benchmark da validação do CSV de produtos, sem banco: linhas/s.
+
+Compara, sobre o mesmo arquivo (com ~5% de linhas inválidas):
+
+- por linha:   DictReader + validate_product_data + montagem do INSERT, como
+               a importação fazia antes (float() duas vezes por linha)
+- por colunas: read_chunks + prepare_chunk (validate_columns por lote)
+- só validar:  csv_import.validate_csv, o caminho do /api/import/validate
+
+Uso:
+    python benchmarks/bench_csv_validate.py [100000 500000]
+"""
+import csv
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import csv_import
+from product_validation import validate_columns, validate_product_data
+
+CHUNK_SIZE = 1000
+
+
+def write_csv(path, count):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write('sku,name,price,description,category,image_url\n')
+        for i in range(count):
+            price = 'abc' if i % 40 == 0 else ('0' if i % 45 == 0 else f'{10 + i % 500}.90')
+            name = '' if i % 97 == 0 else f'Produto {i}'
+            f.write(f'SKU-{i},{name},{price},"Descrição do produto {i}, com vírgula",Categoria {i % 40},\n')
+
+
+def clean_url(url):
+    return url
+
+
+def per_row(path):
+    """Caminho anterior: um dict por linha, validado e convertido linha a linha"""
+    errors = 0
+    valid = 0
+    now = datetime.utcnow()
+    with open(path, encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            row_errors = validate_product_data(row)
+            if row_errors:
+                errors += len(row_errors)
+                continue
+            {
+                'name': row['name'].strip(),
+                'description': row.get('description', '').strip(),
+                'price': float(row['price']),
+                'category': row.get('category', '').strip(),
+                'image_url': clean_url(row.get('image_url', '').strip()),
+                'sku': row.get('sku', '').strip() or None,
+                'created_at': now,
+                'updated_at': now
+            }
+            valid += 1
+    return valid, errors
+
+
+def columnar(path):
+    errors = 0
+    valid = 0
+    with open(path, 'rb') as f:
+        lines = csv_import._Lines(f)
+        for _, line_nums, columns in csv_import.read_chunks(lines, chunk_size=CHUNK_SIZE):
+            values, _, chunk_errors = csv_import.prepare_chunk(
+                line_nums, columns, validate_columns, clean_url, datetime.utcnow()
+            )
+            valid += len(values)
+            errors += len(chunk_errors)
+    return valid, errors
+
+
+def validate_only(path):
+    report = {}
+    with open(path, 'rb') as f:
+        for _ in csv_import.validate_csv(f, validate_columns, report=report):
+            pass
+    return report['valid_rows'], report['error_count']
+
+
+MODES = {'por linha': per_row, 'por colunas': columnar, 'só validar': validate_only}
+
+
+def main(sizes):
+    workdir = tempfile.mkdtemp(prefix='bench-validate-')
+    try:
+        print(f"{'linhas':>8} {'modo':>12} {'tempo':>9} {'linhas/s':>10} {'válidas':>9} {'erros':>7}")
+        for count in sizes:
+            path = os.path.join(workdir, f'{count}.csv')
+            write_csv(path, count)
+            results = set()
+            for mode, run in MODES.items():
+                started = time.perf_counter()
+                valid, errors = run(path)
+                elapsed = time.perf_counter() - started
+                results.add((valid, errors))
+                print(f"{count:>8} {mode:>12} {elapsed:>8.2f}s {count / elapsed:>10.0f} {valid:>9} {errors:>7}")
+            # Os três caminhos precisam concordar
+            assert len(results) == 1, results
+            os.remove(path)
+    finally:
+        os.rmdir(workdir)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [100000, 500000])
@@ -0,0 +1,115 @@
+# benchmarks/bench_image_decode.py
+"""Benchmark da decodificação de imagens enviadas: pico de memória e tempo.
+
+Para cada tamanho gera um JPEG sintético e processa em um processo novo
+(o pico de RSS é por processo), comparando:
+
+- completo: decodifica a imagem inteira e só então reduz (load + thumbnail)
+- anterior: thumbnail direto, como process_image_file fazia antes do draft
+- draft:    open_reduced (draft + limite de pixels + EXIF) e thumbnail
+- derivados: process_image_file atual, que grava também os
+  derivados JPEG/WebP (o tempo extra é a codificação deles, não a leitura)
+
+Uso:
+    python benchmarks/bench_image_decode.py [2 12 48]   # megapixels
+"""
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+import image_jobs
+
+ASPECT = (4, 3)
+
+
+def make_jpeg(path, megapixels):
+    """JPEG com gradiente e ruído (comprime como uma foto, não como cor sólida)"""
+    unit = (megapixels * 1_000_000 / (ASPECT[0] * ASPECT[1])) ** 0.5
+    size = (int(unit * ASPECT[0]), int(unit * ASPECT[1]))
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 64)
+    Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT))).save(path, 'JPEG', quality=90)
+    return size
+
+
+def peak_rss_mb():
+    """Pico de RSS do processo (VmHWM; ru_maxrss sobrevive ao exec do spawn e herdaria o do pai)"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run_full(source, workdir):
+    with Image.open(source) as image:
+        image.load()
+        image.thumbnail(image_jobs.MAX_IMAGE_SIZE, Image.Resampling.LANCZOS, reducing_gap=None)
+        image.save(os.path.join(workdir, 'full.jpg'), 'JPEG', quality=image_jobs.JPEG_QUALITY)
+
+
+def run_previous(source, workdir):
+    with Image.open(source) as image:
+        image.thumbnail(image_jobs.MAX_IMAGE_SIZE, Image.Resampling.LANCZOS)
+        image.save(os.path.join(workdir, 'previous.jpg'), 'JPEG', quality=image_jobs.JPEG_QUALITY)
+
+
+def run_draft(source, workdir):
+    with Image.open(source) as original:
+        image = image_jobs.open_reduced(original, image_jobs.MAX_IMAGE_SIZE, max_pixels=10 ** 9)
+        image.thumbnail(image_jobs.MAX_IMAGE_SIZE, Image.Resampling.LANCZOS, reducing_gap=image_jobs.REDUCING_GAP)
+        image.save(os.path.join(workdir, 'draft.jpg'), 'JPEG', quality=image_jobs.JPEG_QUALITY)
+
+
+def run_pipeline(source, workdir):
+    # process_image_file apaga o original; trabalha numa cópia
+    copy = os.path.join(workdir, 'staging', 'source.upload')
+    shutil.copyfile(source, copy)
+    image_jobs.process_image_file(copy, os.path.join(workdir, 'staging'), os.path.join(workdir, 'uploads'),
+                                  max_pixels=10 ** 9)
+
+
+MODES = {'completo': run_full, 'anterior': run_previous, 'draft': run_draft, 'derivados': run_pipeline}
+
+
+def measure(mode, source, workdir, queue):
+    baseline = peak_rss_mb()
+    started_at = time.perf_counter()
+    MODES[mode](source, workdir)
+    queue.put((time.perf_counter() - started_at, baseline, peak_rss_mb()))
+
+
+def main(sizes):
+    context = multiprocessing.get_context('spawn')
+    workdir = tempfile.mkdtemp(prefix='bench-decode-')
+    os.makedirs(os.path.join(workdir, 'staging'))
+    os.makedirs(os.path.join(workdir, 'uploads'))
+    try:
+        print(f"{'imagem':>18} {'modo':>10} {'tempo':>9} {'pico RSS':>10} {'acréscimo':>10}")
+        for megapixels in sizes:
+            source = os.path.join(workdir, f'{megapixels}mp.jpg')
+            width, height = make_jpeg(source, megapixels)
+            label = f'{megapixels} MP {width}x{height}'
+            for mode in MODES:
+                queue = context.Queue()
+                process = context.Process(target=measure, args=(mode, source, workdir, queue))
+                process.start()
+                elapsed, baseline, peak = queue.get()
+                process.join()
+                print(f"{label:>18} {mode:>10} {elapsed * 1000:>7.0f}ms {peak:>8.0f}MB {peak - baseline:>8.0f}MB")
+                label = ''
+                shutil.rmtree(os.path.join(workdir, 'uploads'))
+                os.makedirs(os.path.join(workdir, 'uploads'))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [2, 12, 48])
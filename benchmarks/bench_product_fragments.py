@@ -0,0 +1,109 @@
+# benchmarks/bench_product_fragments.py
+"""Benchmark da serialização de GET /api/products?all=1.
+
+Compara o caminho antigo (to_dict + clean_image_url + jsonify para cada
+produto) com a montagem por fragmentos JSON em cache, com 10k e 100k produtos.
+
+Uso:
+    python benchmarks/bench_product_fragments.py [10000 100000]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Banco e cache temporários, antes de importar o app
+workdir = tempfile.mkdtemp(prefix='bench-fragments-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+os.environ['CACHE_BACKEND'] = 'memory'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+logging.disable(logging.INFO)
+
+from flask import jsonify
+import app as catalog
+from app import app, db, Product
+
+
+def legacy_response(products):
+    """Serialização como era antes dos fragmentos"""
+    cleaned_products = []
+    for product in products:
+        product_dict = product.to_dict()
+        if product_dict.get('image_url'):
+            if not catalog.check_image_exists(product_dict['image_url']):
+                product_dict['image_exists'] = False
+                product_dict['image_url_display'] = catalog.get_default_image_url()
+            else:
+                product_dict['image_exists'] = True
+                product_dict['image_url_display'] = f"/uploads/{catalog.clean_image_url(product_dict['image_url'])}"
+            product_dict['image_url'] = catalog.clean_image_url(product_dict['image_url'])
+        else:
+            product_dict['image_exists'] = False
+            product_dict['image_url_display'] = catalog.get_default_image_url()
+        cleaned_products.append(product_dict)
+    return jsonify(cleaned_products)
+
+
+def seed(count):
+    with app.app_context():
+        db.session.execute(Product.__table__.delete())
+        start = datetime(2024, 1, 1)
+        rows = [{
+            'name': f'Produto {i}',
+            'description': f'Descrição do produto {i} com alguns detalhes',
+            'price': 10.0 + i % 500,
+            'category': f'Categoria {i % 40}',
+            'image_url': f'{i:016x}_foto.jpg' if i % 3 else '',
+            'created_at': start + timedelta(seconds=i),
+            'updated_at': start + timedelta(seconds=i),
+        } for i in range(count)]
+        db.session.execute(Product.__table__.insert(), rows)
+        catalog.bump_catalog_version()
+        db.session.commit()
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def run(count):
+    seed(count)
+    catalog.product_fragments.clear()
+    query = lambda: Product.query.order_by(Product.created_at.desc(), Product.id.desc())
+
+    with app.test_request_context('/api/products?all=1'):
+        legacy_time, legacy = timed(lambda: legacy_response(query().all()))
+        db.session.expunge_all()
+
+        rows_query = lambda: query().with_entities(*catalog.PRODUCT_LIST_COLUMNS).all()
+        cold_time, cold = timed(lambda: catalog.product_list_response(rows_query()))
+        warm_time, warm = timed(lambda: catalog.product_list_response(rows_query()))
+
+        # Só 1% dos produtos alterados desde a última resposta
+        changed = max(count // 100, 1)
+        db.session.execute(
+            Product.__table__.update()
+            .where(Product.id <= changed)
+            .values(updated_at=datetime.utcnow())
+        )
+        db.session.commit()
+        partial_time, _ = timed(lambda: catalog.product_list_response(rows_query()))
+
+    assert len(cold.data) == len(warm.data) and len(legacy.data) == len(warm.data) + 1
+
+    print(f"\n=== {count} produtos ({len(warm.data) / 1024 / 1024:.1f} MB de JSON) ===")
+    print(f"   antigo (to_dict + jsonify):        {legacy_time * 1000:8.1f} ms")
+    print(f"   fragmentos, cache frio:            {cold_time * 1000:8.1f} ms")
+    print(f"   fragmentos, cache quente:          {warm_time * 1000:8.1f} ms  ({legacy_time / warm_time:.1f}x)")
+    print(f"   fragmentos, 1% alterado:           {partial_time * 1000:8.1f} ms  ({legacy_time / partial_time:.1f}x)")
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    for size in sizes:
+        run(size)
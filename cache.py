@@ -0,0 +1,287 @@
+# cache.py
+"""Camada de cache com backends plugáveis.
+
+- MemoryBackend: LRU em memória com TTL e limite de entradas (por processo)
+- SQLiteBackend: arquivo SQLite compartilhado entre os workers do gunicorn.
+  Os valores são gravados em JSON (nunca pickle: quem escreve no arquivo não
+  ganha execução de código), então só valores serializáveis em JSON; o
+  arquivo é criado com permissão 0600 e recusado se for de outro usuário.
+
+Invalidação por tags: cada entrada guarda a versão das suas tags no momento
+em que foi gravada; invalidate_tags() só incrementa a versão da tag, e as
+entradas antigas passam a contar como miss na próxima leitura.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class MemoryBackend:
+    name = 'memory'
+    # Cada worker tem o seu: invalidate_tags só limpa o do processo atual
+    shared = False
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            entries = self._entries
+            for key in keys:
+                entry = entries.get(key)
+                if entry is not None:
+                    entries.move_to_end(key)
+                    found[key] = entry
+        return found
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def tag_versions(self, tags):
+        return {tag: self._tags.get(tag, 0) for tag in tags}
+
+    def bump_tags(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._tags[tag] = self._tags.get(tag, 0) + 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _create_private(path):
+    """Cria o arquivo do cache só para o dono (0600); recusa arquivo de outro usuário ou link"""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+    try:
+        if hasattr(os, 'getuid') and os.fstat(fd).st_uid != os.getuid():
+            raise PermissionError(f"{path} pertence a outro usuário")
+        if hasattr(os, 'fchmod'):
+            os.fchmod(fd, 0o600)
+    finally:
+        os.close(fd)
+
+
+class SQLiteBackend:
+    """Cache compartilhado em arquivo SQLite (WAL), uma conexão por thread"""
+
+    name = 'sqlite'
+    shared = True
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._local = threading.local()
+        self._writes = 0
+        _create_private(path)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entry ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, stored_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entry_stored_at ON cache_entry (stored_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_tag (tag TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # Conexões não podem ser herdadas pelo fork do gunicorn
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute("SELECT value FROM cache_entry WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            value, expires_at, tags = json.loads(row[0])
+        except ValueError:
+            # Entrada ilegível (de outra versão): conta como miss
+            return None
+        return value, expires_at, tags
+
+    def set(self, key, entry):
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entry (key, value, stored_at) VALUES (?, ?, ?)",
+            (key, json.dumps(entry, separators=(',', ':')), time.time())
+        )
+        # Confere o tamanho a cada 100 gravações, não a cada uma
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._evict(conn)
+
+    def _evict(self, conn):
+        count = conn.execute("SELECT COUNT(*) FROM cache_entry").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            # Remove as entradas mais antigas, com folga de 10%
+            excess += self.max_entries // 10
+            conn.execute(
+                "DELETE FROM cache_entry WHERE key IN "
+                "(SELECT key FROM cache_entry ORDER BY stored_at LIMIT ?)", (excess,)
+            )
+            self.evictions += excess
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM cache_entry WHERE key = ?", (key,))
+
+    def clear(self):
+        self._connect().execute("DELETE FROM cache_entry")
+
+    def tag_versions(self, tags):
+        if not tags:
+            return {}
+        placeholders = ','.join('?' * len(tags))
+        rows = self._connect().execute(
+            f"SELECT tag, version FROM cache_tag WHERE tag IN ({placeholders})", list(tags)
+        ).fetchall()
+        versions = dict(rows)
+        return {tag: versions.get(tag, 0) for tag in tags}
+
+    def bump_tags(self, tags):
+        conn = self._connect()
+        for tag in tags:
+            conn.execute(
+                "INSERT INTO cache_tag (tag, version) VALUES (?, 1) "
+                "ON CONFLICT(tag) DO UPDATE SET version = version + 1", (tag,)
+            )
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM cache_entry").fetchone()[0]
+
+
+class Cache:
+    def __init__(self, backend, default_ttl=300):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def shared(self):
+        """Entradas e invalidações valem para todos os workers?"""
+        return self.backend.shared
+
+    def get(self, key, default=None):
+        entry = self.backend.get(key)
+        if entry is not None:
+            value, expires_at, tags = entry
+            if expires_at is not None and expires_at < time.time():
+                self.backend.delete(key)
+            elif tags and self.backend.tag_versions(list(tags)) != tags:
+                # Alguma tag foi invalidada depois da gravação
+                self.backend.delete(key)
+            else:
+                self.hits += 1
+                return value
+        self.misses += 1
+        return default
+
+    def get_many(self, keys):
+        """Lê várias chaves de uma vez; retorna {chave: valor} só com os hits"""
+        if not hasattr(self.backend, 'get_many'):
+            values = {}
+            for key in keys:
+                value = self.get(key, _MISSING)
+                if value is not _MISSING:
+                    values[key] = value
+            return values
+
+        now = time.time()
+        values = {}
+        for key, (value, expires_at, tags) in self.backend.get_many(keys).items():
+            if (expires_at is not None and expires_at < now) or (
+                    tags and self.backend.tag_versions(list(tags)) != tags):
+                self.backend.delete(key)
+                continue
+            values[key] = value
+        self.hits += len(values)
+        self.misses += len(keys) - len(values)
+        return values
+
+    def set(self, key, value, ttl=None, tags=()):
+        self._store(key, value, ttl, self.backend.tag_versions(list(tags)) if tags else {})
+
+    def _store(self, key, value, ttl, tag_versions):
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        self.backend.set(key, (value, expires_at, tag_versions))
+
+    def get_or_set(self, key, factory, ttl=None, tags=()):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            # Versões lidas antes de gerar o valor: uma invalidação no meio do
+            # factory (outro worker gravando) deixa a entrada já vencida
+            tag_versions = self.backend.tag_versions(list(tags)) if tags else {}
+            value = factory()
+            self._store(key, value, ttl, tag_versions)
+        return value
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def invalidate_tags(self, *tags):
+        self.backend.bump_tags(tags)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'backend': self.backend.name,
+            'shared': self.shared,
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.backend.evictions,
+            'hit_rate': round(self.hits / total, 3) if total else None
+        }
+
+
+def create_cache(backend, path=None, max_entries=1024, default_ttl=300):
+    """Cria o cache conforme a configuração; cai para memória se o SQLite falhar"""
+    if backend == 'sqlite':
+        try:
+            return Cache(SQLiteBackend(path, max_entries=max_entries), default_ttl=default_ttl)
+        except Exception as e:
+            logger.warning(f"⚠️ Cache SQLite indisponível ({path}), usando memória: {e}")
+    return Cache(MemoryBackend(max_entries=max_entries), default_ttl=default_ttl)
@@ -0,0 +1,115 @@
+# catalog_export.py
+"""Exportação do catálogo em streaming (NDJSON, CSV ou array JSON, opcionalmente gzip).
+
+Os produtos são lidos com yield_per (cursor do lado do servidor no
+PostgreSQL, fetchmany no SQLite) e cada lote vira um pedaço da resposta:
+a memória fica constante qualquer que seja o tamanho do catálogo. Nada de
+verificar arquivos de imagem; image_url vai como está no banco.
+
+Para o backup incremental, ``since`` restringe aos produtos alterados desde
+então e iter_deletions lista as exclusões (product_tombstone) do mesmo
+período, uma por linha: {"id": ..., "deleted_at": ...}.
+"""
+import csv
+import io
+import json
+import zlib
+
+from sqlalchemy import select
+
+from models import Product, ProductTombstone
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'json': 'application/json',
+}
+# Mesmos campos (e ordem) de Product.to_dict
+EXPORT_COLUMNS = ('id', 'name', 'description', 'price', 'category', 'image_url', 'sku', 'created_at', 'updated_at')
+DATE_COLUMNS = ('created_at', 'updated_at', 'deleted_at')
+BATCH_SIZE = 1000
+GZIP_LEVEL = 6
+
+
+def export_query(since=None):
+    """Produtos em ordem de id; com ``since``, só os alterados a partir dele (updated_at).
+
+    Com since a ordem é a do índice ix_product_updated_at, que evita ordenar.
+    """
+    query = select(*(Product.__table__.c[column] for column in EXPORT_COLUMNS))
+    if since is None:
+        return query.order_by(Product.id)
+    return query.where(Product.updated_at >= since).order_by(Product.updated_at, Product.id)
+
+
+def deletions_query(since=None):
+    """Exclusões em ordem de data; com ``since``, só as feitas a partir dele"""
+    query = select(ProductTombstone.product_id.label('id'), ProductTombstone.deleted_at) \
+        .order_by(ProductTombstone.deleted_at, ProductTombstone.id)
+    if since is not None:
+        query = query.where(ProductTombstone.deleted_at >= since)
+    return query
+
+
+def _record(row):
+    record = row._asdict()
+    for column in DATE_COLUMNS:
+        if record.get(column) is not None:
+            record[column] = record[column].isoformat()
+    return record
+
+
+def _ndjson(batches):
+    for batch in batches:
+        yield ''.join(json.dumps(_record(row), ensure_ascii=False) + '\n' for row in batch)
+
+
+def _json_array(batches):
+    yield '['
+    separator = '\n'
+    for batch in batches:
+        parts = []
+        for row in batch:
+            parts.append(separator + json.dumps(_record(row), ensure_ascii=False))
+            separator = ',\n'
+        yield ''.join(parts)
+    yield '\n]\n'
+
+
+def _csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in batches:
+        for row in batch:
+            writer.writerow(['' if value is None else value for value in _record(row).values()])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+ENCODERS = {'ndjson': _ndjson, 'csv': _csv, 'json': _json_array}
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_export(conn, fmt, since=None, gzip=False, batch_size=BATCH_SIZE):
+    """Bytes da exportação, um pedaço por lote de produtos"""
+    result = conn.execute(export_query(since).execution_options(yield_per=batch_size))
+    chunks = (text.encode('utf-8') for text in ENCODERS[fmt](result.partitions()) if text)
+    return _gzip(chunks) if gzip else chunks
+
+
+def iter_deletions(conn, since=None, gzip=False, batch_size=BATCH_SIZE):
+    """Bytes das exclusões em NDJSON, um pedaço por lote"""
+    result = conn.execute(deletions_query(since).execution_options(yield_per=batch_size))
+    chunks = (text.encode('utf-8') for text in _ndjson(result.partitions()) if text)
+    return _gzip(chunks) if gzip else chunks
@@ -0,0 +1,330 @@
+# catalog_restore.py
+"""Restauração do catálogo a partir de um backup, numa transação só.
+
+Aceita o documento dos backups (JSON com "products", ou uma lista) ou NDJSON,
+o formato de /api/admin/export, com ou sem gzip. Os dois são lidos aos
+poucos (do JSON, um produto da lista por vez) e gravados em lotes com o
+mesmo INSERT em massa da importação de CSV (COPY no PostgreSQL), com os ids
+e as datas do backup. Facetas e contagem de referências das
+imagens são acertadas na mesma transação; quem chama faz o commit (ou o
+rollback, se vier RestoreError): o catálogo nunca fica restaurado pela metade.
+
+Modos:
+- replace: o catálogo passa a ser exatamente o do backup
+- merge:   produtos do backup gravados por cima pelo id; os demais ficam
+"""
+import gzip
+import io
+import json
+import time
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.exc import IntegrityError
+
+import facets
+import image_store
+from csv_import import MAX_REPORTED_ERRORS, PRODUCT_COLUMNS, _dialect_name, insert_products, product_table
+from models import Product
+from product_validation import validate_columns
+
+RESTORE_FORMATS = ('json', 'ndjson')
+RESTORE_MODES = ('replace', 'merge')
+BATCH_SIZE = 1000
+GZIP_MAGIC = b'\x1f\x8b'
+# Leitura do documento JSON: caracteres por vez e tamanho máximo de um registro
+READ_CHARS = 64 * 1024
+MAX_RECORD_CHARS = 1024 * 1024
+
+
+class RestoreError(ValueError):
+    """Backup que não pode ser restaurado; ``errors`` traz os registros recusados"""
+
+    def __init__(self, message, errors=()):
+        super().__init__(message)
+        self.errors = list(errors)
+
+
+class _LimitedReader(io.RawIOBase):
+    """Backup já descompactado, com teto de bytes: um gzip pequeno não vira gigabytes no servidor"""
+
+    def __init__(self, f, limit):
+        self.f = f
+        self.limit = limit
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.f.read(len(buffer))
+        self.size += len(data)
+        if self.size > self.limit:
+            raise RestoreError(f"Backup descompactado passa de {self.limit // (1024 * 1024)} MB")
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def open_backup(stream, max_bytes=None):
+    """Stream de texto do backup, descompactando se for gzip (detectado pelo conteúdo)"""
+    stream = io.BufferedReader(stream, 64 * 1024) if not hasattr(stream, 'peek') else stream
+    if stream.peek(2)[:2] == GZIP_MAGIC:
+        stream = gzip.GzipFile(fileobj=stream)
+    if max_bytes:
+        stream = io.BufferedReader(_LimitedReader(stream, max_bytes), 64 * 1024)
+    return io.TextIOWrapper(stream, encoding='utf-8')
+
+
+class _JSONReader:
+    """Lê um documento JSON aos poucos: valores pequenos inteiros, listas elemento a elemento.
+
+    Só o valor em leitura fica no buffer (um produto), nunca o documento.
+    """
+
+    def __init__(self, text_stream):
+        self.stream = text_stream
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.stream.read(READ_CHARS)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Próximo caractere fora de espaços ('' no fim do arquivo)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise RestoreError(f"JSON inválido: esperado '{char}', encontrado {found!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decodifica o próximo valor, lendo mais do arquivo até ele estar completo"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                error = e
+            else:
+                # Número no fim do buffer pode continuar no próximo pedaço
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+                error = None
+            if len(self.buffer) - self.pos > MAX_RECORD_CHARS:
+                raise RestoreError(f"JSON inválido ou registro maior que {MAX_RECORD_CHARS // 1024} KB")
+            if not self._fill():
+                raise RestoreError(f"JSON inválido: {error.msg if error else 'fim inesperado do arquivo'}")
+
+    def items(self):
+        """Elementos da lista que começa aqui, um por vez"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ']':
+                self.pos += 1
+                return
+            self.expect(',')
+
+
+def _iter_document(text_stream):
+    """Produtos do documento dos backups ({"products": [...], ...} ou uma lista), sem carregá-lo inteiro"""
+    reader = _JSONReader(text_stream)
+    if reader.peek() == '[':
+        yield from reader.items()
+    else:
+        reader.expect('{')
+        found = False
+        first = True
+        while reader.peek() != '}':
+            if not first:
+                reader.expect(',')
+            first = False
+            key = reader.value()
+            reader.expect(':')
+            if key == 'products' and reader.peek() == '[':
+                found = True
+                yield from reader.items()
+            else:
+                # Metadados do backup (data, totais): pequenos, lidos e descartados
+                reader.value()
+        reader.expect('}')
+        if not found:
+            raise RestoreError("Backup sem lista de produtos ('products')")
+    if reader.peek():
+        raise RestoreError("JSON inválido: conteúdo depois do fim do documento")
+
+
+def iter_records(stream, fmt, max_bytes=None):
+    """Produtos do backup, um dict por vez (o arquivo nunca fica inteiro na memória)"""
+    text_stream = open_backup(stream, max_bytes)
+    try:
+        if fmt == 'ndjson':
+            for line_num, line in enumerate(text_stream, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise RestoreError(f"Linha {line_num}: JSON inválido ({e.msg})")
+            return
+
+        yield from _iter_document(text_stream)
+    except (UnicodeDecodeError, gzip.BadGzipFile, EOFError) as e:
+        raise RestoreError(f"Arquivo de backup ilegível: {e}")
+
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+def _date(value, now):
+    if not value:
+        return now
+    return datetime.fromisoformat(value)
+
+
+def prepare_batch(records, first, now):
+    """(linhas para o INSERT, erros [(número do registro, coluna, mensagem)]) de um lote do backup"""
+    errors = []
+    valid = []
+    for offset, record in enumerate(records):
+        if not isinstance(record, dict):
+            errors.append((first + offset, None, "Registro deve ser um objeto JSON"))
+            continue
+        valid.append((first + offset, record))
+
+    count = len(valid)
+    columns = {
+        'name': tuple(_text(record.get('name')) for _, record in valid),
+        'category': tuple(_text(record.get('category')) for _, record in valid),
+        'sku': tuple(_text(record.get('sku')) for _, record in valid),
+        'price': tuple(_text(record.get('price')) for _, record in valid),
+    }
+    column_errors, prices = validate_columns(columns, count)
+    errors.extend((valid[index][0], column, message) for index, column, message in column_errors)
+    rejected = {index for index, _, _ in column_errors}
+
+    values = []
+    for index, (number, record) in enumerate(valid):
+        if index in rejected:
+            continue
+        try:
+            product_id = record.get('id')
+            row = {
+                'id': None if product_id is None else int(product_id),
+                'name': columns['name'][index],
+                'description': _text(record.get('description')),
+                'price': prices[index],
+                'category': columns['category'][index],
+                'image_url': _text(record.get('image_url')) or None,
+                'sku': columns['sku'][index] or None,
+                'created_at': _date(record.get('created_at'), now),
+                'updated_at': _date(record.get('updated_at'), now),
+            }
+        except (TypeError, ValueError) as e:
+            errors.append((number, None, f"id ou data inválida: {e}"))
+            continue
+        values.append(row)
+    errors.sort(key=lambda error: error[0])
+    return values, errors
+
+
+def _insert(conn, values):
+    """INSERT em massa; com id do backup e, à parte, os sem id (o banco numera)"""
+    with_id = [row for row in values if row['id'] is not None]
+    without_id = [{column: row[column] for column in PRODUCT_COLUMNS} for row in values if row['id'] is None]
+    if with_id:
+        insert_products(conn, with_id, ('id',) + PRODUCT_COLUMNS)
+    if without_id:
+        insert_products(conn, without_id)
+
+
+def _reset_id_sequence(conn):
+    """No PostgreSQL a sequência do id não anda com ids explícitos: continua depois do maior"""
+    if _dialect_name(conn) == 'postgresql':
+        conn.execute(text(
+            "SELECT setval(pg_get_serial_sequence('product', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM product"
+        ))
+
+
+def restore_catalog(conn, stream, fmt='json', mode='replace', batch_size=BATCH_SIZE, max_bytes=None,
+                    allow_empty=False):
+    """Restaura o backup na transação atual (sem commit). Levanta RestoreError.
+
+    Todos os registros são validados; havendo qualquer erro nada deve ser
+    gravado (RestoreError com a lista), e quem chama faz o rollback.
+    ``max_bytes`` limita o tamanho do backup já descompactado. No modo
+    replace um backup sem nenhum produto é recusado (apagaria o catálogo
+    inteiro por causa de um upload vazio ou perdido), a não ser com
+    ``allow_empty``.
+    Retorna o relatório: restored, removed (produtos que saíram ou foram
+    sobrescritos), error_count, duration_ms, rows_per_sec.
+    """
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    report = {'mode': mode, 'format': fmt, 'restored': 0, 'removed': 0, 'error_count': 0}
+    errors = []
+
+    if mode == 'replace':
+        image_store.release_many(conn, conn.execute(select(Product.image_url)).scalars().all())
+        report['removed'] = conn.execute(delete(product_table)).rowcount
+
+    records = iter_records(stream, fmt, max_bytes)
+    first = 1
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        values, batch_errors = prepare_batch(batch, first, now)
+        report['error_count'] += len(batch_errors)
+        errors.extend(batch_errors[:max(MAX_REPORTED_ERRORS - len(errors), 0)])
+        # Com erro não grava mais nada, mas segue validando para listar todos
+        if not report['error_count'] and values:
+            ids = [row['id'] for row in values if row['id'] is not None]
+            if mode == 'merge' and ids:
+                old_images = conn.execute(select(Product.image_url).where(Product.id.in_(ids))).scalars().all()
+                image_store.release_many(conn, old_images)
+                report['removed'] += conn.execute(delete(product_table).where(product_table.c.id.in_(ids))).rowcount
+            try:
+                _insert(conn, values)
+            except IntegrityError as e:
+                raise RestoreError(f"Registros {first} a {first + len(batch) - 1}: id ou SKU repetido ({e.orig})")
+            image_store.acquire_many(conn, [row['image_url'] for row in values])
+            report['restored'] += len(values)
+        first += len(batch)
+
+    if report['error_count']:
+        raise RestoreError(
+            f"Backup com {report['error_count']} erros; nada foi restaurado",
+            [{'record': number, 'column': column, 'error': message} for number, column, message in errors]
+        )
+
+    if mode == 'replace' and first == 1 and not allow_empty:
+        raise RestoreError("Backup sem nenhum produto; o catálogo não foi apagado "
+                           "(para esvaziá-lo de propósito, use allow_empty)")
+
+    facets.rebuild(conn)
+    _reset_id_sequence(conn)
+    elapsed = time.perf_counter() - started
+    report['duration_ms'] = round(elapsed * 1000)
+    report['rows_per_sec'] = round(report['restored'] / elapsed) if elapsed else None
+    return report
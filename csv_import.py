@@ -0,0 +1,601 @@
+# csv_import.py
+"""Importação de produtos por CSV em streaming, em lotes com commit próprio.
+
+O arquivo é decodificado aos poucos (nunca inteiro na memória) e lido em
+lotes de chunk_size registros, separados por coluna: a validação roda sobre
+as colunas inteiras do lote (product_validation.validate_columns) e cada
+erro sai como (linha, coluna, mensagem). As linhas válidas do lote são
+gravadas com um INSERT executemany do Core (COPY no PostgreSQL), junto com
+as facetas, a contagem de referências das imagens e o que o before_commit de
+quem chama fizer (versão do catálogo); então vem o commit. Uma falha no
+banco desfaz só o lote atual: os anteriores continuam gravados e a
+importação para ali, com o relatório dizendo até onde foi.
+
+No modo 'upsert' cada lote vai para uma tabela temporária e é comparado com
+os produtos pela chave natural (sku, ou nome + categoria) em poucas consultas
+no banco: linhas novas são inseridas, as que mudaram são atualizadas (com
+INSERT ... ON CONFLICT quando a chave tem índice único) e as iguais não são
+tocadas, nem o updated_at. Com dry_run o lote é comparado e desfeito.
+
+A busca acompanha sozinha: FTS5 e tsvector por triggers (que também disparam
+no COPY e no ON CONFLICT), a busca em Python pela versão do catálogo.
+"""
+import csv
+import io
+import logging
+import time
+from datetime import datetime
+from itertools import accumulate, islice
+from operator import itemgetter
+
+from sqlalchemy import (Column, Float, Integer, MetaData, String, Table, Text, and_, exists, false, func,
+                        insert, literal, or_, select, true, update)
+from sqlalchemy.dialects import postgresql, sqlite
+
+import facets
+import image_store
+from models import Product
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_COLUMNS = ('name', 'price')
+PRODUCT_COLUMNS = ('name', 'description', 'price', 'category', 'image_url', 'sku', 'created_at', 'updated_at')
+# Mensagens de erro guardadas no relatório; as demais só entram na contagem
+MAX_REPORTED_ERRORS = 100
+# Alterações detalhadas (antes/depois) guardadas no relatório do upsert
+MAX_REPORTED_CHANGES = 100
+
+IMPORT_MODES = ('insert', 'upsert')
+# Chave natural -> colunas; só 'sku' tem índice único (ON CONFLICT)
+NATURAL_KEYS = {'sku': ('sku',), 'name_category': ('name', 'category')}
+UPSERT_COLUMNS = ('name', 'description', 'price', 'category', 'image_url', 'sku')
+SKU_REQUIRED = "SKU é obrigatório na importação com atualização por SKU"
+SKU_IN_USE = "SKU já cadastrado em outro produto"
+# SKUs por consulta na checagem do modo 'insert' (limite de parâmetros do SQLite antigo)
+SKU_QUERY_SIZE = 500
+# Bytes lidos e decodificados por vez (readlines com hint: sempre linhas inteiras)
+LINE_BLOCK_BYTES = 64 * 1024
+
+product_table = Product.__table__
+
+# Lote em comparação no upsert; criada e removida na transação de cada lote
+stage_table = Table(
+    'product_import_stage', MetaData(),
+    Column('line_num', Integer, primary_key=True),
+    Column('name', String(100)),
+    Column('description', Text),
+    Column('price', Float),
+    Column('category', String(50)),
+    Column('image_url', String(200)),
+    Column('sku', String(64)),
+    prefixes=['TEMPORARY']
+)
+
+
+class CSVImportError(ValueError):
+    """Arquivo que não pode ser importado (cabeçalho, codificação)"""
+
+
+class _Lines:
+    """Linhas do arquivo binário, decodificadas em blocos, para o leitor de CSV.
+
+    O leitor de CSV não lê adiante: depois de cada lote, consumed() recebe
+    quantas linhas ele tirou daqui e atualiza line_num e offset (fim da
+    última linha consumida, ponto seguro para retomar a importação). Num erro
+    de codificação as linhas boas do bloco ainda são entregues, a leitura
+    termina como se o arquivo acabasse ali e o erro, com a linha exata, fica
+    em ``error``.
+    """
+
+    def __init__(self, stream, offset=0, line_num=0):
+        self.stream = stream
+        self.offset = offset
+        self.line_num = line_num
+        self.error = None
+        self._first_line = line_num
+        self._block_line = line_num  # linhas antes do bloco atual
+        self._block_offsets = [offset]  # offset depois de cada linha do bloco atual
+
+    def __iter__(self):
+        for block in iter(lambda: self.stream.readlines(LINE_BLOCK_BYTES), []):
+            self._block_line += len(self._block_offsets) - 1
+            self._block_offsets = list(accumulate(map(len, block), initial=self._block_offsets[-1]))
+            try:
+                texts = list(map(bytes.decode, block))
+            except UnicodeDecodeError:
+                texts = []
+                for line in block:
+                    try:
+                        texts.append(line.decode())
+                    except UnicodeDecodeError:
+                        break
+                self.error = CSVImportError(f"Linha {self._block_line + len(texts) + 1} não está em UTF-8")
+            # BOM que o Excel grava no início de arquivos UTF-8
+            if self._block_line == 0 and texts:
+                texts[0] = texts[0].removeprefix('\ufeff')
+            yield from texts
+            if self.error:
+                return
+
+    def consumed(self, count):
+        """O leitor de CSV já tirou ``count`` linhas desde o início desta leitura"""
+        self.line_num = self._first_line + count
+        self.offset = self._block_offsets[self.line_num - self._block_line]
+
+
+def _line_numbers(rows, first_line, last_line):
+    """Linha (a última, se o registro ocupa várias) de cada registro lido entre first_line e last_line"""
+    if last_line - first_line == len(rows):
+        return range(first_line + 1, last_line + 1)
+    # Campos entre aspas com quebra de linha: cada \n dentro deles é uma linha a mais
+    spans = [1 + sum(field.count('\n') for field in row) for row in rows]
+    return list(accumulate(spans, initial=first_line))[1:]
+
+
+def read_chunks(lines, fieldnames=None, required=REQUIRED_COLUMNS, chunk_size=1000):
+    """Lê o CSV aos poucos, chunk_size registros por vez, já separados por coluna.
+
+    Gera (cabeçalho, números das linhas, {coluna: tupla de valores}). Sem
+    ``fieldnames`` o cabeçalho é lido da primeira linha. Campos ausentes
+    viram '', sobras sem cabeçalho são descartadas e linhas em branco,
+    puladas. Num erro de codificação o lote incompleto ainda é entregue
+    antes do CSVImportError.
+    """
+    reader = csv.reader(iter(lines))
+    first_line = lines.line_num
+    try:
+        if fieldnames is None:
+            fieldnames = next(reader, None) or []
+        missing = [column for column in required if column not in fieldnames]
+        if missing:
+            raise CSVImportError(f"Colunas obrigatórias ausentes: {', '.join(missing)}")
+        width = len(fieldnames)
+        padding = [''] * width
+        while True:
+            before = first_line + reader.line_num
+            # islice tira o lote inteiro do leitor em C; as linhas vêm depois, pela contagem
+            rows = list(islice(reader, chunk_size))
+            lines.consumed(reader.line_num)
+            line_nums = _line_numbers(rows, before, lines.line_num)
+            complete = len(rows) == chunk_size
+            if not all(rows) or any(map(width.__ne__, map(len, rows))):
+                kept = [(line_num, (row + padding)[:width]) for line_num, row in zip(line_nums, rows) if row]
+                line_nums = [line_num for line_num, _ in kept]
+                rows = [row for _, row in kept]
+            if rows:
+                yield fieldnames, list(line_nums), dict(zip(fieldnames, zip(*rows)))
+            # Lote incompleto: acabaram as linhas (ou as boas, antes do erro de codificação)
+            if not complete:
+                if lines.error:
+                    raise lines.error
+                return
+    except csv.Error as e:
+        lines.consumed(reader.line_num)
+        raise CSVImportError(f"CSV inválido na linha {lines.line_num}: {e}")
+
+
+def prepare_chunk(line_nums, columns, validate, clean_url, now):
+    """Valida um lote por colunas e monta os valores do INSERT das linhas válidas.
+
+    ``validate(columns, count)`` retorna (erros, preços), como
+    product_validation.validate_columns. Retorna (valores, linhas dos
+    valores, erros como (linha, coluna, mensagem)).
+    """
+    count = len(line_nums)
+    errors, prices = validate(columns, count)
+    invalid = {index for index, _, _ in errors}
+    empty = ('',) * count
+    values, value_lines = [], []
+    for index, (line_num, name, description, category, image_url, sku) in enumerate(zip(
+            line_nums, columns.get('name', empty), columns.get('description', empty),
+            columns.get('category', empty), columns.get('image_url', empty), columns.get('sku', empty))):
+        if index in invalid:
+            continue
+        image_url = image_url.strip()
+        values.append({
+            'name': name.strip(),
+            'description': description.strip(),
+            'price': prices[index],
+            'category': category.strip(),
+            'image_url': clean_url(image_url) if image_url else '',
+            'sku': sku.strip() or None,
+            'created_at': now,
+            'updated_at': now
+        })
+        value_lines.append(line_num)
+    return values, value_lines, [(line_nums[index], column, message) for index, column, message in errors]
+
+
+def validate_csv(stream, validate, chunk_size=1000, report=None):
+    """Só valida o arquivo, sem banco: gera a lista de erros (linha, coluna, mensagem) de cada lote.
+
+    ``report`` (dict) recebe os totais ao longo da leitura. Levanta
+    CSVImportError se o cabeçalho não serve; erro no meio do arquivo
+    termina com status 'failed'.
+    """
+    report = report if report is not None else {}
+    report.update({'status': 'running', 'rows_read': 0, 'valid_rows': 0, 'error_count': 0,
+                   'errors_by_column': {}, 'fieldnames': None, 'error': None})
+    started = time.perf_counter()
+    lines = _Lines(stream)
+    chunks = read_chunks(lines, chunk_size=chunk_size)
+    try:
+        for fieldnames, line_nums, columns in chunks:
+            report['fieldnames'] = fieldnames
+            errors, _ = validate(columns, len(line_nums))
+            report['rows_read'] += len(line_nums)
+            report['valid_rows'] += len(line_nums) - len({index for index, _, _ in errors})
+            report['error_count'] += len(errors)
+            by_column = report['errors_by_column']
+            for _, column, _ in errors:
+                by_column[column] = by_column.get(column, 0) + 1
+            if errors:
+                yield [(line_nums[index], column, message) for index, column, message in errors]
+    except CSVImportError as e:
+        if report['fieldnames'] is None:
+            raise
+        report['status'] = 'failed'
+        report['error'] = str(e)
+    finally:
+        chunks.close()
+    if report['status'] == 'running':
+        report['status'] = 'done'
+    elapsed = time.perf_counter() - started
+    report['duration_ms'] = int(elapsed * 1000)
+    report['rows_per_sec'] = round(report['rows_read'] / elapsed) if elapsed else None
+
+
+def _connection(conn):
+    # Session.connection() é um método; em Connection, .connection é o DBAPI
+    return conn.connection() if callable(getattr(conn, 'connection', None)) else conn
+
+
+def _dbapi_connection(conn):
+    return _connection(conn).connection
+
+
+def _dialect_name(conn):
+    bind = conn.get_bind() if hasattr(conn, 'get_bind') else conn
+    return bind.dialect.name
+
+
+def insert_products(conn, values, columns=PRODUCT_COLUMNS):
+    """Grava um lote de produtos na transação atual: COPY no PostgreSQL, executemany nos demais"""
+    if _dialect_name(conn) != 'postgresql':
+        conn.execute(insert(product_table), values)
+        return
+
+    buffer = io.StringIO()
+    # Strings sempre entre aspas: '' continua string vazia, só None (sem aspas) vira NULL
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+    for row in values:
+        writer.writerow([row[column].isoformat() if isinstance(row[column], datetime) else row[column]
+                         for column in columns])
+    buffer.seek(0)
+    with _dbapi_connection(conn).cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY product ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+
+
+def update_columns(fieldnames, key):
+    """Colunas que o upsert atualiza: as presentes no CSV, menos as da chave"""
+    return [column for column in UPSERT_COLUMNS if column in fieldnames and column not in NATURAL_KEYS[key]]
+
+
+def upsert_products(conn, values, lines, key, columns, now, dry_run=False):
+    """Compara um lote com os produtos pela chave natural e grava a diferença.
+
+    ``values`` vem de prepare_chunk (sem chaves repetidas) e ``lines`` traz o
+    número da linha de cada um. Só ``columns`` são comparadas e atualizadas.
+    Retorna {'inserted', 'updated', 'unchanged', 'changes'}; com dry_run nada
+    é gravado (a tabela temporária some no rollback de quem chama).
+    """
+    connection = _connection(conn)
+    stage_table.drop(connection, checkfirst=True)
+    stage_table.create(connection)
+    connection.execute(insert(stage_table), [
+        {'line_num': line_num, **{column: row[column] for column in UPSERT_COLUMNS}}
+        for line_num, row in zip(lines, values)
+    ])
+
+    matches = and_(*(product_table.c[column] == stage_table.c[column] for column in NATURAL_KEYS[key]))
+    changed = or_(*(product_table.c[column].is_distinct_from(stage_table.c[column]) for column in columns)) \
+        if columns else false()
+    matched = stage_table.join(product_table, matches)
+
+    unchanged = connection.execute(select(func.count()).select_from(matched).where(~changed)).scalar()
+    changed_rows = connection.execute(
+        select(stage_table.c.line_num, product_table.c.id, *(product_table.c[column] for column in UPSERT_COLUMNS))
+        .select_from(matched).where(changed).order_by(stage_table.c.line_num)
+    ).all()
+    new_lines = connection.execute(
+        select(stage_table.c.line_num).where(~exists().where(matches)).order_by(stage_table.c.line_num)
+    ).scalars().all()
+
+    by_line = dict(zip(lines, values))
+    changes = []
+    for row in changed_rows[:MAX_REPORTED_CHANGES]:
+        new = by_line[row.line_num]
+        changes.append({
+            'line': row.line_num,
+            'product_id': row.id,
+            'changes': {column: [getattr(row, column), new[column]] for column in columns
+                        if getattr(row, column) != new[column]}
+        })
+    diff = {'inserted': len(new_lines), 'updated': len(changed_rows), 'unchanged': unchanged, 'changes': changes}
+
+    if not dry_run:
+        _apply_upsert(connection, key, columns, matches, changed, now, bool(new_lines), bool(changed_rows))
+
+        # Facetas: recalcula as categorias que perderam ou ganharam produtos alterados
+        categories = set()
+        released, acquired = [], []
+        for row in changed_rows:
+            new = {column: by_line[row.line_num][column] if column in columns else getattr(row, column)
+                   for column in UPSERT_COLUMNS}
+            if (row.category, row.price) != (new['category'], new['price']):
+                categories.update((row.category, new['category']))
+            if row.image_url != new['image_url']:
+                released.append(row.image_url)
+                acquired.append(new['image_url'])
+        inserted = [by_line[line_num] for line_num in new_lines]
+        facets.recompute_categories(connection, categories)
+        facets.add_product_rows(connection, [(row['category'], row['price']) for row in inserted
+                                             if row['category'] not in categories])
+        image_store.acquire_many(connection, [row['image_url'] for row in inserted] + acquired)
+        # Imagens que ficarem sem uso são apagadas pela limpeza de órfãos
+        image_store.release_many(connection, released)
+
+    stage_table.drop(connection)
+    return diff
+
+
+def _apply_upsert(connection, key, columns, matches, changed, now, has_new, has_changed):
+    columns_in = [column for column in PRODUCT_COLUMNS if column in UPSERT_COLUMNS]
+    rows = select(*(stage_table.c[column] for column in columns_in), literal(now), literal(now))
+    dialect_insert = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}.get(connection.dialect.name)
+
+    if key == 'sku' and dialect_insert:
+        # Um comando só: o índice único decide entre inserir e atualizar. O WHERE do
+        # DO UPDATE deixa intactas (inclusive updated_at) as linhas sem diferença
+        statement = dialect_insert(product_table).from_select(
+            PRODUCT_COLUMNS, rows.where(true()).order_by(stage_table.c.line_num)
+        )
+        if columns:
+            statement = statement.on_conflict_do_update(
+                index_elements=['sku'],
+                set_={**{column: statement.excluded[column] for column in columns}, 'updated_at': now},
+                where=or_(*(product_table.c[column].is_distinct_from(statement.excluded[column]) for column in columns))
+            )
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=['sku'])
+        connection.execute(statement)
+        return
+
+    # Chave sem índice único (nome + categoria podem se repetir): UPDATE ... FROM e INSERT ... SELECT
+    if has_changed:
+        connection.execute(
+            update(product_table).where(matches, changed)
+            .values(**{column: stage_table.c[column] for column in columns}, updated_at=now)
+        )
+    if has_new:
+        connection.execute(insert(product_table).from_select(
+            PRODUCT_COLUMNS, rows.where(~exists().where(matches)).order_by(stage_table.c.line_num)
+        ))
+
+
+def _unique_keys(values, value_lines, key):
+    """Tira do lote as linhas sem chave e as chaves repetidas (vale a última linha).
+
+    O ON CONFLICT não aceita a mesma chave duas vezes no mesmo comando.
+    """
+    key_columns = NATURAL_KEYS[key]
+    errors = []
+    positions = {}
+    unique_values, unique_lines = [], []
+    for product, line_num in zip(values, value_lines):
+        if key == 'sku' and not product['sku']:
+            errors.append((line_num, 'sku', SKU_REQUIRED))
+            continue
+        product_key = tuple(product[column] for column in key_columns)
+        index = positions.get(product_key)
+        if index is None:
+            positions[product_key] = len(unique_values)
+            unique_values.append(product)
+            unique_lines.append(line_num)
+        else:
+            errors.append((unique_lines[index], ','.join(key_columns), f"Chave repetida no arquivo; vale a linha {line_num}"))
+            unique_values[index], unique_lines[index] = product, line_num
+    return unique_values, unique_lines, errors
+
+
+def _new_skus(conn, values, value_lines, seen=None):
+    """Modo 'insert': tira do lote as linhas cujo SKU já existe (ux_product_sku).
+
+    Vale a primeira linha do arquivo; as seguintes com o mesmo SKU e as de
+    SKU já cadastrado viram erro na coluna sku. Lotes anteriores já estão
+    no banco; ``seen`` guarda os SKUs deles quando nada é gravado (dry_run).
+    """
+    skus = {product['sku'] for product in values if product['sku']}
+    if not skus:
+        return values, value_lines, []
+    ordered = sorted(skus)
+    in_use = set()
+    for start in range(0, len(ordered), SKU_QUERY_SIZE):
+        in_use.update(conn.execute(
+            select(product_table.c.sku).where(product_table.c.sku.in_(ordered[start:start + SKU_QUERY_SIZE]))
+        ).scalars())
+    errors = []
+    first_lines = {}
+    unique_values, unique_lines = [], []
+    for product, line_num in zip(values, value_lines):
+        sku = product['sku']
+        if sku in in_use or (seen is not None and sku in seen):
+            errors.append((line_num, 'sku', SKU_IN_USE))
+        elif sku in first_lines:
+            errors.append((line_num, 'sku', f"SKU repetido no arquivo; já está na linha {first_lines[sku]}"))
+        else:
+            if sku:
+                first_lines[sku] = line_num
+            unique_values.append(product)
+            unique_lines.append(line_num)
+    if seen is not None:
+        seen.update(first_lines)
+    return unique_values, unique_lines, errors
+
+
+def import_csv(session, stream, validate, clean_url, chunk_size=1000, before_commit=None, after_commit=None,
+               resume=None, mode='insert', key='sku', dry_run=False):
+    """Importa o CSV em lotes de chunk_size linhas lidas, um commit por lote.
+
+    ``validate(columns, count)`` valida cada lote por colunas (ver
+    product_validation.validate_columns) e ``clean_url`` normaliza
+    image_url, como nas rotas de produto.
+
+    ``mode`` 'insert' cria um produto por linha; 'upsert' atualiza os
+    produtos com a mesma chave natural (``key``: 'sku' ou 'name_category').
+    No upsert só as colunas presentes no CSV são atualizadas e, se a chave se
+    repete no mesmo lote, vale a última linha. ``dry_run`` desfaz cada lote
+    em vez de gravá-lo; o relatório traz o que aconteceria. No modo 'insert'
+    a simulação só valida e confere os SKUs contra o banco.
+
+    No modo 'insert' um SKU repetido no arquivo ou já cadastrado é erro da
+    linha (coluna sku), como na criação de um produto pela API; para
+    atualizar por SKU, use mode='upsert'.
+
+    ``before_commit(chunk, report)`` roda na transação de cada lote (pode
+    levantar exceção para desistir dele). ``chunk`` traz 'rows' (produtos
+    criados ou alterados), 'offset' e 'line_num', onde o lote seguinte
+    começa, e 'errors', os erros do lote como (linha, coluna, mensagem).
+    ``after_commit(report)`` roda depois de cada commit.
+
+    ``resume`` é o estado de um lote já gravado: offset, line_num,
+    fieldnames e os contadores do relatório. O arquivo é posicionado ali e
+    o cabeçalho não é relido.
+
+    Levanta CSVImportError se o cabeçalho não serve. Um erro de codificação
+    no meio do arquivo encerra a importação com status 'failed' e mantém os
+    lotes já gravados.
+    """
+    if mode not in IMPORT_MODES:
+        raise CSVImportError(f"Modo de importação inválido: {mode}")
+    if key not in NATURAL_KEYS:
+        raise CSVImportError(f"Chave de importação inválida: {key}")
+    upsert = mode == 'upsert'
+    key_columns = NATURAL_KEYS[key] if upsert else ()
+    required = REQUIRED_COLUMNS + tuple(column for column in key_columns if column not in REQUIRED_COLUMNS)
+
+    started = time.perf_counter()
+    resume = resume or {}
+    report = {
+        'status': 'running',
+        'mode': mode,
+        'key': key if upsert else None,
+        'dry_run': dry_run,
+        'rows_read': resume.get('rows_read', 0),
+        'created': resume.get('created', 0),
+        'updated': resume.get('updated', 0),
+        'unchanged': resume.get('unchanged', 0),
+        'error_count': resume.get('error_count', 0),
+        'errors': [],
+        'errors_by_column': {},
+        'changes': [],
+        'chunks': [],
+        'fieldnames': resume.get('fieldnames'),
+        'error': None
+    }
+    first_chunk = resume.get('chunks', 0) + 1
+    start_rows = report['rows_read']
+
+    if resume.get('offset'):
+        stream.seek(resume['offset'])
+    lines = _Lines(stream, resume.get('offset', 0), resume.get('line_num', 0))
+    chunk_errors = []
+    seen_skus = set() if dry_run else None
+
+    def add_errors(errors):
+        report['error_count'] += len(errors)
+        chunk_errors.extend(errors)
+        by_column = report['errors_by_column']
+        for _, column, _ in errors:
+            by_column[column] = by_column.get(column, 0) + 1
+        room = MAX_REPORTED_ERRORS - len(report['errors'])
+        report['errors'].extend(f"Linha {line_num}: {message}" for line_num, _, message in errors[:max(room, 0)])
+
+    def count(diff, sign):
+        report['created'] += sign * diff['inserted']
+        report['updated'] += sign * diff['updated']
+        report['unchanged'] += sign * diff['unchanged']
+
+    def flush(values, value_lines):
+        chunk = {'chunk': first_chunk + len(report['chunks']), 'rows': 0, 'status': 'committed',
+                 'offset': lines.offset, 'line_num': lines.line_num, 'errors': chunk_errors}
+        report['chunks'].append(chunk)
+        diff = {'inserted': len(values), 'updated': 0, 'unchanged': 0, 'changes': []}
+        counted = False
+        try:
+            if values and upsert:
+                diff = upsert_products(session, values, value_lines, key,
+                                       update_columns(report['fieldnames'], key), datetime.utcnow(), dry_run)
+            elif values and not dry_run:
+                insert_products(session, values)
+                facets.add_product_rows(session, [(row['category'], row['price']) for row in values])
+                image_store.acquire_many(session, [row['image_url'] for row in values])
+            chunk['rows'] = diff['inserted'] + diff['updated']
+            # Contadores antes do before_commit, que grava o progresso na mesma transação
+            count(diff, 1)
+            counted = True
+            if dry_run:
+                session.rollback()
+            else:
+                if before_commit:
+                    before_commit(chunk, report)
+                session.commit()
+        except Exception as e:
+            session.rollback()
+            if counted:
+                count(diff, -1)
+            chunk['rows'] = 0
+            chunk['status'] = 'failed'
+            report['status'] = 'failed'
+            report['error'] = f"Lote {chunk['chunk']} não gravado: {e}"
+            logger.error(f"Erro ao gravar lote {chunk['chunk']} da importação: {e}")
+            return False
+        finally:
+            del chunk['errors']
+        report['changes'].extend(diff['changes'][:max(MAX_REPORTED_CHANGES - len(report['changes']), 0)])
+        if after_commit and not dry_run:
+            after_commit(report)
+        return True
+
+    chunks = read_chunks(lines, report['fieldnames'], required, chunk_size)
+    try:
+        for fieldnames, line_nums, columns in chunks:
+            report['fieldnames'] = fieldnames
+            report['rows_read'] += len(line_nums)
+            values, value_lines, errors = prepare_chunk(line_nums, columns, validate, clean_url, datetime.utcnow())
+            if upsert:
+                values, value_lines, key_errors = _unique_keys(values, value_lines, key)
+            else:
+                values, value_lines, key_errors = _new_skus(session, values, value_lines, seen_skus)
+            errors = sorted(errors + key_errors, key=itemgetter(0))
+            add_errors(errors)
+            if not flush(values, value_lines):
+                break
+            chunk_errors = []
+    except CSVImportError as e:
+        if report['fieldnames'] is None:
+            raise
+        # Erro no meio do arquivo: o lote incompleto já foi gravado acima
+        report['status'] = 'failed'
+        report['error'] = str(e)
+    finally:
+        chunks.close()
+
+    if report['status'] == 'running':
+        report['status'] = 'done'
+    elapsed = time.perf_counter() - started
+    report['duration_ms'] = int(elapsed * 1000)
+    report['rows_per_sec'] = round((report['rows_read'] - start_rows) / elapsed) if elapsed else None
+    return report
@@ -0,0 +1,133 @@
+# facets.py
+"""Facetas de categoria (quantidade e faixa de preço) materializadas em category_facet.
+
+As funções recebem a sessão/conexão da transação em andamento e devem ser
+chamadas depois do flush da alteração no produto, antes do commit, para que o
+agregado seja gravado junto com o produto.
+"""
+from sqlalchemy import case, delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import CategoryFacet, Product
+
+facet_table = CategoryFacet.__table__
+
+
+def _key(category):
+    # Mesma regra do /api/categories: categorias em branco ficam de fora
+    return category if category and category.strip() else None
+
+
+def _recompute(conn, category):
+    """Recalcula uma categoria a partir dos produtos (usa o índice por categoria)"""
+    count, total, low, high = conn.execute(
+        select(func.count(Product.id), func.sum(Product.price), func.min(Product.price), func.max(Product.price))
+        .where(Product.category == category)
+    ).one()
+    conn.execute(delete(facet_table).where(facet_table.c.category == category))
+    if count:
+        conn.execute(insert(facet_table).values(
+            category=category, product_count=count, price_sum=total or 0, price_min=low, price_max=high
+        ))
+
+
+def add_products(conn, category, count, total, low, high):
+    """Soma produtos novos ao agregado da categoria"""
+    category = _key(category)
+    if not category or not count:
+        return
+
+    values = {
+        'product_count': facet_table.c.product_count + count,
+        'price_sum': facet_table.c.price_sum + total,
+        'price_min': case(
+            (facet_table.c.price_min.is_(None) | (facet_table.c.price_min > low), low),
+            else_=facet_table.c.price_min
+        ),
+        'price_max': case(
+            (facet_table.c.price_max.is_(None) | (facet_table.c.price_max < high), high),
+            else_=facet_table.c.price_max
+        ),
+    }
+    result = conn.execute(update(facet_table).where(facet_table.c.category == category).values(**values))
+    if result.rowcount:
+        return
+
+    try:
+        with conn.begin_nested():
+            conn.execute(insert(facet_table).values(
+                category=category, product_count=count, price_sum=total, price_min=low, price_max=high
+            ))
+    except IntegrityError:
+        # Outra transação criou a linha ao mesmo tempo
+        conn.execute(update(facet_table).where(facet_table.c.category == category).values(**values))
+
+
+def remove_product(conn, category, price):
+    """Retira um produto do agregado; recalcula só se ele era o mínimo ou máximo.
+
+    Retorna True quando a categoria foi recalculada: o recálculo já reflete o
+    estado atual dos produtos, inclusive a nova versão do produto alterado.
+    """
+    category = _key(category)
+    if not category:
+        return False
+
+    row = conn.execute(
+        select(facet_table.c.product_count, facet_table.c.price_min, facet_table.c.price_max)
+        .where(facet_table.c.category == category)
+    ).first()
+    if row is None or row.product_count <= 1 or price <= row.price_min or price >= row.price_max:
+        _recompute(conn, category)
+        return True
+
+    conn.execute(update(facet_table).where(facet_table.c.category == category).values(
+        product_count=facet_table.c.product_count - 1,
+        price_sum=facet_table.c.price_sum - price,
+    ))
+    return False
+
+
+def apply_product_change(conn, old=None, new=None):
+    """Atualiza as facetas para uma escrita em produto. old/new: (categoria, preço) ou None"""
+    if old == new:
+        return
+    recomputed = None
+    if old is not None and remove_product(conn, old[0], old[1]):
+        recomputed = _key(old[0])
+    if new is not None and _key(new[0]) != recomputed:
+        add_products(conn, new[0], 1, new[1], new[1], new[1])
+
+
+def add_product_rows(conn, rows):
+    """Soma um lote de produtos novos (importação), um UPDATE por categoria"""
+    groups = {}
+    for category, price in rows:
+        category = _key(category)
+        if not category:
+            continue
+        count, total, low, high = groups.get(category, (0, 0.0, price, price))
+        groups[category] = (count + 1, total + price, min(low, price), max(high, price))
+
+    for category, (count, total, low, high) in groups.items():
+        add_products(conn, category, count, total, low, high)
+
+
+def recompute_categories(conn, categories):
+    """Recalcula as categorias afetadas por um lote de alterações (importação com atualização)"""
+    for category in sorted({_key(category) for category in categories} - {None}):
+        _recompute(conn, category)
+
+
+def rebuild(conn):
+    """Recria todas as facetas a partir da tabela de produtos"""
+    conn.execute(delete(facet_table))
+    conn.execute(insert(facet_table).from_select(
+        ['category', 'product_count', 'price_sum', 'price_min', 'price_max'],
+        select(
+            Product.category, func.count(Product.id), func.sum(Product.price),
+            func.min(Product.price), func.max(Product.price)
+        )
+        .where(func.trim(Product.category) != '')
+        .group_by(Product.category)
+    ))
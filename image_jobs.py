@@ -0,0 +1,279 @@
+# image_jobs.py
+"""Processamento de imagens fora das threads de requisição.
+
+O upload grava o arquivo original em uma pasta de staging (dentro de
+UPLOAD_FOLDER, mesmo sistema de arquivos) e enfileira um job em um pool de
+processos limitado. O processo filho decodifica, redimensiona e grava o JPEG
+em um arquivo temporário, que só então é renomeado atomicamente para
+UPLOAD_FOLDER; quem serve /uploads nunca vê uma imagem pela metade.
+
+O nome final vem do hash do JPEG gerado ("ab/<hash>.jpg"): a mesma foto
+enviada duas vezes resulta no mesmo arquivo, gravado uma vez só.
+
+Memória: MAX_CONTENT_LENGTH limita só o tamanho comprimido. JPEGs são
+decodificados já reduzidos (draft, escala 1/2, 1/4 ou 1/8 no próprio
+decodificador), e a imagem que ainda passar de max_pixels depois disso é
+recusada antes de ser decodificada.
+"""
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import ExifTags, Image, ImageOps
+
+from upload_storage import content_name, variant_name
+
+logger = logging.getLogger(__name__)
+
+MAX_IMAGE_SIZE = (800, 800)
+JPEG_QUALITY = 85
+# Caracteres do sha256 usados no nome do arquivo (128 bits)
+CONTENT_HASH_LENGTH = 32
+# Larguras dos derivados responsivos; a imagem base (até 800px) completa o srcset
+DERIVATIVE_WIDTHS = (160, 320, 640)
+WEBP_QUALITY = 80
+# Pixels decodificados aceitos por imagem (~96 MB em RGBA); JPEGs contam depois do draft
+MAX_DECODED_PIXELS = 24_000_000
+# Redução por draft/reduce() até este múltiplo do tamanho final (o padrão do Pillow); o LANCZOS faz o resto
+REDUCING_GAP = 2.0
+
+
+class QueueFull(Exception):
+    """Fila de imagens cheia; o cliente deve tentar de novo mais tarde"""
+
+
+class ImageTooLarge(ValueError):
+    """Imagem com mais pixels do que o limite de decodificação"""
+
+
+def open_reduced(image, box=MAX_IMAGE_SIZE, max_pixels=MAX_DECODED_PIXELS):
+    """Prepara uma imagem recém-aberta (ainda não decodificada) para caber em ``box``.
+
+    Em JPEGs pede ao decodificador a menor escala que ainda deixa pelo menos
+    REDUCING_GAP vezes o tamanho final; confere o limite de pixels e aplica a
+    orientação do EXIF. Retorna a imagem decodificada (outro objeto se foi girada).
+    """
+    width, height = image.size
+    orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+    if orientation in (5, 6, 7, 8):
+        # Rotação de 90°: a caixa final vale para a imagem já girada
+        box = (box[1], box[0])
+    scale = min(box[0] / width, box[1] / height, 1)
+    if image.format == 'JPEG' and scale < 1:
+        # Imagens muito alongadas (10000x2) dariam 0 no lado curto, e o draft divide por ele
+        image.draft('RGB' if image.mode == 'CMYK' else image.mode,
+                    (max(1, int(width * scale * REDUCING_GAP)), max(1, int(height * scale * REDUCING_GAP))))
+
+    width, height = image.size
+    if width * height > max_pixels:
+        raise ImageTooLarge(f"Imagem muito grande: {width}x{height} pixels (limite de {max_pixels // 1_000_000} MP)")
+    if orientation == 1:
+        image.load()
+        return image
+    return ImageOps.exif_transpose(image)
+
+
+def process_image_file(source_path, staging_folder, upload_folder, max_pixels=MAX_DECODED_PIXELS):
+    """Executa no processo filho: gera o JPEG final e os derivados e os move para a pasta de uploads.
+
+    Para cada largura em DERIVATIVE_WIDTHS menor que a da imagem base são
+    gerados "<nome>-<largura>w.jpg" e ".webp"; a base ganha também um WebP
+    "<nome>-<largura real>w.webp". A base é movida por último, então quando
+    ela aparece os derivados já estão no lugar. Se a base já existe (mesmo
+    conteúdo enviado antes), nada é gravado.
+    """
+    # O filho (spawn) não herda a configuração do Pillow; o limite de verdade
+    # é max_pixels, este só recusa cabeçalhos absurdos já na abertura
+    Image.MAX_IMAGE_PIXELS = max_pixels * 16
+    started_at = time.time()
+    outputs = []  # (arquivo temporário, nome final), na ordem em que serão movidos
+    try:
+        with Image.open(source_path) as original:
+            image = open_reduced(original, MAX_IMAGE_SIZE, max_pixels)
+
+            # Otimizar imagem
+            image.thumbnail(MAX_IMAGE_SIZE, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+
+            # Converter para RGB se necessário
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+
+            # Salvar com qualidade otimizada
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+            data = buffer.getvalue()
+            filename = content_name(hashlib.sha256(data).hexdigest()[:CONTENT_HASH_LENGTH])
+
+            deduplicated = os.path.exists(os.path.join(upload_folder, filename))
+            if not deduplicated:
+                for width in DERIVATIVE_WIDTHS:
+                    if width >= image.width:
+                        break
+                    derivative = image.copy()
+                    derivative.thumbnail((width, image.height), Image.Resampling.LANCZOS)
+                    outputs.append(_save(derivative, staging_folder, variant_name(filename, derivative.width, 'jpg'), 'JPEG'))
+                    outputs.append(_save(derivative, staging_folder, variant_name(filename, derivative.width, 'webp'), 'WEBP'))
+                outputs.append(_save(image, staging_folder, variant_name(filename, image.width, 'webp'), 'WEBP'))
+                outputs.append(_save(data, staging_folder, filename, 'JPEG'))
+
+        if outputs:
+            os.makedirs(os.path.join(upload_folder, os.path.dirname(filename)), exist_ok=True)
+        for partial_path, name in outputs:
+            os.replace(partial_path, os.path.join(upload_folder, name))
+    finally:
+        for path in [source_path] + [partial_path for partial_path, _ in outputs]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return {
+        'started_at': started_at,
+        'finished_at': time.time(),
+        'filename': filename,
+        'size_bytes': len(data),
+        'deduplicated': deduplicated,
+        'variants': [name for _, name in outputs[:-1]]
+    }
+
+
+def _save(image, staging_folder, name, image_format):
+    """Grava em staging (o nome final pode ter "/", o temporário não); aceita bytes prontos"""
+    partial_path = os.path.join(staging_folder, name.replace('/', '_') + '.part')
+    if isinstance(image, bytes):
+        with open(partial_path, 'wb') as f:
+            f.write(image)
+    elif image_format == 'JPEG':
+        image.save(partial_path, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    else:
+        image.save(partial_path, 'WEBP', quality=WEBP_QUALITY, method=4)
+    return partial_path, name
+
+
+class ImageJobQueue:
+    """Pool de processos por worker do gunicorn, com limite de jobs pendentes.
+
+    O pool é criado sob demanda (depois do fork do preload_app) e recriado se
+    um processo filho morrer. Com max_workers=0 o processamento é feito na
+    própria thread da requisição.
+    """
+
+    def __init__(self, upload_folder, max_workers=2, max_pending=16, max_pixels=MAX_DECODED_PIXELS):
+        self.upload_folder = upload_folder
+        self.max_pixels = max_pixels
+        self.staging_folder = os.path.join(upload_folder, '.staging')
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._pending = 0
+        self._timings = deque(maxlen=100)
+        self._lock = threading.Lock()
+        self._slot_free = threading.Condition(self._lock)
+        self._executor = None
+        self._pid = None
+        os.makedirs(self.staging_folder, exist_ok=True)
+
+    def staging_path(self, job_id):
+        """Caminho onde o upload original do job deve ser gravado"""
+        return os.path.join(self.staging_folder, job_id + '.upload')
+
+    def _get_executor(self):
+        if self._executor is None or self._pid != os.getpid():
+            # spawn: o filho não herda conexões nem locks do worker
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            self._pid = os.getpid()
+        return self._executor
+
+    def submit(self, job_id, on_done, wait=0):
+        """Enfileira o job; on_done(job_id, result, error) é chamado ao terminar.
+
+        Retorna um Future resolvido com o resultado depois que on_done roda.
+        Se já houver max_pending jobs neste worker, espera até ``wait``
+        segundos por uma vaga e então levanta QueueFull.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._slot_free.wait_for(lambda: self._pending < self.max_pending, timeout=wait)
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise QueueFull(f"Fila de imagens cheia ({self._pending} pendentes)")
+            self._pending += 1
+            self.submitted += 1
+
+        done = Future()
+        args = (self.staging_path(job_id), self.staging_folder, self.upload_folder, self.max_pixels)
+        if not self.max_workers:
+            try:
+                result, error = process_image_file(*args), None
+            except Exception as e:
+                result, error = None, e
+            self._finish(job_id, result, error, on_done, done)
+            return done
+
+        try:
+            try:
+                future = self._get_executor().submit(process_image_file, *args)
+            except BrokenProcessPool:
+                # Um filho morreu (OOM, kill); recria o pool e tenta uma vez
+                self._executor = None
+                future = self._get_executor().submit(process_image_file, *args)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+                self._slot_free.notify()
+            raise
+        future.add_done_callback(
+            lambda f: self._finish(job_id, None if f.exception() else f.result(), f.exception(), on_done, done)
+        )
+        return done
+
+    def _finish(self, job_id, result, error, on_done, done):
+        with self._lock:
+            self._pending -= 1
+            self._slot_free.notify()
+            if error is None:
+                self.completed += 1
+                self._timings.append((result['finished_at'] - result['started_at']) * 1000)
+            else:
+                self.failed += 1
+        if error is not None:
+            # O filho pode ter morrido antes de apagar o original
+            try:
+                os.remove(self.staging_path(job_id))
+            except FileNotFoundError:
+                pass
+        try:
+            on_done(job_id, result, error)
+        except Exception as e:
+            logger.error(f"Erro ao finalizar job de imagem {job_id}: {e}")
+        if error is None:
+            done.set_result(result)
+        else:
+            done.set_exception(error)
+
+    def stats(self):
+        with self._lock:
+            timings = sorted(self._timings)
+            return {
+                'workers': self.max_workers,
+                'pending': self._pending,
+                'max_pending': self.max_pending,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'processing_ms_avg': round(sum(timings) / len(timings), 1) if timings else None,
+                'processing_ms_p95': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 1) if timings else None
+            }
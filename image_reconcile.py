@@ -0,0 +1,343 @@
+# image_reconcile.py
+"""Reconciliação entre as imagens usadas pelos produtos e a pasta de uploads.
+
+Roda em segundo plano (background.PeriodicTask) e grava o resultado em
+image_issue: produtos que apontam para um arquivo inexistente ("missing") e
+arquivos que nenhum produto usa ("orphan"). As rotas de admin só leem esse
+relatório; a remoção dos órfãos é uma ação separada (collect_orphans).
+
+É incremental: confere os produtos com updated_at posterior à execução
+anterior e relê só as pastas cujo mtime mudou (a raiz e cada shard "ab/").
+Uma imagem que deixa de ser usada não muda o mtime de pasta nenhuma; esses
+candidatos vêm de stored_image com ref_count 0. De tempos em tempos (ou com
+full=True) tudo é conferido de novo.
+
+Arquivos mais novos que orphan_grace segundos não contam como órfãos: o
+upload acontece antes de o produto ser salvo. A pasta fica marcada para ser
+relida na próxima execução.
+
+Como em image_store.py, as funções recebem a sessão/conexão; o commit fica
+com quem chama.
+"""
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, func, insert, or_, select, true, update
+from sqlalchemy.exc import IntegrityError
+
+from models import ImageIssue, ImageJob, ImageReconcileState, Product, StoredImage
+from upload_storage import parse_variant
+
+logger = logging.getLogger(__name__)
+
+STATE_ID = 1
+issue_table = ImageIssue.__table__
+state_table = ImageReconcileState.__table__
+stored_table = StoredImage.__table__
+# Folga no marcador de updated_at para escritas que ainda não tinham feito commit
+WATERMARK_MARGIN = timedelta(minutes=1)
+# URLs gravadas com o caminho do navegador (ver clean_image_url); o arquivo fica na raiz
+DIRTY_URL_FILTER = or_(
+    Product.image_url.ilike('%fakepath%'),
+    Product.image_url.like('C:/%'),
+    Product.image_url.like('file:///%')
+)
+
+
+def _dir_mtimes(upload_folder):
+    """{subpasta: mtime_ns} da raiz ('') e das subpastas de shard, sem as ocultas"""
+    mtimes = {'': os.stat(upload_folder).st_mtime_ns}
+    with os.scandir(upload_folder) as entries:
+        for entry in entries:
+            if entry.is_dir() and not entry.name.startswith('.'):
+                mtimes[entry.name] = entry.stat().st_mtime_ns
+    return mtimes
+
+
+class _Listings:
+    """Conteúdo das pastas lidas nesta execução: {nome: (tamanho, mtime)}, lidas sob demanda"""
+
+    def __init__(self, upload_folder):
+        self.upload_folder = upload_folder
+        self._dirs = {}
+        self._variants = {}
+
+    def files(self, subdir):
+        if subdir not in self._dirs:
+            path = os.path.join(self.upload_folder, subdir) if subdir else self.upload_folder
+            prefix = subdir + '/' if subdir else ''
+            files = {}
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.name.startswith('.') or not entry.is_file():
+                            continue
+                        stat = entry.stat()
+                        files[prefix + entry.name] = (stat.st_size, stat.st_mtime)
+            except FileNotFoundError:
+                pass
+            variants = {}
+            for name in files:
+                parsed = parse_variant(name)
+                if parsed and parsed[0] in files:
+                    variants.setdefault(parsed[0], []).append(name)
+            self._dirs[subdir] = files
+            self._variants[subdir] = variants
+        return self._dirs[subdir]
+
+    def variants(self, name):
+        """Derivados existentes de uma imagem base"""
+        subdir = os.path.dirname(name)
+        self.files(subdir)
+        return self._variants[subdir].get(name, [])
+
+    def exists(self, name):
+        return name in self.files(os.path.dirname(name))
+
+    def stat(self, name):
+        return self.files(os.path.dirname(name)).get(name)
+
+
+def _dir_condition(subdir):
+    """Produtos cujas imagens ficam na subpasta (faixa em image_url, atendida pelo índice)"""
+    if subdir:
+        # '0' é o caractere seguinte a '/': cobre exatamente "ab/..."
+        return and_(Product.image_url >= subdir + '/', Product.image_url < subdir + '0')
+    return or_(~Product.image_url.contains('/'), DIRTY_URL_FILTER)
+
+
+def _iter_products(conn, condition, batch_size):
+    """(id, nome, image_url) dos produtos com imagem que atendem à condição, em lotes por id"""
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(Product.id, Product.name, Product.image_url)
+            .where(condition, Product.id > last_id, Product.image_url.is_not(None), Product.image_url != '')
+            .order_by(Product.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def _check_missing(conn, rows, listings, clean_url, now):
+    """Refaz as linhas "missing" de um lote de produtos; retorna quantas faltam"""
+    conn.execute(delete(issue_table).where(
+        issue_table.c.kind == 'missing',
+        issue_table.c.product_id.in_([product_id for product_id, _, _ in rows])
+    ))
+    missing = []
+    for product_id, name, image_url in rows:
+        filename = clean_url(image_url)
+        if filename and not listings.exists(filename):
+            missing.append({'kind': 'missing', 'filename': filename, 'product_id': product_id,
+                            'product_name': name, 'detected_at': now})
+    if missing:
+        conn.execute(insert(issue_table), missing)
+    return len(missing)
+
+
+def _referenced(conn, names, clean_url, batch_size):
+    """Quais dos nomes algum produto usa"""
+    names = list(names)
+    used = set()
+    for start in range(0, len(names), batch_size):
+        used.update(conn.execute(
+            select(Product.image_url).where(Product.image_url.in_(names[start:start + batch_size]))
+        ).scalars())
+    if any('/' not in name for name in names):
+        used.update(clean_url(url) for url in conn.execute(select(Product.image_url).where(DIRTY_URL_FILTER)).scalars())
+    return used
+
+
+def _update_totals(conn):
+    totals = {kind: (count, size) for kind, count, size in conn.execute(
+        select(issue_table.c.kind, func.count(), func.coalesce(func.sum(issue_table.c.size_bytes), 0))
+        .group_by(issue_table.c.kind)
+    )}
+    conn.execute(update(state_table).where(state_table.c.id == STATE_ID).values(
+        missing_count=totals.get('missing', (0, 0))[0],
+        orphan_count=totals.get('orphan', (0, 0))[0],
+        orphan_bytes=totals.get('orphan', (0, 0))[1]
+    ))
+    return totals
+
+
+def _ensure_state(conn):
+    if conn.execute(select(state_table.c.id).where(state_table.c.id == STATE_ID)).first() is None:
+        try:
+            with conn.begin_nested():
+                conn.execute(insert(state_table).values(id=STATE_ID, missing_count=0, orphan_count=0, orphan_bytes=0))
+        except IntegrityError:
+            pass
+
+
+def claim(conn, lease_seconds):
+    """Reserva a execução para este worker por até lease_seconds. Retorna True se conseguiu"""
+    _ensure_state(conn)
+    now = datetime.utcnow()
+    return conn.execute(
+        update(state_table)
+        .where(state_table.c.id == STATE_ID,
+               or_(state_table.c.lease_until.is_(None), state_table.c.lease_until < now))
+        .values(lease_until=now + timedelta(seconds=lease_seconds))
+    ).rowcount == 1
+
+
+def release_claim(conn, error=None):
+    conn.execute(update(state_table).where(state_table.c.id == STATE_ID).values(
+        lease_until=None, last_error=error
+    ))
+
+
+def reconcile(conn, upload_folder, clean_url, full=False, orphan_grace=86400, full_every=None, batch_size=500):
+    """Atualiza o relatório de imagens ausentes e órfãs; retorna um resumo da execução.
+
+    ``clean_url`` normaliza image_url como as rotas fazem. Com ``full_every``
+    (segundos), uma execução incremental vira completa se a última completa
+    for mais antiga que isso.
+    """
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    _ensure_state(conn)
+    state = conn.execute(select(state_table).where(state_table.c.id == STATE_ID)).first()
+    if state.products_watermark is None or (
+            full_every and (state.last_full_run_at is None or state.last_full_run_at < now - timedelta(seconds=full_every))):
+        full = True
+    previous_mtimes = {} if full or not state.dir_mtimes else json.loads(state.dir_mtimes)
+
+    current_mtimes = _dir_mtimes(upload_folder)
+    changed = {subdir for subdir in set(current_mtimes) | set(previous_mtimes)
+               if current_mtimes.get(subdir) != previous_mtimes.get(subdir)}
+    listings = _Listings(upload_folder)
+
+    # 1. Referências sem arquivo: produtos alterados e produtos cujas pastas mudaram
+    if full:
+        conditions = [true()]
+    else:
+        conditions = [Product.updated_at > state.products_watermark] + [_dir_condition(subdir) for subdir in sorted(changed)]
+    checked = set()
+    for condition in conditions:
+        for rows in _iter_products(conn, condition, batch_size):
+            rows = [row for row in rows if row[0] not in checked]
+            checked.update(product_id for product_id, _, _ in rows)
+            if rows:
+                _check_missing(conn, rows, listings, clean_url, now)
+    # Produtos removidos (ou que ficaram sem imagem) desde a última execução
+    conn.execute(delete(issue_table).where(
+        issue_table.c.kind == 'missing',
+        ~issue_table.c.product_id.in_(
+            select(Product.id).where(Product.image_url.is_not(None), Product.image_url != '')
+        )
+    ))
+
+    # 2. Arquivos sem referência: pastas alteradas, imagens com ref_count 0 e órfãos já conhecidos
+    candidates = set()
+    for subdir in changed:
+        for name in listings.files(subdir):
+            parsed = parse_variant(name)
+            if not (parsed and listings.exists(parsed[0])):
+                candidates.add(name)  # imagem base, arquivo antigo ou derivado sem base
+    candidates.update(conn.execute(select(stored_table.c.filename).where(stored_table.c.ref_count <= 0)).scalars())
+    candidates.update(conn.execute(select(issue_table.c.filename).where(issue_table.c.kind == 'orphan')).scalars())
+
+    used = _referenced(conn, candidates, clean_url, batch_size)
+    grace_limit = time.time() - orphan_grace
+    unsettled = set()
+    orphans = []
+    for name in sorted(candidates - used):
+        info = listings.stat(name)
+        if info is None:
+            continue
+        if info[1] > grace_limit:
+            unsettled.add(os.path.dirname(name))
+            continue
+        size = info[0] + sum(listings.stat(variant)[0] for variant in listings.variants(name))
+        orphans.append({'kind': 'orphan', 'filename': name, 'size_bytes': size, 'detected_at': now})
+    candidates = list(candidates)
+    for start in range(0, len(candidates), batch_size):
+        conn.execute(delete(issue_table).where(
+            issue_table.c.kind == 'orphan', issue_table.c.filename.in_(candidates[start:start + batch_size])
+        ))
+    if orphans:
+        conn.execute(insert(issue_table), orphans)
+
+    # 3. Estado para a próxima execução; pastas com arquivos recentes serão relidas
+    mtimes = {subdir: mtime for subdir, mtime in current_mtimes.items() if subdir not in unsettled}
+    values = {
+        'products_watermark': now - WATERMARK_MARGIN,
+        'dir_mtimes': json.dumps(mtimes),
+        'last_run_at': now,
+        'last_duration_ms': int((time.perf_counter() - started) * 1000)
+    }
+    if full:
+        values['last_full_run_at'] = now
+    conn.execute(update(state_table).where(state_table.c.id == STATE_ID).values(**values))
+    totals = _update_totals(conn)
+
+    return {
+        'full': full,
+        'products_checked': len(checked),
+        'dirs_scanned': len(changed),
+        'orphan_candidates': len(candidates),
+        'missing': totals.get('missing', (0, 0))[0],
+        'orphans': totals.get('orphan', (0, 0))[0],
+        'orphan_bytes': totals.get('orphan', (0, 0))[1],
+        'duration_ms': values['last_duration_ms']
+    }
+
+
+def collect_orphans(conn, upload_folder, orphan_grace=86400, dry_run=False):
+    """Apaga os arquivos listados como órfãos (e os derivados), conferindo cada um de novo.
+
+    Um órfão que voltou a ser usado, ou foi gerado há pouco por um upload,
+    sai do relatório sem ser apagado. Os arquivos são apagados antes do
+    commit de quem chama: se ele falhar, o relatório volta a apontá-los e
+    a próxima reconciliação os remove da lista. Retorna (nomes apagados, bytes).
+    """
+    listings = _Listings(upload_folder)
+    grace_limit = time.time() - orphan_grace
+    recent_jobs_limit = datetime.utcnow() - timedelta(seconds=orphan_grace)
+    removed = []
+    freed = 0
+    for issue_id, filename in conn.execute(
+            select(issue_table.c.id, issue_table.c.filename).where(issue_table.c.kind == 'orphan')).all():
+        info = listings.stat(filename)
+        in_use = (
+            info is None
+            or info[1] > grace_limit
+            or conn.execute(select(Product.id).where(Product.image_url == filename).limit(1)).first() is not None
+            or (conn.execute(select(stored_table.c.ref_count).where(stored_table.c.filename == filename)).scalar() or 0) > 0
+            # Reenvio de um conteúdo já existente: o job termina na hora, apontando para o arquivo antigo
+            or conn.execute(select(ImageJob.id).where(
+                ImageJob.filename == filename, ImageJob.finished_at > recent_jobs_limit).limit(1)).first() is not None
+        )
+        if dry_run:
+            if not in_use:
+                names = [filename] + listings.variants(filename)
+                removed.extend(names)
+                freed += sum(listings.stat(name)[0] for name in names)
+            continue
+
+        conn.execute(delete(issue_table).where(issue_table.c.id == issue_id))
+        if in_use:
+            continue
+        for name in [filename] + listings.variants(filename):
+            try:
+                freed += listings.stat(name)[0]
+                os.remove(os.path.join(upload_folder, name))
+                removed.append(name)
+            except FileNotFoundError:
+                pass
+        conn.execute(delete(stored_table).where(stored_table.c.filename == filename))
+
+    if not dry_run:
+        _ensure_state(conn)
+        _update_totals(conn)
+    return removed, freed
+
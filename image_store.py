@@ -0,0 +1,205 @@
+# image_store.py
+"""Imagens endereçadas por conteúdo, com contagem de referências.
+
+Os arquivos gerados pelo processamento de imagens ficam em
+UPLOAD_FOLDER/<2 primeiros caracteres do hash>/<hash>.jpg e têm uma linha em
+stored_image. ref_count conta os produtos que usam a imagem; como em
+facets.py, as funções recebem a sessão/conexão da transação em andamento e
+são chamadas depois do flush da alteração no produto, antes do commit.
+
+Arquivos antigos (nome aleatório na raiz de uploads) não têm linha em
+stored_image; para eles a verificação de uso consulta a tabela product.
+
+Conversão dos arquivos antigos para o novo formato:
+    python image_store.py --convert [--dry-run]
+"""
+import hashlib
+import logging
+import os
+import shutil
+import sys
+
+from sqlalchemy import case, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import Product, StoredImage
+from upload_storage import content_name, parse_variant, variant_name
+
+logger = logging.getLogger(__name__)
+
+stored_table = StoredImage.__table__
+
+
+def _change_refs(conn, filename, delta):
+    """Ajusta ref_count; retorna o novo valor, ou None se a imagem não é rastreada"""
+    new_count = stored_table.c.ref_count + delta
+    conn.execute(
+        update(stored_table)
+        .where(stored_table.c.filename == filename)
+        .values(ref_count=case((new_count < 0, 0), else_=new_count))
+    )
+    return conn.execute(
+        select(stored_table.c.ref_count).where(stored_table.c.filename == filename)
+    ).scalar()
+
+
+def acquire(conn, filename):
+    """Um produto passou a usar a imagem"""
+    if filename:
+        _change_refs(conn, filename, 1)
+
+
+def acquire_many(conn, filenames):
+    """Vários produtos passaram a usar imagens (importação em lote)"""
+    counts = {}
+    for filename in filenames:
+        if filename:
+            counts[filename] = counts.get(filename, 0) + 1
+    for filename, count in counts.items():
+        _change_refs(conn, filename, count)
+
+
+def release_many(conn, filenames):
+    """Vários produtos deixaram de usar imagens; as que ficarem sem uso vão para a limpeza de órfãos"""
+    counts = {}
+    for filename in filenames:
+        if filename:
+            counts[filename] = counts.get(filename, 0) + 1
+    for filename, count in counts.items():
+        _change_refs(conn, filename, -count)
+
+
+def release(conn, filename):
+    """Um produto deixou de usar a imagem. Retorna True se nenhum produto a usa mais"""
+    if not filename:
+        return False
+    ref_count = _change_refs(conn, filename, -1)
+    if ref_count is not None:
+        return ref_count == 0
+    # Arquivo antigo, sem contagem: confere direto nos produtos (índice em image_url)
+    return conn.execute(select(Product.id).where(Product.image_url == filename).limit(1)).first() is None
+
+
+def register(conn, filename, source_hash=None, size_bytes=None):
+    """Registra uma imagem recém-processada (ou atualiza o hash do original)"""
+    updated = conn.execute(
+        update(stored_table).where(stored_table.c.filename == filename).values(source_hash=source_hash)
+    ).rowcount
+    if updated:
+        return
+    # Produtos podem já apontar para o arquivo (reenvio depois de uma remoção)
+    ref_count = conn.execute(select(func.count(Product.id)).where(Product.image_url == filename)).scalar()
+    try:
+        with conn.begin_nested():
+            conn.execute(insert(stored_table).values(
+                filename=filename, source_hash=source_hash, size_bytes=size_bytes, ref_count=ref_count
+            ))
+    except IntegrityError:
+        # Outro worker registrou o mesmo conteúdo ao mesmo tempo
+        pass
+
+
+def find_by_source(conn, source_hash):
+    """Imagem já gerada a partir de um original idêntico, ou None"""
+    return conn.execute(
+        select(stored_table.c.filename).where(stored_table.c.source_hash == source_hash).limit(1)
+    ).scalar()
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _link(old_path, new_path):
+    """Cria o novo nome sem copiar o conteúdo, quando o sistema de arquivos permite"""
+    if os.path.exists(new_path):
+        return  # mesmo conteúdo já convertido
+    try:
+        os.link(old_path, new_path)
+    except OSError:
+        shutil.copyfile(old_path, new_path)
+
+
+def convert_legacy_files(conn, upload_folder, dry_run=False):
+    """Converte os arquivos da raiz de uploads para o formato endereçado por conteúdo.
+
+    O hash é o do arquivo já processado (não há reprocessamento); cópias
+    idênticas viram um arquivo só. Os novos nomes são criados como hard links
+    e os produtos são apontados para eles; os nomes antigos só devem ser
+    apagados depois do commit. Retorna ({antigo: novo}, nomes antigos a apagar).
+    """
+    # Evita importar image_jobs (Pillow) só por causa da constante
+    from image_jobs import CONTENT_HASH_LENGTH
+
+    renamed = {}
+    obsolete = []
+    with os.scandir(upload_folder) as entries:
+        names = sorted(entry.name for entry in entries if entry.is_file() and not entry.name.startswith('.'))
+    name_set = set(names)
+    variants = {}
+    for name in names:
+        parsed = parse_variant(name)
+        if parsed and parsed[0] in name_set:
+            variants.setdefault(parsed[0], []).append((name, parsed[1], parsed[2]))
+
+    for name in names:
+        parsed = parse_variant(name)
+        if parsed and parsed[0] in name_set:
+            continue  # derivado, convertido junto com a base
+        path = os.path.join(upload_folder, name)
+        with open(path, 'rb') as f:
+            is_jpeg = f.read(3) == b'\xff\xd8\xff'
+        ext = 'jpg' if is_jpeg else (name.rsplit('.', 1)[1].lower() if '.' in name else 'bin')
+        new_name = content_name(file_sha256(path)[:CONTENT_HASH_LENGTH], ext)
+        renamed[name] = new_name
+        if dry_run:
+            continue
+
+        os.makedirs(os.path.join(upload_folder, os.path.dirname(new_name)), exist_ok=True)
+        links = [(name, new_name)]
+        if is_jpeg:
+            links += [(variant, variant_name(new_name, width, variant_ext)) for variant, width, variant_ext in variants.get(name, ())]
+        for old, new in links:
+            _link(os.path.join(upload_folder, old), os.path.join(upload_folder, new))
+            obsolete.append(old)
+
+        conn.execute(update(Product.__table__).where(Product.image_url == name).values(image_url=new_name))
+        register(conn, new_name, size_bytes=os.path.getsize(path))
+        # register() conta os produtos só ao criar a linha; cópias idênticas somam aqui
+        conn.execute(
+            update(stored_table).where(stored_table.c.filename == new_name).values(
+                ref_count=select(func.count(Product.id)).where(Product.image_url == new_name).scalar_subquery()
+            )
+        )
+    return renamed, obsolete
+
+
+if __name__ == '__main__':
+    import app as app_module
+    from app import app, db
+
+    if '--convert' not in sys.argv:
+        print(__doc__)
+        sys.exit(1)
+
+    dry_run = '--dry-run' in sys.argv
+    with app.app_context():
+        upload_folder = app.config['UPLOAD_FOLDER']
+        renamed, obsolete = convert_legacy_files(db.session, upload_folder, dry_run=dry_run)
+        for old, new in renamed.items():
+            print(f"   {old} -> {new}")
+        if dry_run:
+            db.session.rollback()
+            print(f"🔍 {len(renamed)} arquivos seriam convertidos ({len(set(renamed.values()))} distintos)")
+        else:
+            app_module.bump_catalog_version()
+            db.session.commit()
+            app_module.cache.invalidate_tags('products')
+            for name in obsolete:
+                os.remove(os.path.join(upload_folder, name))
+            app_module.upload_index.build()
+            print(f"✅ {len(renamed)} arquivos convertidos ({len(set(renamed.values()))} distintos)")
@@ -0,0 +1,257 @@
+# migrations.py
+"""Migrações versionadas do schema.
+
+db.create_all() só cria tabelas novas; índices e colunas adicionados depois
+precisam ser aplicados em bancos que já existem. Cada migração roda uma única
+vez e fica registrada em schema_migrations. No PostgreSQL os índices são
+criados com CREATE INDEX CONCURRENTLY, sem bloquear escritas.
+
+Uso:
+    python migrations.py            # aplica migrações pendentes
+    python migrations.py --report   # mostra quais consultas usam cada índice
+"""
+import logging
+import sys
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+
+import facets
+from models import SchemaMigration
+
+logger = logging.getLogger(__name__)
+
+# Chave arbitrária do advisory lock, impede dois workers migrando ao mesmo tempo
+MIGRATION_LOCK_KEY = 734002
+
+
+class IndexSpec:
+    """Índice a ser criado, com as consultas que ele atende (para o relatório)"""
+
+    def __init__(self, name, table, columns, unique=False, serves=()):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.unique = unique
+        self.serves = serves
+
+
+class Migration:
+    def __init__(self, version, name, indexes=(), run=None):
+        self.version = version
+        self.name = name
+        self.indexes = indexes
+        self.run = run
+
+
+# (descrição, SQL de exemplo) das consultas quentes do app.py
+PRODUCT_LIST_QUERY = (
+    "GET /api/products (listagem e paginação por created_at, id)",
+    "SELECT id FROM product WHERE created_at < '2100-01-01' "
+    "ORDER BY created_at DESC, id DESC LIMIT 50",
+)
+PRODUCT_CATEGORY_QUERY = (
+    "GET /api/products?category= (filtro por categoria)",
+    "SELECT id FROM product WHERE category = 'Bebidas' "
+    "ORDER BY created_at DESC, id DESC LIMIT 50",
+)
+CATEGORY_DISTINCT_QUERY = (
+    "GET /api/categories (DISTINCT category)",
+    "SELECT DISTINCT category FROM product",
+)
+ADMIN_COUNT_QUERY = (
+    "demote_user / toggle_user (contagem de admins ativos)",
+    'SELECT count(*) FROM "user" WHERE is_admin = true AND is_active = true',
+)
+IMAGE_IN_USE_QUERY = (
+    "delete_product (outro produto usa a mesma imagem?)",
+    "SELECT id FROM product WHERE image_url = 'ab/abcdef.jpg' LIMIT 1",
+)
+SKU_LOOKUP_QUERY = (
+    "Importação CSV com atualização por SKU (ON CONFLICT e diff)",
+    "SELECT id FROM product WHERE sku = 'ABC-123'",
+)
+NAME_CATEGORY_LOOKUP_QUERY = (
+    "Importação CSV com atualização por nome + categoria (diff)",
+    "SELECT id FROM product WHERE name = 'Café' AND category = 'Bebidas'",
+)
+CHANGED_SINCE_QUERY = (
+    "GET /api/admin/export?since= (backup incremental)",
+    "SELECT id FROM product WHERE updated_at >= '2024-01-01' ORDER BY updated_at, id",
+)
+USER_LIST_QUERY = (
+    "GET /api/admin/users (ordem por created_at)",
+    'SELECT id FROM "user" ORDER BY created_at DESC',
+)
+
+MIGRATIONS = [
+    Migration(1, 'product_listing_indexes', indexes=[
+        IndexSpec('ix_product_created_at_id', 'product', ['created_at', 'id'],
+                  serves=[PRODUCT_LIST_QUERY]),
+        IndexSpec('ix_product_category_created_at_id', 'product', ['category', 'created_at', 'id'],
+                  serves=[PRODUCT_CATEGORY_QUERY, CATEGORY_DISTINCT_QUERY]),
+    ]),
+    Migration(2, 'user_admin_indexes', indexes=[
+        IndexSpec('ix_user_is_admin_is_active', 'user', ['is_admin', 'is_active'],
+                  serves=[ADMIN_COUNT_QUERY]),
+        IndexSpec('ix_user_created_at', 'user', ['created_at'],
+                  serves=[USER_LIST_QUERY]),
+    ]),
+    # Carga inicial; depois disso as escritas em produtos mantêm o agregado
+    Migration(3, 'category_facets', run=facets.rebuild),
+    Migration(4, 'product_image_url_index', indexes=[
+        IndexSpec('ix_product_image_url', 'product', ['image_url'],
+                  serves=[IMAGE_IN_USE_QUERY]),
+    ]),
+    Migration(5, 'product_sku_column', run=lambda conn: _add_columns(conn, 'product', [
+        ('sku', 'VARCHAR(64)'),
+    ])),
+    # Índice único parcial na prática: vários produtos podem ficar sem SKU (NULL)
+    Migration(6, 'product_natural_key_indexes', indexes=[
+        IndexSpec('ux_product_sku', 'product', ['sku'], unique=True,
+                  serves=[SKU_LOOKUP_QUERY]),
+        IndexSpec('ix_product_name_category', 'product', ['name', 'category'],
+                  serves=[NAME_CATEGORY_LOOKUP_QUERY]),
+    ]),
+    Migration(7, 'import_job_upsert_columns', run=lambda conn: _add_columns(conn, 'import_job', [
+        ('updated_count', 'INTEGER NOT NULL DEFAULT 0'),
+        ('unchanged_count', 'INTEGER NOT NULL DEFAULT 0'),
+        ('options', 'TEXT'),
+    ])),
+    Migration(8, 'import_job_error_column', run=lambda conn: _add_columns(conn, 'import_job_error', [
+        ('column', 'VARCHAR(100)'),
+    ])),
+    Migration(9, 'product_updated_at_index', indexes=[
+        IndexSpec('ix_product_updated_at', 'product', ['updated_at'],
+                  serves=[CHANGED_SINCE_QUERY]),
+    ]),
+    Migration(10, 'catalog_state_restored_at', run=lambda conn: _add_columns(conn, 'catalog_state', [
+        ('restored_at', 'TIMESTAMP'),
+    ])),
+]
+
+
+def _add_columns(conn, table, columns):
+    """ALTER TABLE ADD COLUMN das colunas que faltam (o create_all já as cria em bancos novos)"""
+    existing = {column['name'] for column in inspect(conn).get_columns(table)}
+    quote = conn.dialect.identifier_preparer.quote
+    for name, ddl in columns:
+        if name not in existing:
+            conn.execute(text(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(name)} {ddl}"))
+
+
+def _create_index(engine, index):
+    quote = engine.dialect.identifier_preparer.quote
+    columns = ', '.join(quote(column) for column in index.columns)
+    unique = 'UNIQUE ' if index.unique else ''
+
+    if engine.dialect.name == 'postgresql':
+        # CONCURRENTLY não pode rodar dentro de transação
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            # Um CREATE INDEX CONCURRENTLY interrompido deixa o índice inválido
+            invalid = conn.execute(text(
+                "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE c.relname = :name AND NOT i.indisvalid"
+            ), {'name': index.name}).first()
+            if invalid:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {quote(index.name)}"))
+            conn.execute(text(
+                f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {quote(index.name)} "
+                f"ON {quote(index.table)} ({columns})"
+            ))
+    else:
+        with engine.begin() as conn:
+            conn.execute(text(
+                f"CREATE {unique}INDEX IF NOT EXISTS {quote(index.name)} "
+                f"ON {quote(index.table)} ({columns})"
+            ))
+
+
+def _applied_versions(engine):
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def _apply(engine, migration):
+    for index in migration.indexes:
+        _create_index(engine, index)
+    if migration.run:
+        with engine.begin() as conn:
+            migration.run(conn)
+
+    try:
+        with engine.begin() as conn:
+            conn.execute(SchemaMigration.__table__.insert().values(
+                version=migration.version, name=migration.name, applied_at=datetime.utcnow()
+            ))
+    except IntegrityError:
+        # Outro worker registrou a mesma migração; os passos são idempotentes
+        pass
+
+
+def run_migrations(engine):
+    """Aplica as migrações pendentes. Retorna a lista das que foram aplicadas"""
+    SchemaMigration.__table__.create(engine, checkfirst=True)
+
+    lock_conn = None
+    if engine.dialect.name == 'postgresql':
+        lock_conn = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {'key': MIGRATION_LOCK_KEY})
+
+    applied = []
+    try:
+        done = _applied_versions(engine)
+        for migration in MIGRATIONS:
+            if migration.version in done:
+                continue
+            logger.info(f"🛠️ Aplicando migração {migration.version}: {migration.name}")
+            _apply(engine, migration)
+            applied.append(migration.name)
+    finally:
+        if lock_conn is not None:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': MIGRATION_LOCK_KEY})
+            lock_conn.close()
+
+    return applied
+
+
+def index_report(engine):
+    """Plano de execução de cada consulta atendida pelos índices das migrações"""
+    if engine.dialect.name == 'postgresql':
+        explain = "EXPLAIN "
+    else:
+        explain = "EXPLAIN QUERY PLAN "
+
+    report = []
+    with engine.connect() as conn:
+        for migration in MIGRATIONS:
+            for index in migration.indexes:
+                for description, sql in index.serves:
+                    plan = [' '.join(str(col) for col in row) for row in conn.execute(text(explain + sql))]
+                    report.append({
+                        'index': index.name,
+                        'query': description,
+                        'sql': sql,
+                        'uses_index': any(index.name in line for line in plan),
+                        'plan': plan,
+                    })
+    return report
+
+
+if __name__ == '__main__':
+    from app import app, db
+
+    with app.app_context():
+        if '--report' in sys.argv:
+            print("=== ÍNDICES E CONSULTAS ATENDIDAS ===")
+            for item in index_report(db.engine):
+                status = "✅" if item['uses_index'] else "⚠️ (plano não usa o índice)"
+                print(f"\n{item['index']} {status}")
+                print(f"   {item['query']}")
+                print(f"   {item['sql']}")
+                for line in item['plan']:
+                    print(f"      {line}")
+        else:
+            applied = run_migrations(db.engine)
+            print(f"✅ {len(applied)} migrações aplicadas" if applied else "✅ Nenhuma migração pendente")
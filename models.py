@@ -1,3 +1,4 @@
+import json
 import os
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
@@ -7,6 +8,10 @@ db = SQLAlchemy()
 
 class User(db.Model):
     __tablename__ = 'user'
+    __table_args__ = (
+        db.Index('ix_user_is_admin_is_active', 'is_admin', 'is_active'),
+        db.Index('ix_user_created_at', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -35,6 +40,14 @@ class User(db.Model):
 
 class Product(db.Model):
     __tablename__ = 'product'
+    __table_args__ = (
+        db.Index('ix_product_created_at_id', 'created_at', 'id'),
+        db.Index('ix_product_category_created_at_id', 'category', 'created_at', 'id'),
+        db.Index('ix_product_image_url', 'image_url'),
+        db.Index('ux_product_sku', 'sku', unique=True),
+        db.Index('ix_product_name_category', 'name', 'category'),
+        db.Index('ix_product_updated_at', 'updated_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -42,6 +55,7 @@ class Product(db.Model):
     price = db.Column(db.Float, nullable=False)
     category = db.Column(db.String(50), nullable=True)
     image_url = db.Column(db.String(200), nullable=True)
+    sku = db.Column(db.String(64), nullable=True)  # código do fornecedor; chave da importação com atualização
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -53,6 +67,227 @@ class Product(db.Model):
             'price': self.price,
             'category': self.category,
             'image_url': self.image_url,
+            'sku': self.sku,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
-        }
\ No newline at end of file
+        }
+
+class ProductTombstone(db.Model):
+    __tablename__ = 'product_tombstone'
+    __table_args__ = (
+        db.Index('ix_product_tombstone_deleted_at', 'deleted_at'),
+    )
+    
+    # Produto excluído, para o backup incremental replicar a exclusão
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class CatalogState(db.Model):
+    __tablename__ = 'catalog_state'
+    
+    # Linha única (id=1) compartilhada por todos os workers
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    restored_at = db.Column(db.DateTime, nullable=True)  # última restauração de backup (/api/admin/restore)
+
+class CategoryFacet(db.Model):
+    __tablename__ = 'category_facet'
+    
+    # Agregado por categoria, mantido incrementalmente pelas escritas em produtos
+    category = db.Column(db.String(50), primary_key=True)
+    product_count = db.Column(db.Integer, nullable=False, default=0)
+    price_sum = db.Column(db.Float, nullable=False, default=0)
+    price_min = db.Column(db.Float, nullable=True)
+    price_max = db.Column(db.Float, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'category': self.category,
+            'product_count': self.product_count,
+            'min_price': self.price_min,
+            'max_price': self.price_max,
+            'avg_price': round(self.price_sum / self.product_count, 2) if self.product_count else None
+        }
+
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+    
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ImageJob(db.Model):
+    __tablename__ = 'image_job'
+    __table_args__ = (
+        db.Index('ix_image_job_status_created_at', 'status', 'created_at'),
+    )
+    
+    # Processamento de imagem enviado ao pool de processos; status consultado por qualquer worker
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued | done | failed
+    original_name = db.Column(db.String(200), nullable=True)
+    source_hash = db.Column(db.String(64), nullable=True)
+    filename = db.Column(db.String(200), nullable=True)  # conhecido quando o job termina
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    queue_ms = db.Column(db.Integer, nullable=True)
+    processing_ms = db.Column(db.Integer, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'original_name': self.original_name,
+            'filename': self.filename,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'queue_ms': self.queue_ms,
+            'processing_ms': self.processing_ms
+        }
+
+class StoredImage(db.Model):
+    __tablename__ = 'stored_image'
+    
+    # Imagem endereçada por conteúdo ("ab/<hash>.jpg"), com contagem de produtos que a usam
+    filename = db.Column(db.String(200), primary_key=True)
+    source_hash = db.Column(db.String(64), nullable=True, index=True)  # sha256 do último upload original
+    size_bytes = db.Column(db.Integer, nullable=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ImageIssue(db.Model):
+    __tablename__ = 'image_issue'
+    __table_args__ = (
+        db.Index('ix_image_issue_kind_filename', 'kind', 'filename'),
+        db.Index('ix_image_issue_product_id', 'product_id'),
+    )
+    
+    # Relatório do reconciliador de imagens: referência sem arquivo ou arquivo sem referência
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)  # missing | orphan
+    filename = db.Column(db.String(200), nullable=False)
+    product_id = db.Column(db.Integer, nullable=True)  # só em missing
+    product_name = db.Column(db.String(100), nullable=True)
+    size_bytes = db.Column(db.BigInteger, nullable=True)  # só em orphan, somando os derivados
+    detected_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'kind': self.kind,
+            'filename': self.filename,
+            'product_id': self.product_id,
+            'product_name': self.product_name,
+            'size_bytes': self.size_bytes,
+            'detected_at': self.detected_at.isoformat() if self.detected_at else None
+        }
+
+class ImageReconcileState(db.Model):
+    __tablename__ = 'image_reconcile_state'
+    
+    # Linha única (id=1): onde a última reconciliação parou e lease para um worker por vez
+    id = db.Column(db.Integer, primary_key=True)
+    products_watermark = db.Column(db.DateTime, nullable=True)  # produtos com updated_at maior são reconferidos
+    dir_mtimes = db.Column(db.Text, nullable=True)  # JSON {subpasta: mtime_ns}
+    lease_until = db.Column(db.DateTime, nullable=True)
+    last_run_at = db.Column(db.DateTime, nullable=True)
+    last_full_run_at = db.Column(db.DateTime, nullable=True)
+    last_duration_ms = db.Column(db.Integer, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    missing_count = db.Column(db.Integer, nullable=False, default=0)
+    orphan_count = db.Column(db.Integer, nullable=False, default=0)
+    orphan_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'last_run_at': self.last_run_at.isoformat() if self.last_run_at else None,
+            'last_full_run_at': self.last_full_run_at.isoformat() if self.last_full_run_at else None,
+            'last_duration_ms': self.last_duration_ms,
+            'last_error': self.last_error,
+            'running': bool(self.lease_until and self.lease_until > datetime.utcnow()),
+            'missing_count': self.missing_count,
+            'orphan_count': self.orphan_count,
+            'orphan_bytes': self.orphan_bytes
+        }
+
+class ImportJob(db.Model):
+    __tablename__ = 'import_job'
+    __table_args__ = (
+        db.Index('ix_import_job_status_lease_until', 'status', 'lease_until'),
+        db.Index('ix_import_job_created_at', 'created_at'),
+    )
+    
+    # Importação de CSV em segundo plano; offset/line_num marcam o fim do último lote gravado
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued | running | done | failed
+    original_name = db.Column(db.String(200), nullable=True)
+    size_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    offset = db.Column(db.BigInteger, nullable=False, default=0)
+    line_num = db.Column(db.Integer, nullable=False, default=0)
+    fieldnames = db.Column(db.Text, nullable=True)  # JSON do cabeçalho, para retomar sem relê-lo
+    rows_read = db.Column(db.Integer, nullable=False, default=0)
+    created_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_count = db.Column(db.Integer, nullable=False, default=0)
+    unchanged_count = db.Column(db.Integer, nullable=False, default=0)
+    options = db.Column(db.Text, nullable=True)  # JSON: mode (insert | upsert) e key
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    chunks = db.Column(db.Integer, nullable=False, default=0)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    owner = db.Column(db.String(32), nullable=True)  # execução atual; outra que assumir o job troca o valor
+    lease_until = db.Column(db.DateTime, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_by = db.Column(db.String(80), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        progress = self.offset / self.size_bytes if self.size_bytes else 0
+        if self.status == 'done':
+            progress = 1
+        eta_seconds = None
+        if self.status == 'running' and self.started_at and self.updated_at and 0 < progress < 1:
+            elapsed = (self.updated_at - self.started_at).total_seconds()
+            eta_seconds = round(elapsed * (1 - progress) / progress)
+        return {
+            'id': self.id,
+            'status': self.status,
+            'original_name': self.original_name,
+            'size_bytes': self.size_bytes,
+            'bytes_processed': self.offset,
+            'progress': round(progress, 4),
+            'eta_seconds': eta_seconds,
+            'rows_read': self.rows_read,
+            'created': self.created_count,
+            'updated': self.updated_count,
+            'unchanged': self.unchanged_count,
+            'options': json.loads(self.options) if self.options else None,
+            'error_count': self.error_count,
+            'chunks': self.chunks,
+            'attempts': self.attempts,
+            'error': self.error,
+            'created_by': self.created_by,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class ImportJobError(db.Model):
+    __tablename__ = 'import_job_error'
+    __table_args__ = (
+        db.Index('ix_import_job_error_job_id_line_num', 'job_id', 'line_num'),
+    )
+    
+    # Linhas recusadas de uma importação, gravadas no mesmo commit do lote
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(32), nullable=False)
+    line_num = db.Column(db.Integer, nullable=False)
+    column = db.Column(db.String(100), nullable=True)  # coluna do CSV com o problema
+    message = db.Column(db.Text, nullable=False)
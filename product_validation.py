@@ -0,0 +1,113 @@
+# product_validation.py
+"""Regras de validação de produtos: por produto (API JSON) e por colunas (importação CSV).
+
+validate_columns aplica as mesmas regras a um lote inteiro, coluna por
+coluna: cada verificação é uma passada em C sobre a lista de valores (map,
+compress), o preço é convertido uma vez só e o resultado já serve para o
+INSERT. Nenhuma exceção por linha inválida, a não ser no preço, e só quando o
+lote tem algum valor que não é número.
+"""
+import math
+from itertools import compress, count, repeat
+from operator import is_, itemgetter, not_
+
+NAME_MAX_LENGTH = 100
+CATEGORY_MAX_LENGTH = 50
+SKU_MAX_LENGTH = 64
+
+NAME_REQUIRED = "Nome é obrigatório"
+PRICE_NOT_POSITIVE = "Preço deve ser maior que zero"
+PRICE_INVALID = "Preço deve ser um número válido"
+NAME_TOO_LONG = f"Nome deve ter no máximo {NAME_MAX_LENGTH} caracteres"
+CATEGORY_TOO_LONG = f"Categoria deve ter no máximo {CATEGORY_MAX_LENGTH} caracteres"
+SKU_TOO_LONG = f"SKU deve ter no máximo {SKU_MAX_LENGTH} caracteres"
+
+LENGTH_RULES = (
+    ('name', NAME_MAX_LENGTH, NAME_TOO_LONG),
+    ('category', CATEGORY_MAX_LENGTH, CATEGORY_TOO_LONG),
+    ('sku', SKU_MAX_LENGTH, SKU_TOO_LONG),
+)
+
+
+def validate_product_data(data):
+    """Valida dados do produto"""
+    errors = []
+
+    if not data.get('name') or not data['name'].strip():
+        errors.append(NAME_REQUIRED)
+
+    try:
+        price = float(data.get('price', 0))
+        if not math.isfinite(price):
+            errors.append(PRICE_INVALID)
+        elif price <= 0:
+            errors.append(PRICE_NOT_POSITIVE)
+    except (ValueError, TypeError):
+        errors.append(PRICE_INVALID)
+
+    if len(data.get('name', '')) > NAME_MAX_LENGTH:
+        errors.append(NAME_TOO_LONG)
+
+    if len(data.get('category', '')) > CATEGORY_MAX_LENGTH:
+        errors.append(CATEGORY_TOO_LONG)
+
+    if len(data.get('sku') or '') > SKU_MAX_LENGTH:
+        errors.append(SKU_TOO_LONG)
+
+    return errors
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _positions(flags):
+    """Índices onde flags é verdadeiro (compress/count rodam em C)"""
+    return list(compress(count(), flags))
+
+
+def parse_prices(values):
+    """float de cada valor, ou None se não é um número finito"""
+    try:
+        # Caminho comum: a coluna inteira converte numa passada só
+        prices = list(map(float, values))
+    except ValueError:
+        prices = list(map(_to_float, values))
+    # A soma acusa nan/inf (filter(None) tira None e 0.0, que não mudam o resultado)
+    if math.isfinite(sum(filter(None, prices))):
+        return prices
+    return [price if price is None or math.isfinite(price) else None for price in prices]
+
+
+def validate_columns(columns, count):
+    """Valida um lote de linhas do CSV dado por colunas ({nome da coluna: [valores]}).
+
+    Retorna (erros, preços): erros é a lista de (índice da linha no lote,
+    coluna, mensagem), na ordem das linhas e, dentro da linha, na ordem de
+    validate_product_data; preços traz o float de cada linha (None se inválido).
+    Cada regra é um map sobre a coluna; só as linhas com erro passam por Python.
+    """
+    empty = ('',) * count
+    names = columns.get('name', empty)
+    errors = [(index, 'name', NAME_REQUIRED) for index in _positions(map(not_, map(str.strip, names)))]
+
+    prices = parse_prices(columns['price']) if 'price' in columns else [0.0] * count
+    invalid = _positions(map(is_, prices, repeat(None)))
+    if invalid:
+        errors.extend((index, 'price', PRICE_INVALID) for index in invalid)
+        not_positive = _positions(price is not None and price <= 0 for price in prices)
+    else:
+        not_positive = _positions(map((0.0).__ge__, prices))
+    errors.extend((index, 'price', PRICE_NOT_POSITIVE) for index in not_positive)
+
+    for column, limit, message in LENGTH_RULES:
+        values = columns.get(column)
+        if values and max(map(len, values)) > limit:
+            errors.extend((index, column, message) for index in _positions(map(limit.__lt__, map(len, values))))
+
+    # Ordena só pela linha (sort estável): dentro dela fica a ordem das regras acima
+    errors.sort(key=itemgetter(0))
+    return errors, prices
@@ -1,7 +1,34 @@
-import csv
-import requests
+import gzip
 import json
-from datetime import datetime
+import shutil
+import tempfile
+
+from backup_auto import login_admin
+
+def enviar_backup(sessao, render_url, backup_path, mode='replace'):
+    """Envia o arquivo de backup (gzip) para /api/admin/restore, que grava tudo numa transação.
+
+    Ids e datas do backup são mantidos; se algum produto for recusado nada
+    muda no servidor. Retorna o relatório da restauração.
+    """
+    with tempfile.TemporaryFile() as corpo:
+        with open(backup_path, 'rb') as f:
+            if backup_path.endswith('.gz'):
+                shutil.copyfileobj(f, corpo)
+            else:
+                with gzip.GzipFile(fileobj=corpo, mode='wb') as compactado:
+                    shutil.copyfileobj(f, compactado)
+        corpo.seek(0)
+        formato = 'ndjson' if backup_path.endswith(('.ndjson', '.ndjson.gz')) else 'json'
+        response = sessao.post(f"{render_url}/api/admin/restore", params={'mode': mode, 'format': formato},
+                               data=corpo, headers={'Content-Type': 'application/octet-stream'},
+                               timeout=(30, 600))
+    if response.status_code != 200:
+        erro = response.json() if response.headers.get('Content-Type', '').startswith('application/json') else {}
+        for item in erro.get('errors', [])[:10]:
+            print(f"   ❌ Produto {item['record']}: {item['error']}")
+        raise Exception(erro.get('error', f"Erro API: {response.status_code}"))
+    return response.json()['restore']
 
 def restaurar_backup():
     """Restaura produtos de um backup"""
@@ -34,18 +61,11 @@ def restaurar_backup():
         # Restaurar para o Render
         render_url = "https://catalogo-online-0i96.onrender.com"
         
-        confirm = input("Restaurar para o Render? (s/n): ").lower()
+        confirm = input("Restaurar para o Render? O catálogo atual será substituído (s/n): ").lower()
         if confirm == 's':
-            for product in data['products']:
-                response = requests.post(
-                    f"{render_url}/api/products",
-                    json=product,
-                    timeout=10
-                )
-                if response.status_code != 201:
-                    print(f"❌ Erro ao restaurar {product['name']}")
-            
-            print("✅ Restauração concluída!")
+            resultado = enviar_backup(login_admin(render_url), render_url, f'backups/{backup_file}')
+            print(f"✅ Restauração concluída! {resultado['restored']} produtos "
+                  f"({resultado['duration_ms']} ms no servidor)")
             
     except Exception as e:
         print(f"❌ Erro: {e}")
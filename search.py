@@ -0,0 +1,391 @@
+import bisect
+import logging
+import re
+import threading
+import unicodedata
+
+from sqlalchemy import text
+
+from models import Product
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Pesos por campo: nome > categoria > descrição
+FIELD_WEIGHTS = (('name', 3.0), ('category', 2.0), ('description', 1.0))
+
+
+def normalize(value):
+    """Remove acentos e converte para minúsculas ("Café" -> "cafe")"""
+    if not value:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', value)
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+
+
+def tokenize(value):
+    return TOKEN_RE.findall(normalize(value))
+
+
+def trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SQLiteFTSSearch:
+    """Busca com FTS5 do SQLite, sincronizada por triggers na tabela product"""
+
+    name = 'sqlite-fts5'
+
+    SETUP_SQL = [
+        """CREATE VIRTUAL TABLE product_fts USING fts5(
+            name, description, category,
+            content='product', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+        """CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN
+            INSERT INTO product_fts(rowid, name, description, category)
+            VALUES (new.id, new.name, new.description, new.category);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN
+            INSERT INTO product_fts(product_fts, rowid, name, description, category)
+            VALUES ('delete', old.id, old.name, old.description, old.category);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE ON product BEGIN
+            INSERT INTO product_fts(product_fts, rowid, name, description, category)
+            VALUES ('delete', old.id, old.name, old.description, old.category);
+            INSERT INTO product_fts(rowid, name, description, category)
+            VALUES (new.id, new.name, new.description, new.category);
+        END""",
+        "INSERT INTO product_fts(product_fts) VALUES ('rebuild')",
+    ]
+
+    def __init__(self, db):
+        self.db = db
+
+    def setup(self):
+        with self.db.engine.begin() as conn:
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_fts'"
+            )).first()
+            if exists:
+                return
+            for statement in self.SETUP_SQL:
+                conn.execute(text(statement))
+        logger.info("🔎 Índice FTS5 de produtos criado")
+
+    @staticmethod
+    def _where(tokens, category):
+        """FROM/WHERE da pesquisa; a categoria é filtrada na mesma consulta, antes do LIMIT"""
+        # O termo exato conta duas vezes no bm25, ficando à frente dos prefixos
+        params = {'match': ' AND '.join(f'("{token}" OR "{token}"*)' for token in tokens)}
+        sql = "FROM product_fts "
+        if category:
+            sql += "JOIN product ON product.id = product_fts.rowid AND product.category = :category "
+            params['category'] = category
+        return sql + "WHERE product_fts MATCH :match", params
+
+    def search(self, query, limit=None, category=None):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        sql, params = self._where(tokens, category)
+        rows = self.db.session.execute(text(
+            f"SELECT product_fts.rowid {sql} "
+            "ORDER BY bm25(product_fts, 3.0, 1.0, 2.0), product_fts.rowid DESC LIMIT :limit"
+        ), {**params, 'limit': -1 if limit is None else limit})
+        return [row[0] for row in rows]
+
+    def count(self, query, category=None):
+        tokens = tokenize(query)
+        if not tokens:
+            return 0
+        sql, params = self._where(tokens, category)
+        return self.db.session.execute(text(f"SELECT count(*) {sql}"), params).scalar()
+
+    def index_product(self, product):
+        pass
+
+    def remove_product(self, product_id):
+        pass
+
+
+class PostgresSearch:
+    """Busca com tsvector (prefixo, ranking) e pg_trgm (similaridade) no PostgreSQL"""
+
+    name = 'postgres-tsvector'
+
+    # Chave arbitrária do advisory lock, evita DDL concorrente entre workers
+    LOCK_KEY = 734001
+
+    # Objetos já criados (por este ou outro worker): no boot só esta consulta roda
+    INSTALLED_SQL = (
+        "SELECT to_regclass('product_search') IS NOT NULL AND EXISTS ("
+        "SELECT 1 FROM pg_trigger WHERE tgname = 'product_search_sync' AND tgrelid = to_regclass('product'))"
+    )
+
+    SETUP_SQL = [
+        "CREATE EXTENSION IF NOT EXISTS unaccent",
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        """CREATE TABLE IF NOT EXISTS product_search (
+            product_id INTEGER PRIMARY KEY REFERENCES product(id) ON DELETE CASCADE,
+            document TEXT NOT NULL,
+            vector TSVECTOR NOT NULL)""",
+        "CREATE INDEX IF NOT EXISTS ix_product_search_vector ON product_search USING GIN (vector)",
+        "CREATE INDEX IF NOT EXISTS ix_product_search_document ON product_search USING GIN (document gin_trgm_ops)",
+        """CREATE OR REPLACE FUNCTION product_search_sync() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO product_search (product_id, document, vector)
+            VALUES (
+                NEW.id,
+                lower(unaccent(concat_ws(' ', NEW.name, NEW.category, NEW.description))),
+                setweight(to_tsvector('simple', lower(unaccent(coalesce(NEW.name, '')))), 'A') ||
+                setweight(to_tsvector('simple', lower(unaccent(coalesce(NEW.category, '')))), 'B') ||
+                setweight(to_tsvector('simple', lower(unaccent(coalesce(NEW.description, '')))), 'C')
+            )
+            ON CONFLICT (product_id) DO UPDATE
+                SET document = EXCLUDED.document, vector = EXCLUDED.vector;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql""",
+        """CREATE TRIGGER product_search_sync
+            AFTER INSERT OR UPDATE OF name, description, category ON product
+            FOR EACH ROW EXECUTE FUNCTION product_search_sync()""",
+        # Indexa produtos que ainda não estão na tabela de busca (dispara o trigger)
+        "UPDATE product SET name = name WHERE id NOT IN (SELECT product_id FROM product_search)",
+    ]
+
+    def __init__(self, db):
+        self.db = db
+
+    def setup(self):
+        # O CREATE TRIGGER trava a tabela product inteira e o backfill a percorre:
+        # só rodam se os objetos ainda não existem, como no SQLiteFTSSearch
+        with self.db.engine.begin() as conn:
+            if conn.execute(text(self.INSTALLED_SQL)).scalar():
+                return
+            conn.execute(text("SELECT pg_advisory_xact_lock(:lock_key)"), {'lock_key': self.LOCK_KEY})
+            # Outro worker pode ter criado tudo enquanto este esperava o lock
+            if conn.execute(text(self.INSTALLED_SQL)).scalar():
+                return
+            for statement in self.SETUP_SQL:
+                conn.execute(text(statement))
+        logger.info("🔎 Índice tsvector/pg_trgm de produtos criado")
+
+    @staticmethod
+    def _where(tokens, category):
+        """FROM/WHERE da pesquisa; a categoria é filtrada na mesma consulta, antes do LIMIT"""
+        params = {'tsquery': ' & '.join(f"{token}:*" for token in tokens), 'plain': ' '.join(tokens)}
+        sql = "FROM product_search s CROSS JOIN to_tsquery('simple', :tsquery) q "
+        if category:
+            sql += "JOIN product p ON p.id = s.product_id AND p.category = :category "
+            params['category'] = category
+        return sql + "WHERE (s.vector @@ q OR s.document % :plain)", params
+
+    def search(self, query, limit=None, category=None):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        sql, params = self._where(tokens, category)
+        rows = self.db.session.execute(text(
+            f"SELECT s.product_id {sql} "
+            "ORDER BY ts_rank(s.vector, q) DESC, similarity(s.document, :plain) DESC, s.product_id DESC "
+            "LIMIT :limit"
+        ), {**params, 'limit': limit})
+        return [row[0] for row in rows]
+
+    def count(self, query, category=None):
+        tokens = tokenize(query)
+        if not tokens:
+            return 0
+        sql, params = self._where(tokens, category)
+        return self.db.session.execute(text(f"SELECT count(*) {sql}"), params).scalar()
+
+    def index_product(self, product):
+        pass
+
+    def remove_product(self, product_id):
+        pass
+
+
+class PythonSearch:
+    """Índice invertido em memória (um por worker), usado quando não há FTS no banco.
+
+    Sincronizado pelas rotas de escrita via index_product/remove_product; se a
+    versão do catálogo mudar por outro caminho (outro worker, importação CSV),
+    o índice é reconstruído na próxima busca.
+    """
+
+    name = 'python'
+
+    def __init__(self, db, current_version):
+        self.db = db
+        self.current_version = current_version
+        self._lock = threading.Lock()
+        self._version = None
+        self._postings = {}
+        self._docs = {}
+        self._categories = {}
+        self._vocab = []
+        self._trigrams = {}
+
+    def setup(self):
+        pass
+
+    def _build(self, version):
+        rows = self.db.session.query(
+            Product.id, Product.name, Product.description, Product.category
+        ).yield_per(5000)
+
+        self._postings = {}
+        self._docs = {}
+        self._categories = {}
+        for row in rows:
+            self._add(row.id, row.name, row.description, row.category)
+        self._refresh_vocab()
+        self._version = version
+        logger.info(f"🔎 Índice de busca em memória reconstruído: {len(self._docs)} produtos")
+
+    def _add(self, product_id, name, description, category, incremental=False):
+        weights = {}
+        for field, weight in FIELD_WEIGHTS:
+            value = {'name': name, 'description': description, 'category': category}[field]
+            for token in tokenize(value):
+                weights[token] = max(weights.get(token, 0.0), weight)
+        self._docs[product_id] = weights
+        self._categories[product_id] = category
+        for token, weight in weights.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = {}
+                if incremental:
+                    bisect.insort(self._vocab, token)
+                    for gram in trigrams(token):
+                        self._trigrams.setdefault(gram, set()).add(token)
+            posting[product_id] = weight
+
+    def _remove(self, product_id):
+        self._categories.pop(product_id, None)
+        for token in self._docs.pop(product_id, {}):
+            posting = self._postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(product_id, None)
+            if not posting:
+                del self._postings[token]
+                position = bisect.bisect_left(self._vocab, token)
+                if position < len(self._vocab) and self._vocab[position] == token:
+                    del self._vocab[position]
+                for gram in trigrams(token):
+                    self._trigrams.get(gram, set()).discard(token)
+
+    def _refresh_vocab(self):
+        self._vocab = sorted(self._postings)
+        self._trigrams = {}
+        for token in self._vocab:
+            for gram in trigrams(token):
+                self._trigrams.setdefault(gram, set()).add(token)
+
+    def _ensure_current(self):
+        version = self.current_version()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._build(version)
+
+    def _expand(self, token):
+        """Termos do vocabulário que casam com o token: prefixo ou, se nenhum, trigramas"""
+        start = bisect.bisect_left(self._vocab, token)
+        matches = []
+        for term in self._vocab[start:]:
+            if not term.startswith(token):
+                break
+            matches.append((term, 1.0 if term == token else 0.8))
+        if matches or len(token) < 3:
+            return matches
+
+        grams = trigrams(token)
+        counts = {}
+        for gram in grams:
+            for term in self._trigrams.get(gram, ()):
+                counts[term] = counts.get(term, 0) + 1
+        similar = []
+        for term, shared in counts.items():
+            similarity = shared / len(grams | trigrams(term))
+            if similarity >= 0.4:
+                similar.append((term, similarity * 0.5))
+        return similar
+
+    def _scores(self, query, category):
+        """{id do produto: pontuação} de todos os produtos que casam (da categoria, se dada)"""
+        tokens = tokenize(query)
+        if not tokens:
+            return {}
+        self._ensure_current()
+
+        scores = None
+        for token in tokens:
+            token_scores = {}
+            for term, factor in self._expand(token):
+                for product_id, weight in self._postings.get(term, {}).items():
+                    score = weight * factor
+                    if score > token_scores.get(product_id, 0.0):
+                        token_scores[product_id] = score
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {pid: scores[pid] + score for pid, score in token_scores.items() if pid in scores}
+            if not scores:
+                return {}
+
+        if category:
+            categories = self._categories
+            scores = {pid: score for pid, score in scores.items() if categories.get(pid) == category}
+        return scores
+
+    def search(self, query, limit=None, category=None):
+        ranked = sorted(self._scores(query, category).items(), key=lambda item: (-item[1], -item[0]))
+        return [product_id for product_id, _ in ranked[:limit]]
+
+    def count(self, query, category=None):
+        return len(self._scores(query, category))
+
+    def _apply(self, change):
+        """Aplica uma alteração feita por este worker, se for a única desde o último build"""
+        with self._lock:
+            if self._version is None:
+                return
+            version = self.current_version()
+            if version != self._version + 1:
+                # Houve outras escritas no meio; a próxima busca reconstrói o índice
+                return
+            change()
+            self._version = version
+
+    def index_product(self, product):
+        def change():
+            self._remove(product.id)
+            self._add(product.id, product.name, product.description, product.category, incremental=True)
+        self._apply(change)
+
+    def remove_product(self, product_id):
+        self._apply(lambda: self._remove(product_id))
+
+
+def create_search_engine(db, backend, current_version):
+    """Escolhe o mecanismo de busca conforme o banco, com fallback em Python"""
+    dialect = db.engine.dialect.name
+    candidates = []
+    if backend in ('auto', 'sqlite-fts5') and dialect == 'sqlite':
+        candidates.append(SQLiteFTSSearch(db))
+    if backend in ('auto', 'postgres-tsvector') and dialect == 'postgresql':
+        candidates.append(PostgresSearch(db))
+
+    for engine in candidates:
+        try:
+            engine.setup()
+            return engine
+        except Exception as e:
+            logger.warning(f"⚠️ Busca {engine.name} indisponível, usando fallback: {e}")
+
+    return PythonSearch(db, current_version)
@@ -0,0 +1,266 @@
+# snapshot.py
+"""Snapshot consistente do banco (todas as tabelas) e das imagens num arquivo só.
+
+- SQLite: API de backup do sqlite3. A cópia é feita com o app no ar e
+  corresponde ao banco num instante só.
+- PostgreSQL: COPY ... TO STDOUT de cada tabela, todas na mesma transação
+  REPEATABLE READ somente leitura, ou seja, o mesmo instante para todas.
+- uploads/: tar.gz montado numa thread, em paralelo com o banco. A pasta
+  oculta das importações em andamento fica de fora.
+
+O resultado é um tar sem compressão, porque os membros já vêm comprimidos.
+Ele contém database.sqlite3.gz (ou database/<tabela>.csv.gz), uploads.tar.gz
+e, por último, manifest.json. O manifesto traz tamanho e sha256 de cada
+membro, linhas por tabela e a vazão em MB/s.
+
+Uso:
+    python snapshot.py [--output DIR] [--no-uploads]
+    python snapshot.py --verify snapshots/snapshot_20240101_120000.tar
+"""
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = 'snapshots'
+MANIFEST_NAME = 'manifest.json'
+# O banco comprime bem; as imagens já são JPEG, então o gzip só empacota (nível 1, rápido)
+DATABASE_GZIP_LEVEL = 6
+UPLOADS_GZIP_LEVEL = 1
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class _HashingReader:
+    """Arquivo de entrada que calcula o sha256 do que é lido (o tar lê cada membro uma vez só)"""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.sha256.update(data)
+        return data
+
+
+class _CountingWriter:
+    """Conta os bytes (sem compressão) que o COPY escreve"""
+
+    def __init__(self, f):
+        self.f = f
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return self.f.write(data)
+
+
+def _throughput(size, seconds):
+    return {'bytes': size, 'seconds': round(seconds, 3),
+            'mb_per_s': round(size / 1024 / 1024 / seconds, 1) if seconds else None}
+
+
+def snapshot_sqlite(db_path, workdir):
+    """Copia o banco SQLite pela API de backup e comprime a cópia.
+
+    Retorna ({membro: caminho}, informações do banco, bytes lidos).
+    """
+    copy_path = os.path.join(workdir, 'database.sqlite3')
+    source = sqlite3.connect(Path(os.path.abspath(db_path)).as_uri() + '?mode=ro', uri=True)
+    target = sqlite3.connect(copy_path)
+    try:
+        # Um passo só (pages=-1): a cópia inteira sai de uma leitura consistente
+        source.backup(target)
+        tables = [row[0] for row in target.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        )]
+        rows = {table: target.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables}
+    finally:
+        target.close()
+        source.close()
+
+    size = os.path.getsize(copy_path)
+    member = copy_path + '.gz'
+    with open(copy_path, 'rb') as f, gzip.open(member, 'wb', compresslevel=DATABASE_GZIP_LEVEL) as out:
+        shutil.copyfileobj(f, out, COPY_CHUNK_SIZE)
+    os.remove(copy_path)
+    return {'database.sqlite3.gz': member}, {'dialect': 'sqlite', 'tables': rows}, size
+
+
+def snapshot_postgres(engine, workdir):
+    """COPY de cada tabela do schema public, todas numa transação REPEATABLE READ.
+
+    Retorna ({membro: caminho}, informações do banco, bytes lidos). As
+    sequências vão no manifesto, para a restauração continuar a numeração.
+    """
+    members = {}
+    rows = {}
+    size = 0
+    os.makedirs(os.path.join(workdir, 'database'), exist_ok=True)
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        # Primeiro comando da transação: todas as leituras abaixo veem o mesmo instante
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        cursor.execute("SELECT tablename FROM pg_tables WHERE schemaname = 'public' ORDER BY tablename")
+        tables = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT sequencename, last_value FROM pg_sequences WHERE schemaname = 'public'")
+        sequences = dict(cursor.fetchall())
+        for table in tables:
+            name = f'database/{table}.csv.gz'
+            path = os.path.join(workdir, name)
+            with gzip.open(path, 'wb', compresslevel=DATABASE_GZIP_LEVEL) as out:
+                writer = _CountingWriter(out)
+                cursor.copy_expert(f'COPY "{table}" TO STDOUT WITH (FORMAT csv, HEADER)', writer)
+            rows[table] = cursor.rowcount
+            size += writer.size
+            members[name] = path
+        raw.rollback()
+    finally:
+        raw.close()
+    return members, {'dialect': 'postgresql', 'tables': rows, 'sequences': sequences}, size
+
+
+def archive_uploads(upload_folder, path):
+    """tar.gz de uploads/ (sem pastas ocultas). Retorna (informações, vazão)"""
+    started = time.perf_counter()
+    files = 0
+    size = 0
+    skipped = []
+    with open(path, 'wb') as f, \
+            gzip.GzipFile(fileobj=f, mode='wb', compresslevel=UPLOADS_GZIP_LEVEL) as compressed, \
+            tarfile.open(fileobj=compressed, mode='w|') as tar:
+        for root, dirs, names in os.walk(upload_folder):
+            dirs[:] = sorted(name for name in dirs if not name.startswith('.'))
+            for name in sorted(names):
+                full_path = os.path.join(root, name)
+                arcname = os.path.relpath(full_path, upload_folder)
+                try:
+                    image = open(full_path, 'rb')
+                except OSError as e:
+                    # Removido durante a cópia; aberto, o arquivo pode sumir que a leitura continua
+                    skipped.append(arcname)
+                    logger.warning(f"⚠️ Arquivo ignorado no snapshot: {full_path} ({e})")
+                    continue
+                with image:
+                    info = tar.gettarinfo(arcname=arcname, fileobj=image)
+                    tar.addfile(info, image)
+                files += 1
+                size += info.size
+    return {'files': files, 'skipped': skipped}, _throughput(size, time.perf_counter() - started)
+
+
+def _add_member(tar, name, path):
+    """Copia o arquivo para o tar calculando o sha256 no caminho"""
+    info = tar.gettarinfo(path, arcname=name)
+    with open(path, 'rb') as f:
+        reader = _HashingReader(f)
+        tar.addfile(info, reader)
+    return {'size': info.size, 'sha256': reader.sha256.hexdigest()}
+
+
+def create_snapshot(engine, upload_folder, output_dir=SNAPSHOT_DIR, include_uploads=True):
+    """Gera output_dir/snapshot_<data>.tar. Retorna (caminho, manifesto)"""
+    started = time.perf_counter()
+    created_at = datetime.utcnow()
+    os.makedirs(output_dir, exist_ok=True)
+    archive_path = os.path.join(output_dir, f"snapshot_{created_at.strftime('%Y%m%d_%H%M%S')}.tar")
+    manifest = {'created_at': created_at.isoformat(), 'files': {}, 'throughput': {}}
+
+    with tempfile.TemporaryDirectory(dir=output_dir, prefix='.snapshot-') as workdir:
+        uploads_path = os.path.join(workdir, 'uploads.tar.gz')
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # As imagens vão sendo comprimidas enquanto o banco é copiado (zlib e E/S soltam o GIL)
+            uploads = None
+            if include_uploads and os.path.isdir(upload_folder):
+                uploads = executor.submit(archive_uploads, upload_folder, uploads_path)
+
+            db_started = time.perf_counter()
+            if engine.dialect.name == 'postgresql':
+                members, manifest['database'], db_size = snapshot_postgres(engine, workdir)
+            else:
+                members, manifest['database'], db_size = snapshot_sqlite(engine.url.database, workdir)
+            manifest['throughput']['database'] = _throughput(db_size, time.perf_counter() - db_started)
+
+            total_size = db_size
+            if uploads is not None:
+                manifest['uploads'], manifest['throughput']['uploads'] = uploads.result()
+                members['uploads.tar.gz'] = uploads_path
+                total_size += manifest['throughput']['uploads']['bytes']
+
+        partial = archive_path + '.part'
+        with tarfile.open(partial, 'w') as tar:
+            for name, path in members.items():
+                manifest['files'][name] = _add_member(tar, name, path)
+            manifest['throughput']['total'] = _throughput(total_size, time.perf_counter() - started)
+            # Manifesto por último: um arquivo sem ele ficou incompleto
+            data = json.dumps(manifest, indent=2, ensure_ascii=False).encode('utf-8')
+            info = tarfile.TarInfo(MANIFEST_NAME)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+        os.replace(partial, archive_path)
+    return archive_path, manifest
+
+
+def verify_snapshot(archive_path):
+    """Confere tamanho e sha256 de cada membro contra o manifesto. Retorna a lista de problemas"""
+    problems = []
+    with tarfile.open(archive_path, 'r') as tar:
+        try:
+            manifest = json.load(tar.extractfile(MANIFEST_NAME))
+        except KeyError:
+            return [f"{MANIFEST_NAME} ausente: snapshot incompleto"]
+        for name, expected in manifest['files'].items():
+            try:
+                f = tar.extractfile(name)
+            except KeyError:
+                problems.append(f"{name}: ausente")
+                continue
+            digest = hashlib.sha256()
+            size = 0
+            for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                size += len(chunk)
+            if size != expected['size'] or digest.hexdigest() != expected['sha256']:
+                problems.append(f"{name}: checksum não confere")
+    return problems
+
+
+if __name__ == '__main__':
+    if '--verify' in sys.argv:
+        path = sys.argv[sys.argv.index('--verify') + 1]
+        problems = verify_snapshot(path)
+        for problem in problems:
+            print(f"❌ {problem}")
+        print("✅ Snapshot íntegro" if not problems else f"❌ {len(problems)} problemas")
+        sys.exit(1 if problems else 0)
+
+    from app import app, db
+
+    output_dir = sys.argv[sys.argv.index('--output') + 1] if '--output' in sys.argv else SNAPSHOT_DIR
+    with app.app_context():
+        path, manifest = create_snapshot(db.engine, app.config['UPLOAD_FOLDER'], output_dir,
+                                         include_uploads='--no-uploads' not in sys.argv)
+    tables = manifest['database']['tables']
+    print(f"✅ Snapshot: {path}")
+    print(f"   🗄️  {manifest['database']['dialect']}: {len(tables)} tabelas, "
+          f"{tables.get('product', 0)} produtos, {tables.get('user', 0)} usuários")
+    if 'uploads' in manifest:
+        print(f"   🖼️  {manifest['uploads']['files']} arquivos de uploads")
+    for part, stats in manifest['throughput'].items():
+        print(f"   ⏱️  {part}: {stats['bytes'] / 1024 / 1024:.1f} MB em {stats['seconds']:.2f}s "
+              f"({stats['mb_per_s']} MB/s)")
@@ -256,7 +256,7 @@ async function showSection(sectionName) {
 // Função para carregar estatísticas do dashboard
 async function loadDashboardStats() {
     try {
-        const response = await fetch(`${API_BASE}/products`);
+        const response = await fetch(`${API_BASE}/products?all=1`);
         const products = await response.json();
         
         const totalProducts = products.length;
@@ -320,7 +320,7 @@ async function loadProductsTable() {
     try {
         showTableLoading();
         
-        const response = await fetch(`${API_BASE}/products`);
+        const response = await fetch(`${API_BASE}/products?all=1`);
         
         if (!response.ok) {
             throw new Error(`Erro HTTP: ${response.status}`);
@@ -512,9 +512,9 @@ async function removeProductImage(productId) {
 }
 
 // Carregar imagens ausentes
-async function loadMissingImages() {
+async function loadMissingImages(refresh = false) {
     try {
-        const response = await fetch(`${API_BASE}/admin/missing-images`, {
+        const response = await fetch(`${API_BASE}/admin/missing-images${refresh ? '?refresh=1' : ''}`, {
             credentials: 'include'
         });
         
@@ -540,6 +540,11 @@ function displayMissingImages(data) {
         countElement.textContent = data.missing_count;
     }
     
+    const orphanElement = document.getElementById('orphan-images-info');
+    if (orphanElement && data.report) {
+        orphanElement.textContent = `${data.report.orphan_count} arquivos órfãos (${(data.report.orphan_bytes / 1024 / 1024).toFixed(1)} MB)`;
+    }
+    
     if (data.missing_count === 0) {
         container.innerHTML = `
             <div class="alert alert-success">
@@ -600,6 +605,29 @@ async function removeMissingImage(productId) {
     }
 }
 
+// Remover arquivos que nenhum produto usa
+async function collectOrphanImages() {
+    if (!confirm('Remover do disco os arquivos de imagem que nenhum produto usa?')) return;
+    
+    try {
+        const response = await fetch(`${API_BASE}/admin/images/gc`, {
+            method: 'POST',
+            credentials: 'include'
+        });
+        
+        const result = await response.json();
+        
+        if (response.ok) {
+            showMessage(`${result.removed_count} arquivos removidos (${(result.freed_bytes / 1024 / 1024).toFixed(1)} MB liberados)`, 'success');
+            loadMissingImages();
+        } else {
+            throw new Error(result.error);
+        }
+    } catch (error) {
+        showMessage('Erro: ' + error.message, 'error');
+    }
+}
+
 // Corrigir URLs de imagem
 async function fixImageUrls() {
     if (!confirm('Tem certeza que deseja corrigir todas as URLs de imagem no banco de dados?')) return;
@@ -624,6 +652,86 @@ async function fixImageUrls() {
     }
 }
 
+// Resultado do upload de imagens em lote
+function displayBatchResults(result) {
+    const container = document.getElementById('batch-images-results');
+    const badges = { done: 'bg-success', queued: 'bg-secondary', failed: 'bg-danger' };
+    
+    container.innerHTML = `
+        <ul class="list-group">
+            ${Object.entries(result.results).map(([name, item]) => `
+                <li class="list-group-item d-flex justify-content-between align-items-center">
+                    <span>
+                        ${escapeHtml(name)}
+                        ${item.product_id ? `<small class="text-muted">→ produto #${item.product_id}</small>` : ''}
+                        ${item.error || item.match_error ? `<small class="text-danger">${escapeHtml(item.error || item.match_error)}</small>` : ''}
+                    </span>
+                    <span class="badge ${badges[item.status] || 'bg-secondary'}">${item.status}</span>
+                </li>
+            `).join('')}
+        </ul>
+    `;
+}
+
+// Acompanhar importação de CSV em segundo plano
+async function pollImportJob(statusUrl) {
+    while (true) {
+        const response = await fetch(statusUrl, { credentials: 'include' });
+        const job = await response.json();
+        if (!response.ok) {
+            throw new Error(job.error || 'Erro ao consultar importação');
+        }
+        
+        displayImportProgress(job);
+        if (job.status === 'done' || job.status === 'failed') {
+            return job;
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+}
+
+function displayImportProgress(job) {
+    const container = document.getElementById('import-progress');
+    const percent = Math.round(job.progress * 100);
+    const bar = job.status === 'failed' ? 'bg-danger' : (job.status === 'done' ? 'bg-success' : 'progress-bar-striped progress-bar-animated');
+    const eta = job.eta_seconds != null ? ` · faltam ~${job.eta_seconds}s` : '';
+    
+    container.innerHTML = `
+        <div class="progress mb-2">
+            <div class="progress-bar ${bar}" role="progressbar" style="width: ${percent}%">${percent}%</div>
+        </div>
+        <small class="text-muted">
+            ${job.rows_read} linhas lidas · ${job.created} produtos criados · ${job.updated} atualizados · ${job.error_count} erros${eta}
+        </small>
+        ${job.error ? `<div class="text-danger small">${escapeHtml(job.error)}</div>` : ''}
+        ${job.errors_url ? `<div><a href="${job.errors_url}" class="small"><i class="fas fa-download"></i> Baixar relatório de erros</a></div>` : ''}
+    `;
+}
+
+// Simulação da importação: o que seria criado/alterado
+function displayImportDiff(report) {
+    const container = document.getElementById('import-progress');
+    const rows = report.changes.map(change => `
+        <tr>
+            <td>${change.line}</td>
+            <td>#${change.product_id}</td>
+            <td>${Object.entries(change.changes).map(([column, [before, after]]) =>
+                `<code>${escapeHtml(column)}</code>: ${escapeHtml(String(before ?? ''))} → <strong>${escapeHtml(String(after ?? ''))}</strong>`
+            ).join('<br>')}</td>
+        </tr>
+    `).join('');
+    
+    container.innerHTML = `
+        <div class="small mb-2">
+            <span class="badge bg-success">${report.created} novos</span>
+            <span class="badge bg-warning text-dark">${report.updated} alterados</span>
+            <span class="badge bg-secondary">${report.unchanged} sem alteração</span>
+            <span class="badge bg-danger">${report.error_count} erros</span>
+        </div>
+        ${rows ? `<table class="table table-sm small"><thead><tr><th>Linha</th><th>Produto</th><th>Alterações</th></tr></thead><tbody>${rows}</tbody></table>` : ''}
+    `;
+}
+
 // Editar produto
 async function editProduct(productId) {
     try {
@@ -874,6 +982,60 @@ document.addEventListener('DOMContentLoaded', async function() {
             });
         }
         
+        // Adicionar evento ao formulário de upload de imagens em lote
+        const batchImagesForm = document.getElementById('batch-images-form');
+        if (batchImagesForm) {
+            batchImagesForm.addEventListener('submit', async function(e) {
+                e.preventDefault();
+                
+                const submitButton = this.querySelector('button[type="submit"]');
+                const originalText = submitButton.innerHTML;
+                
+                try {
+                    submitButton.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Enviando...';
+                    submitButton.disabled = true;
+                    
+                    const files = document.getElementById('batch-images-files').files;
+                    if (!files.length) {
+                        throw new Error('Selecione ao menos um arquivo');
+                    }
+                    
+                    const formData = new FormData();
+                    for (const file of files) {
+                        formData.append('files', file);
+                    }
+                    formData.append('match', document.getElementById('batch-images-match').value);
+                    
+                    const response = await fetch(`${API_BASE}/upload/batch`, {
+                        method: 'POST',
+                        credentials: 'include',
+                        body: formData
+                    });
+                    
+                    const result = await response.json();
+                    
+                    if (!response.ok) {
+                        throw new Error(result.error || 'Erro no upload em lote');
+                    }
+                    
+                    displayBatchResults(result);
+                    showMessage(`${result.done} imagens processadas, ${result.failed} com erro, ${result.matched} produtos atualizados`, result.failed ? 'warning' : 'success');
+                    this.reset();
+                    if (result.matched) {
+                        loadProductsTable();
+                        loadMissingImages();
+                    }
+                    
+                } catch (error) {
+                    console.error('Erro:', error);
+                    showMessage('Erro no upload em lote: ' + error.message, 'error');
+                } finally {
+                    submitButton.innerHTML = originalText;
+                    submitButton.disabled = false;
+                }
+            });
+        }
+        
         // Adicionar evento ao formulário de importação
         const importForm = document.getElementById('import-form');
         if (importForm) {
@@ -895,7 +1057,12 @@ document.addEventListener('DOMContentLoaded', async function() {
                     const formData = new FormData();
                     formData.append('file', file);
                     
-                    const response = await fetch(`${API_BASE}/upload`, {
+                    const [mode, key] = document.getElementById('import-mode').value.split(':');
+                    const params = new URLSearchParams({ mode });
+                    if (key) params.set('key', key);
+                    if (document.getElementById('import-dry-run').checked) params.set('dry_run', '1');
+                    
+                    const response = await fetch(`${API_BASE}/upload?${params}`, {
                         method: 'POST',
                         credentials: 'include',
                         body: formData
@@ -903,7 +1070,20 @@ document.addEventListener('DOMContentLoaded', async function() {
                     
                     const result = await response.json();
                     
-                    if (response.ok) {
+                    if (response.status === 202) {
+                        document.getElementById('import-form').reset();
+                        const job = await pollImportJob(result.status_url);
+                        const message = `${job.created} produtos criados, ${job.updated} atualizados, ${job.error_count} erros`;
+                        if (job.status === 'failed') {
+                            showMessage(`Importação interrompida: ${job.error}. ${message}`, 'error');
+                        } else {
+                            showMessage(message, job.error_count ? 'warning' : 'success');
+                        }
+                        loadProductsTable();
+                    } else if (response.ok && result.import && result.import.dry_run) {
+                        displayImportDiff(result.import);
+                        showMessage(result.message, 'info');
+                    } else if (response.ok) {
                         showMessage(result.message, 'success');
                         document.getElementById('import-form').reset();
                         loadProductsTable();
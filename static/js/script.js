@@ -4,21 +4,35 @@ const API_BASE = window.location.origin + '/api';
 // Elementos DOM
 const productsContainer = document.getElementById('products-container');
 const categoryFilter = document.querySelector('.category-filter');
+const PAGE_SIZE = 24;
+let currentCategory = 'all';
+let nextPageToken = null;
+
+// Buscar uma página de produtos
+async function fetchProductsPage(category, after = null) {
+    const params = new URLSearchParams({ limit: PAGE_SIZE });
+    if (category !== 'all') params.set('category', category);
+    if (after) params.set('after', after);
+    
+    const response = await fetch(`${API_BASE}/products?${params}`);
+    
+    if (!response.ok) {
+        throw new Error(`Erro HTTP: ${response.status}`);
+    }
+    
+    nextPageToken = response.headers.get('X-Next-Page-Token');
+    return response.json();
+}
 
 // Carregar produtos
 async function loadProducts(category = 'all') {
     try {
         showLoading();
+        currentCategory = category;
         
-        const response = await fetch(`${API_BASE}/products`);
-        
-        if (!response.ok) {
-            throw new Error(`Erro HTTP: ${response.status}`);
-        }
-        
-        const products = await response.json();
+        const products = await fetchProductsPage(category);
         displayProducts(products, category);
-        updateCategoryFilter(products);
+        updateLoadMoreButton();
         
     } catch (error) {
         console.error('Erro ao carregar produtos:', error);
@@ -26,6 +40,39 @@ async function loadProducts(category = 'all') {
     }
 }
 
+// Carregar a próxima página e adicionar ao final da lista
+async function loadMoreProducts() {
+    if (!nextPageToken) return;
+    
+    try {
+        const products = await fetchProductsPage(currentCategory, nextPageToken);
+        products.forEach(product => {
+            productsContainer.appendChild(createProductCard(product));
+        });
+        updateLoadMoreButton();
+    } catch (error) {
+        console.error('Erro ao carregar mais produtos:', error);
+    }
+}
+
+// Botão "Carregar mais" no final da lista
+function updateLoadMoreButton() {
+    const existing = document.getElementById('load-more-col');
+    if (existing) existing.remove();
+    
+    if (!nextPageToken) return;
+    
+    const col = document.createElement('div');
+    col.id = 'load-more-col';
+    col.className = 'col-12 text-center mb-4';
+    col.innerHTML = `
+        <button class="btn btn-outline-primary" onclick="loadMoreProducts()">
+            <i class="fas fa-plus"></i> Carregar mais
+        </button>
+    `;
+    productsContainer.appendChild(col);
+}
+
 // Mostrar loading
 function showLoading() {
     productsContainer.innerHTML = `
@@ -91,6 +138,8 @@ function createProductCard(product) {
     col.innerHTML = `
         <div class="card product-card h-100">
             <img src="${imageUrl}" 
+                 ${product.image_srcset ? `srcset="${product.image_srcset['image/jpeg']}" sizes="(min-width: 1200px) 25vw, (min-width: 992px) 33vw, (min-width: 768px) 50vw, 100vw"` : ''}
+                 loading="lazy"
                  class="card-img-top product-image" 
                  alt="${product.name}"
                  onerror="this.src='https://via.placeholder.com/300x200?text=Imagem+Não+Carregada'">
@@ -112,18 +161,27 @@ function createProductCard(product) {
 }
 
 // Atualizar filtro de categorias
-function updateCategoryFilter(products) {
-    const categories = [...new Set(products.map(p => p.category).filter(c => c))];
+async function updateCategoryFilter() {
+    let facets = [];
+    try {
+        const response = await fetch(`${API_BASE}/categories/facets`);
+        if (response.ok) {
+            facets = await response.json();
+        }
+    } catch (error) {
+        console.error('Erro ao carregar categorias:', error);
+    }
     
     // Limpar botões existentes (exceto "Todos")
     const existingButtons = categoryFilter.querySelectorAll('button:not([data-category="all"])');
     existingButtons.forEach(btn => btn.remove());
     
-    categories.forEach(category => {
+    facets.forEach(facet => {
+        const category = facet.category;
         const button = document.createElement('button');
         button.type = 'button';
         button.className = 'btn btn-outline-primary ms-1 mb-1';
-        button.textContent = category;
+        button.textContent = `${category} (${facet.product_count})`;
         button.setAttribute('data-category', category);
         button.onclick = (e) => filterByCategory(category, e);
         
@@ -200,6 +258,7 @@ function escapeHtml(unsafe) {
 // Inicializar
 document.addEventListener('DOMContentLoaded', () => {
     loadProducts();
+    updateCategoryFilter();
     
     // Configurar botão "Todos"
     const allButton = document.querySelector('[data-category="all"]');
@@ -0,0 +1,221 @@
+import os
+import re
+import threading
+import time
+
+# Nomes endereçados por conteúdo ("ab/<hash>.jpg" e derivados): o conteúdo nunca muda
+CONTENT_NAME_RE = re.compile(r'^(?P<shard>[0-9a-f]{2})/(?P=shard)[0-9a-f]{14,62}(-\d+w)?\.[a-z0-9]+$')
+
+# Derivados de uma imagem "abc_foto.jpg": "abc_foto-320w.jpg", "abc_foto-320w.webp"...
+VARIANT_RE = re.compile(r'^(?P<stem>.+)-(?P<width>\d+)w\.(?P<ext>jpg|webp)$')
+
+
+def content_name(digest, ext='jpg'):
+    """Nome endereçado por conteúdo, com shard pelo prefixo do hash ("ab/abcdef....jpg")"""
+    return f"{digest[:2]}/{digest}.{ext}"
+
+
+def is_content_name(name):
+    return CONTENT_NAME_RE.match(name) is not None
+
+
+def variant_name(base_name, width, ext):
+    """Nome do derivado de ``base_name`` com a largura e extensão dadas"""
+    return f"{os.path.splitext(base_name)[0]}-{width}w.{ext}"
+
+
+def parse_variant(name):
+    """(nome da imagem base, largura, extensão) se ``name`` for um derivado, senão None"""
+    match = VARIANT_RE.match(name)
+    if match is None:
+        return None
+    return match.group('stem') + '.jpg', int(match.group('width')), match.group('ext')
+
+
+def _group_variants(names):
+    variants = {}
+    for name in names:
+        parsed = parse_variant(name)
+        if parsed:
+            base_name, width, ext = parsed
+            variants.setdefault(base_name, set()).add((width, ext))
+    return {base_name: tuple(sorted(items)) for base_name, items in variants.items()}
+
+
+class UploadIndex:
+    """Índice em memória dos arquivos da pasta de uploads.
+
+    Cada worker do gunicorn mantém sua própria cópia. As rotas que criam ou
+    removem arquivos atualizam o índice diretamente; alterações feitas por
+    outros workers são detectadas pelo mtime dos diretórios (a raiz e cada
+    subpasta de shard), verificado no máximo uma vez a cada
+    ``rescan_interval`` segundos. Só os diretórios alterados são relidos.
+
+    Os nomes são relativos à pasta de uploads ("ab/abcdef.jpg"); arquivos
+    antigos, na raiz, continuam sem prefixo. Pastas ocultas (staging) são
+    ignoradas.
+
+    Também agrupa os derivados responsivos por imagem base, para montar o
+    srcset sem tocar no disco.
+    """
+
+    def __init__(self, folder, rescan_interval=10):
+        self.folder = folder
+        self.rescan_interval = rescan_interval
+        self._names = set()
+        self._variants = {}
+        self._dirs = {}  # subpasta relativa ('' = raiz) -> (mtime_ns, nomes)
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+
+    def _scan(self, subdir):
+        """(mtime, arquivos, subpastas) de uma pasta; mtime None se ela não existe"""
+        path = os.path.join(self.folder, subdir) if subdir else self.folder
+        prefix = subdir + '/' if subdir else ''
+        files, subdirs = set(), []
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_file():
+                        files.add(prefix + entry.name)
+                    elif not subdir and entry.is_dir():
+                        subdirs.append(entry.name)
+        except FileNotFoundError:
+            mtime = None
+        return mtime, files, subdirs
+
+    def _replace_dir(self, subdir, mtime, files):
+        """Troca os nomes de uma pasta no índice (chamar com o lock)"""
+        _, old_files = self._dirs.get(subdir, (None, set()))
+        self._names -= old_files
+        self._names |= files
+        for base_name in _group_variants(old_files):
+            self._variants.pop(base_name, None)
+        self._variants.update(_group_variants(files))
+        if mtime is None:
+            self._dirs.pop(subdir, None)
+        else:
+            self._dirs[subdir] = (mtime, files)
+
+    def build(self):
+        """Lê a pasta de uploads (e as subpastas) e recria o índice"""
+        mtime, files, subdirs = self._scan('')
+        scanned = [('', mtime, files)]
+        for subdir in subdirs:
+            scanned.append((subdir,) + self._scan(subdir)[:2])
+
+        names, variants, dirs = set(), {}, {}
+        for subdir, mtime, files in scanned:
+            names |= files
+            variants.update(_group_variants(files))
+            if mtime is not None:
+                dirs[subdir] = (mtime, files)
+
+        with self._lock:
+            self._names = names
+            self._variants = variants
+            self._dirs = dirs
+            self._next_check = time.monotonic() + self.rescan_interval
+        return len(names)
+
+    def _maybe_rescan(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.rescan_interval
+
+        changed = []
+        for subdir, (mtime, _) in list(self._dirs.items()):
+            path = os.path.join(self.folder, subdir) if subdir else self.folder
+            try:
+                current = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                current = None
+            if current != mtime:
+                changed.append(subdir)
+        if not self._dirs:
+            changed.append('')
+
+        for subdir in changed:
+            mtime, files, subdirs = self._scan(subdir)
+            with self._lock:
+                self._replace_dir(subdir, mtime, files)
+            # Subpastas criadas por outro worker mudam o mtime da raiz
+            for new_subdir in subdirs:
+                if new_subdir not in self._dirs:
+                    mtime, files, _ = self._scan(new_subdir)
+                    with self._lock:
+                        self._replace_dir(new_subdir, mtime, files)
+
+    def __contains__(self, name):
+        self._maybe_rescan()
+        return name in self._names
+
+    def snapshot(self):
+        """(nomes, derivados por imagem base), para consultas em lote sem repetir a verificação"""
+        self._maybe_rescan()
+        return self._names, self._variants
+
+    def variants(self, base_name):
+        """Derivados existentes de uma imagem: tupla ordenada de (largura, extensão)"""
+        self._maybe_rescan()
+        return self._variants.get(base_name, ())
+
+    def webp_for(self, name):
+        """Versão WebP de uma imagem JPEG (base ou derivado), se existir"""
+        self._maybe_rescan()
+        parsed = parse_variant(name)
+        if parsed:
+            candidate = os.path.splitext(name)[0] + '.webp'
+            return candidate if parsed[2] == 'jpg' and candidate in self._names else None
+        widths = [width for width, ext in self._variants.get(name, ()) if ext == 'webp']
+        return variant_name(name, max(widths), 'webp') if widths else None
+
+    def related_names(self, base_name):
+        """A imagem e todos os seus derivados (para remoção)"""
+        return [base_name] + [variant_name(base_name, width, ext) for width, ext in self.variants(base_name)]
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, name):
+        """Registra um arquivo recém-gravado"""
+        parsed = parse_variant(name)
+        with self._lock:
+            self._names.add(name)
+            subdir = os.path.dirname(name)
+            if subdir in self._dirs:
+                self._dirs[subdir][1].add(name)
+            if parsed:
+                base_name, width, ext = parsed
+                items = set(self._variants.get(base_name, ()))
+                items.add((width, ext))
+                self._variants[base_name] = tuple(sorted(items))
+
+    def discard(self, name):
+        """Remove um arquivo apagado do índice"""
+        parsed = parse_variant(name)
+        with self._lock:
+            self._names.discard(name)
+            subdir = os.path.dirname(name)
+            if subdir in self._dirs:
+                self._dirs[subdir][1].discard(name)
+            if parsed:
+                base_name, width, ext = parsed
+                items = tuple(item for item in self._variants.get(base_name, ()) if item != (width, ext))
+                if items:
+                    self._variants[base_name] = items
+                else:
+                    self._variants.pop(base_name, None)
+
+    def refresh(self, name):
+        """Confere um único arquivo no disco e atualiza o índice"""
+        exists = os.path.isfile(os.path.join(self.folder, name))
+        if exists:
+            self.add(name)
+        else:
+            self.discard(name)
+        return exists